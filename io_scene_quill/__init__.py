@@ -60,6 +60,26 @@ class ImportQuill(bpy.types.Operator, ImportHelper):
         default=True,
     )
 
+    use_frame_range: BoolProperty(
+        name="Frame Range",
+        description="Only import the drawings visible in a range of frames",
+        default=False,
+    )
+
+    frame_range_start: IntProperty(
+        name="Start",
+        description="First frame of the range to import",
+        min=0,
+        default=0,
+    )
+
+    frame_range_end: IntProperty(
+        name="End",
+        description="Last frame of the range to import",
+        min=0,
+        default=250,
+    )
+
     convert_paint: EnumProperty(
         name="Convert to",
         items=(("MESH", "Mesh", ""),
@@ -139,6 +159,11 @@ class QUILL_PT_import_include(bpy.types.Panel):
         sublayout = layout.column(heading="Limit to")
         sublayout.prop(operator, "only_visible")
         sublayout.prop(operator, "only_non_empty")
+        sublayout.prop(operator, "use_frame_range")
+        sublayout = layout.column(align=True)
+        sublayout.enabled = operator.use_frame_range
+        sublayout.prop(operator, "frame_range_start")
+        sublayout.prop(operator, "frame_range_end")
 
 
 class QUILL_PT_import_paint(bpy.types.Panel):
@@ -232,6 +257,47 @@ class ExportQuill(bpy.types.Operator, ExportHelper):
         default=True,
     )
 
+    greasepencil_point_reduction: EnumProperty(
+        name="Point reduction",
+        items=(("NONE", "None", "Export all the points of the strokes"),
+               ("RESAMPLE", "Resample", "Resample the strokes to a target spacing between points"),
+               ("SIMPLIFY", "Simplify", "Remove the points that can be interpolated from their neighbors within a tolerance")),
+        description="Reduce the number of points of dense Grease Pencil strokes",
+        default="NONE",
+    )
+
+    greasepencil_point_spacing: FloatProperty(
+        name="Spacing",
+        description="Target distance between points when resampling strokes. Strokes that are already sparser are not changed",
+        min=0.0001, max=1.0,
+        soft_min=0.001, soft_max=0.1,
+        default=0.005,
+        precision=4,
+    )
+
+    greasepencil_simplify_tolerance: FloatProperty(
+        name="Tolerance",
+        description="Maximum position and width error allowed when simplifying strokes",
+        min=0.0, max=1.0,
+        soft_min=0.0, soft_max=0.01,
+        default=0.0005,
+        precision=4,
+    )
+
+    wireframe_mode: EnumProperty(
+        name="Strokes",
+        items=(("EDGES", "Edges", "One stroke per edge"),
+               ("POLYLINES", "Polylines", "Chain connected edges into strokes following the edge loops")),
+        description="How mesh edges are converted to paint strokes",
+        default="EDGES",
+    )
+
+    wireframe_animation: BoolProperty(
+        name="Animation",
+        description="Export deforming meshes and Keymesh objects frame by frame, with one drawing per distinct mesh",
+        default=False,
+    )
+
     wireframe_stroke_width: FloatProperty(
         name="Width",
         description="Size of paint strokes",
@@ -248,6 +314,14 @@ class ExportQuill(bpy.types.Operator, ExportHelper):
         default=10,
     )
 
+    picture_compression: EnumProperty(
+        name="Compression",
+        items=(("NONE", "None", "Store the raw pixels, as Quill does"),
+               ("PNG", "PNG", "Store the pictures as PNG files. Much smaller, but the exported file can only be opened by this add-on, not by Quill")),
+        description="Format of the picture data stored in the Quill file",
+        default="NONE",
+    )
+
     armature_bone_shape: EnumProperty(
         name="Bone shape",
         items=(("OCTAHEDRAL", "Octahedral", ""),
@@ -266,10 +340,48 @@ class ExportQuill(bpy.types.Operator, ExportHelper):
         name="Interpolation",
         items=(("STEPPED", "Stepped", ""),
                ("LINEAR", "Linear", "")),
-        description="Interpolation method for armature animation",
+        description="Interpolation method for armature animation. Not used when simplifying animation",
         default="STEPPED",
     )
 
+    animation_fast_sampling: BoolProperty(
+        name="Fast sampling",
+        description="Evaluate the F-curves of objects without constraints, drivers or NLA directly instead of stepping through the timeline",
+        default=False,
+    )
+
+    animation_simplify: BoolProperty(
+        name="Simplify",
+        description="Reduce the number of transform key frames by fitting Quill interpolations to the animation",
+        default=False,
+    )
+
+    animation_tolerance_position: FloatProperty(
+        name="Position tolerance",
+        description="Maximum position error allowed when simplifying animation",
+        min=0.0, max=1.0,
+        soft_min=0.0, soft_max=0.1,
+        default=0.001,
+        precision=4,
+    )
+
+    animation_tolerance_rotation: FloatProperty(
+        name="Rotation tolerance",
+        description="Maximum rotation error allowed when simplifying animation, in degrees",
+        min=0.0, max=45.0,
+        soft_min=0.0, soft_max=5.0,
+        default=0.1,
+    )
+
+    animation_tolerance_scale: FloatProperty(
+        name="Scale tolerance",
+        description="Maximum scale error allowed when simplifying animation",
+        min=0.0, max=1.0,
+        soft_min=0.0, soft_max=0.1,
+        default=0.001,
+        precision=4,
+    )
+
     def draw(self, context):
         pass
 
@@ -341,6 +453,12 @@ class QUILL_PT_export_greasepencil(bpy.types.Panel):
         layout.prop(operator, "greasepencil_brush_type")
         layout.prop(operator, "greasepencil_guess_drawing_plane")
         layout.prop(operator, "greasepencil_match_round_caps")
+        layout.prop(operator, "greasepencil_point_reduction")
+        sublayout = layout.column()
+        if operator.greasepencil_point_reduction == "RESAMPLE":
+            sublayout.prop(operator, "greasepencil_point_spacing")
+        elif operator.greasepencil_point_reduction == "SIMPLIFY":
+            sublayout.prop(operator, "greasepencil_simplify_tolerance")
 
 
 class QUILL_PT_export_wireframe(bpy.types.Panel):
@@ -363,8 +481,33 @@ class QUILL_PT_export_wireframe(bpy.types.Panel):
         sfile = context.space_data
         operator = sfile.active_operator
 
+        layout.prop(operator, "wireframe_mode")
         layout.prop(operator, "wireframe_stroke_width")
         layout.prop(operator, "wireframe_segments_per_unit")
+        layout.prop(operator, "wireframe_animation")
+
+
+class QUILL_PT_export_image(bpy.types.Panel):
+    bl_space_type = 'FILE_BROWSER'
+    bl_region_type = 'TOOL_PROPS'
+    bl_label = "Image"
+    bl_parent_id = "FILE_PT_operator"
+
+    @classmethod
+    def poll(cls, context):
+        sfile = context.space_data
+        operator = sfile.active_operator
+        return operator.bl_idname == "EXPORT_SCENE_OT_quill"
+
+    def draw(self, context):
+        layout = self.layout
+        layout.use_property_split = True
+        layout.use_property_decorate = False  # No animation.
+
+        sfile = context.space_data
+        operator = sfile.active_operator
+
+        layout.prop(operator, "picture_compression")
 
 
 class QUILL_PT_export_armature(bpy.types.Panel):
@@ -392,6 +535,35 @@ class QUILL_PT_export_armature(bpy.types.Panel):
         layout.prop(operator, "armature_interpolation")
 
 
+class QUILL_PT_export_animation(bpy.types.Panel):
+    bl_space_type = 'FILE_BROWSER'
+    bl_region_type = 'TOOL_PROPS'
+    bl_label = "Animation"
+    bl_parent_id = "FILE_PT_operator"
+
+    @classmethod
+    def poll(cls, context):
+        sfile = context.space_data
+        operator = sfile.active_operator
+        return operator.bl_idname == "EXPORT_SCENE_OT_quill"
+
+    def draw(self, context):
+        layout = self.layout
+        layout.use_property_split = True
+        layout.use_property_decorate = False  # No animation.
+
+        sfile = context.space_data
+        operator = sfile.active_operator
+
+        layout.prop(operator, "animation_fast_sampling")
+        layout.prop(operator, "animation_simplify")
+        sublayout = layout.column()
+        sublayout.enabled = operator.animation_simplify
+        sublayout.prop(operator, "animation_tolerance_position")
+        sublayout.prop(operator, "animation_tolerance_rotation")
+        sublayout.prop(operator, "animation_tolerance_scale")
+
+
 def menu_func_import(self, context):
     self.layout.operator(ImportQuill.bl_idname, text="Quill scene")
 
@@ -409,7 +581,9 @@ classes = (
     QUILL_PT_export_include,
     QUILL_PT_export_greasepencil,
     QUILL_PT_export_wireframe,
+    QUILL_PT_export_image,
     QUILL_PT_export_armature,
+    QUILL_PT_export_animation,
 )
 
 
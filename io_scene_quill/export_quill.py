@@ -3,9 +3,10 @@ import os
 import bpy
 import logging
 import mathutils
+import numpy as np
 from math import degrees, radians
 from .model import quill_utils, sequence
-from .exporters import paint_armature, paint_gpencil, paint_wireframe, picture, utils
+from .exporters import animation, paint_armature, paint_gpencil, paint_wireframe, picture, sampler, utils
 from .utils.keymesh import keymesh_get_frame_sequence
 
 class QuillExporter:
@@ -16,11 +17,13 @@ class QuillExporter:
         self.config = kwargs
 
         self.original_quill_scenes = {}
+        self.original_quill_drawings = {}
         self.quill_scene = None
         self.quill_state = None
         self.quill_qbin = None
 
         self.exporting_objects = set()
+        self.sampler = None
 
     def __enter__(self):
         return self
@@ -72,6 +75,12 @@ class QuillExporter:
 
         logging.info("Exporting %d objects", len(self.exporting_objects))
 
+        # Find what we need from the original Quill scenes so we don't load everything.
+        self.collect_original_drawings()
+
+        # Record the animation of all the exported objects in a single pass over the timeline.
+        self.sample_animation()
+
         # Loop through the Blender objects and export them.
         root_layer = self.quill_scene.sequence.root_layer
         for obj in scn.objects:
@@ -85,6 +94,77 @@ class QuillExporter:
         if memo_edit_mode:
             bpy.ops.object.editmode_toggle()
 
+    def sample_animation(self):
+        """Step through the timeline once and record the state of all the exported objects."""
+
+        scn = bpy.context.scene
+
+        # Transform key frames are created from frame 0 onwards while drawing visibility
+        # is read from the start of the scene range, cover both.
+        frame_start = scn.frame_start
+        frame_end = max(scn.frame_end, 0)
+        self.sampler = sampler.FrameSampler(frame_start, frame_end, self.config["animation_fast_sampling"])
+
+        for obj in self.exporting_objects:
+            self.sampler.add_object(obj)
+
+            # Paint layers imported as a group of objects, the visibility of the drawings drives the frame list.
+            if obj.type == "EMPTY" and obj.quill.active and obj.quill.paint_layer:
+                for child in obj.children:
+                    self.sampler.add_object(child)
+
+            if obj.type == "ARMATURE" and self.config["armature_animation"]:
+                self.sampler.add_armature(obj)
+
+            # Deforming meshes and Keymesh objects exported as frame by frame wireframes.
+            if obj.type == "MESH" and not obj.quill.active and self.config["wireframe_animation"] and paint_wireframe.is_deforming(obj):
+                self.sampler.add_mesh(obj)
+
+        self.sampler.sample()
+
+    def collect_original_drawings(self):
+        """
+        Find the layers and drawings of the original Quill scenes used by the objects imported from Quill.
+        Maps scene path to a map from layer path to the set of drawing indices.
+
+        Only the objects exported from their original data are recorded (paint layers and sounds),
+        groups are rebuilt from the Blender objects and don't need anything from the original scene.
+        """
+
+        self.original_quill_drawings = {}
+
+        for obj in self.exporting_objects:
+            if not obj.quill.active:
+                continue
+
+            is_paint_layer = obj.type == "EMPTY" and obj.quill.paint_layer
+            is_drawing = obj.type == "MESH"
+            if obj.type not in ("MESH", "SPEAKER") and not is_paint_layer:
+                continue
+
+            # Meshes under a paint layer Empty are exported through their parent.
+            if is_drawing and obj.parent is not None and obj.parent.quill.active and obj.parent.quill.paint_layer:
+                continue
+
+            scene_drawings = self.original_quill_drawings.setdefault(obj.quill.scene_path, {})
+            drawing_indices = scene_drawings.setdefault(obj.quill.layer_path, set())
+
+            # Meshes holding the drawings.
+            # Same lookup as in export_empty_as_paint_layer and export_mesh_quill.
+            meshes = []
+            if is_paint_layer:
+                meshes = [child.data for child in obj.children if child.type == "MESH"]
+            elif obj.type == "MESH":
+                if hasattr(obj, "keymesh") and obj.keymesh.active:
+                    meshes = [block_registry.block for block_registry in obj.keymesh.blocks]
+                else:
+                    meshes = [obj.data]
+
+            for mesh in meshes:
+                # -1 is the blank Keymesh block, it doesn't come from the scene.
+                if mesh.quill.drawing_index >= 0:
+                    drawing_indices.add(mesh.quill.drawing_index)
+
     def should_export_object(self, obj):
 
         # Always include pure empties as they are used for grouping.
@@ -158,9 +238,14 @@ class QuillExporter:
 
         elif obj.type == "ARMATURE":
             # Export the armature hierarchy.
-            layer = paint_armature.convert(obj, self.config)
+            layer, bone_group_layers = paint_armature.convert(obj, self.config, self.sampler)
             self.setup_layer(layer, obj, parent_layer)
             self.animate_layer(layer, obj)
+
+            # Export the objects parented to bones into the bone groups.
+            for child in obj.children:
+                if self.is_bone_child(child) and child.parent_bone in bone_group_layers:
+                    self.export_object(child, bone_group_layers[child.parent_bone])
             
         elif obj.type == "SPEAKER":
             # Currently we only support exporting speaker objects that were created from Quill sound layers.
@@ -250,14 +335,16 @@ class QuillExporter:
             frame_end = scn.frame_end
             paint_layer.implementation.frames = []
             blank_drawing_index = -1
+            children = obj.children
+            visibility = [self.sampler.get_visibility(child) for child in children]
             for frame in range(frame_start, frame_end + 1):
-                scn.frame_set(frame)
+                index = self.sampler.get_index(frame)
 
                 # Determine which drawing is visible at this frame.
                 # We assume at most one drawing is visible at a time and stop at the first one we find.
                 blender_drawing_index = -1
-                for i, child in enumerate(obj.children):
-                    if child.visible_get() and i in blender_object_indices:
+                for i in blender_object_indices:
+                    if visibility[i][index]:
                         blender_drawing_index = i
                         break
 
@@ -277,7 +364,7 @@ class QuillExporter:
                 else:
                     # We found a visible drawing on this frame.
                     # Map from blender child index to Quill drawing index.
-                    quill_drawing_index = obj.children[blender_drawing_index].quill.drawing_index
+                    quill_drawing_index = children[blender_drawing_index].quill.drawing_index
 
                 # Set the drawing index for this frame.
                 paint_layer.implementation.frames.append(quill_drawing_index)
@@ -379,8 +466,8 @@ class QuillExporter:
 
     def export_mesh_wireframe(self, obj, parent_layer):
 
-        # TODO: if this is a keymesh object we could also export an animated wireframe.
-        layer = paint_wireframe.convert(obj, self.config)
+        # Deforming meshes and Keymesh objects recorded by the sampler are exported frame by frame.
+        layer = paint_wireframe.convert(obj, self.config, self.sampler)
 
         if layer is not None:
             self.setup_layer(layer, obj, parent_layer)
@@ -419,6 +506,11 @@ class QuillExporter:
         # Approach: loop through blender frames and create a key frame at each frame.
         # This way we get all the drivers, modifiers and interpolation baked in
         # without having to drill down the F-curves channels and interpret everything.
+        # The matrices were recorded for all objects in a single pass over the timeline.
+        matrices = self.sampler.get_matrices(obj)
+        if matrices is None:
+            return
+
         scn = bpy.context.scene
 
         frame_start = max(scn.frame_start, 0)
@@ -426,37 +518,33 @@ class QuillExporter:
         ticks_per_second = 12600
         ticks_per_frame = int(ticks_per_second / scn.render.fps)
 
-        memo_current_frame = scn.frame_current
-
-        # At this point we don't know if there will be any key frames to create.
-        # We always create the first one to make sure we initialize it correctly in case there are others.
-        # We'll remove it at the end if it turns out it's the only one and the layer-level transform is enough.
-        previous_matrix_local = None
-
-        # Transform key frames.
         kktt = layer.animation.keys.transform
-        for frame in range(frame_start, frame_end + 1):
+        frames = range(frame_start, frame_end + 1)
+        matrices = matrices[self.sampler.get_index(frame_start):self.sampler.get_index(frame_end) + 1]
 
-            scn.frame_set(frame)
+        if self.config["animation_simplify"]:
+            # Fit the sampled transforms with Quill interpolations and only keep the key frames needed.
+            times = [frame * ticks_per_frame for frame in frames]
+            transforms = self.get_transforms(obj, matrices)
+            kktt.extend(animation.make_keyframes(times, transforms, self.config))
 
-            # Only create a kf if we have moved.
+        else:
+            # Only create a kf if we have moved since the last one.
             # Perform the check on the Blender transform to minimize precision issues.
             # It's not clear what the epsilon of matrix equality is in Blender, but it doesn't work for the local
             # matrix of an object parented to a moving empty. The local matrix keeps changing when it shouldn't.
             # Using 1e-5 seems to work.
+            # We always create the first one to make sure we initialize it correctly in case there are others.
             epsilon = 1e-5
-            if previous_matrix_local == None or not utils.transform_equals(obj.matrix_local, previous_matrix_local, epsilon):
-
-                transform = self.get_transform(obj)
-
-                # If we do create it, create it with constant interpolation.
-                # Any interpolation style on Blender side is already accounted for from the
-                # fact that we get the transform at every frame. The only remaining case is a frame-hold.
-                time = frame * ticks_per_frame
-                keyframe = sequence.Keyframe("None", time, transform)
-                kktt.append(keyframe)
+            indices = utils.transform_change_indices(matrices, epsilon)
+            transforms = self.get_transforms(obj, matrices[indices])
 
-                previous_matrix_local = obj.matrix_local.copy()
+            # Create the key frames with constant interpolation.
+            # Any interpolation style on Blender side is already accounted for from the
+            # fact that we get the transform at every frame. The only remaining case is a frame-hold.
+            for index, transform in zip(indices, transforms):
+                time = frames[index] * ticks_per_frame
+                kktt.append(sequence.Keyframe("None", time, transform))
 
         # Cleanup unecessary keyframe.
         # If there is a single key frame we don't need it.
@@ -464,17 +552,35 @@ class QuillExporter:
         if len(kktt) == 1:
             kktt.clear()
 
-        # Restore the active frame
-        scn.frame_set(memo_current_frame)
+    def get_transform(self, obj, matrix_local=None):
+        """
+        Get the object's transform in Quill space.
 
-    def get_transform(self, obj):
-        """Get the object's transform at the current frame, in Quill space."""
+        :param obj: the Blender object.
+        :param matrix_local: local matrix of the object, if None the matrix at the current frame is used.
+        """
+
+        if matrix_local is None:
+            matrix_local = obj.matrix_local
+
+        return self.get_transforms(obj, np.array(matrix_local, dtype=np.float64).reshape(1, 4, 4))[0]
+
+    def get_transforms(self, obj, matrices):
+        """
+        Get the object's transforms in Quill space for an array of local matrices.
+
+        :param obj: the Blender object.
+        :param matrices: array of local matrices of shape (n, 4, 4).
+        :return: list of Quill transforms.
+        """
+
+        matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+        scale_factor = 1.0
 
         if obj.type == "EMPTY" and obj.empty_display_type == "IMAGE":
 
             # Blender identity pose for images is on the front plane.
-            mat = obj.matrix_local @ mathutils.Matrix.Rotation(radians(90), 4, 'X')
-            translation, rotation, scale, flip = utils.convert_transform(mat)
+            matrices = matrices @ np.array(mathutils.Matrix.Rotation(radians(90), 4, 'X'))
 
             # On Blender side, images have a display size independent of the scale.
             # For landscape the unit quad is mapped to the width, for portrait to the height.
@@ -493,20 +599,15 @@ class QuillExporter:
 
             scale_factor *= 0.5
 
-            scale *= scale_factor
-            transform = sequence.Transform(flip, list(rotation), scale[0], list(translation))
-
         elif obj.type == "CAMERA":
 
             # Blender identity pose for cameras looks down.
             # Rotate by 90° around X axis to match Quill.
-            mat = obj.matrix_local @ mathutils.Matrix.Rotation(- radians(90), 4, 'X')
-            translation, rotation, scale, flip = utils.convert_transform(mat)
+            matrices = matrices @ np.array(mathutils.Matrix.Rotation(- radians(90), 4, 'X'))
 
             # Apply extra scale based on the "display size" of the camera
             # Camera > Viewport Display > Size (cm).
-            scale *= obj.data.display_size
-            transform = sequence.Transform(flip, list(rotation), scale[0], list(translation))
+            scale_factor = obj.data.display_size
 
         elif obj.quill.active and obj.quill.paint_layer:
             # We want to use any custom transform applied at the layer level in Blender,
@@ -517,24 +618,39 @@ class QuillExporter:
             # This approach means that every time we import and export we accumulate rotations around X.
             # The other approach would be to modify the original drawing data on the fly at the vertex level
             # just to counter the rotation done in `convert_transform`.
-            mat = obj.matrix_local @ mathutils.Matrix.Rotation(- radians(90), 4, 'X')
-            translation, rotation, scale, flip = utils.convert_transform(mat)
-            transform = sequence.Transform(flip, list(rotation), scale[0], list(translation))
+            matrices = matrices @ np.array(mathutils.Matrix.Rotation(- radians(90), 4, 'X'))
 
         elif obj.type == "ARMATURE":
             # The hierarchy of bones is set up in Blender space
             # and we apply a single transform at the top level.
-            mat = obj.matrix_local @ mathutils.Matrix.Rotation(- radians(90), 4, 'X')
-            translation, rotation, scale, flip = utils.convert_transform(mat)
-            transform = sequence.Transform(flip, list(rotation), scale[0], list(translation))
-
+            matrices = matrices @ np.array(mathutils.Matrix.Rotation(- radians(90), 4, 'X'))
+
+        if self.is_bone_child(obj):
+            # The bone groups are set up in Blender space, see paint_armature.
+            # The local matrix of an object parented to a bone is relative to the tail of the bone,
+            # and the content of the layer is in Quill space, so we rotate it back to Blender space.
+            bone_length = obj.parent.data.bones[obj.parent_bone].length
+            bone_tail = np.array(mathutils.Matrix.Translation((0, bone_length, 0)))
+            matrices = bone_tail @ matrices @ np.array(mathutils.Matrix.Rotation(radians(90), 4, 'X'))
+            translations, rotations, scales, flips = utils.convert_transforms_raw(matrices)
         else:
-            # Normal case for groups and leaf objects created in Blender.
+            # Otherwise it's the normal case for groups and leaf objects created in Blender.
             # This does the normal conversion from Blender to Quill space.
-            translation, rotation, scale, flip = utils.convert_transform(obj.matrix_local)
-            transform = sequence.Transform(flip, list(rotation), scale[0], list(translation))
+            translations, rotations, scales, flips = utils.convert_transforms(matrices)
+
+        scales = scales * scale_factor
+
+        transforms = []
+        for i in range(len(matrices)):
+            transforms.append(sequence.Transform(flips[i], rotations[i].tolist(), float(scales[i, 0]), translations[i].tolist()))
 
-        return transform
+        return transforms
+
+    def is_bone_child(self, obj):
+        """Whether the object is parented to a bone of an exported armature."""
+        parent = obj.parent
+        return (parent is not None and obj.parent_type == 'BONE' and parent.type == "ARMATURE" and
+                parent in self.exporting_objects and obj.parent_bone in parent.data.bones)
 
     def get_quill_scene(self, obj):
         """Get the original Quill scene for an object imported from Quill."""
@@ -544,8 +660,13 @@ class QuillExporter:
         if scene_path in self.original_quill_scenes:
             return self.original_quill_scenes[scene_path]
 
-        layer_types = {'PAINT', 'VIEWPOINT', 'CAMERA', 'PICTURE', 'SOUND'}
-        original_quill_scene = quill_utils.import_scene(scene_path, layer_types)
+        # Only decode the layers and drawings the exported objects refer to.
+        if scene_path in self.original_quill_drawings:
+            layer_drawings = self.original_quill_drawings[scene_path]
+            original_quill_scene = quill_utils.import_scene_partial(scene_path, layer_drawings)
+        else:
+            layer_types = {'PAINT', 'VIEWPOINT', 'CAMERA', 'PICTURE', 'SOUND'}
+            original_quill_scene = quill_utils.import_scene(scene_path, layer_types)
         if original_quill_scene is None:
             logging.warning("Could not load original Quill scene at %s for object %s", scene_path, obj.name)
             return None
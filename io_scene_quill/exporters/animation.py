@@ -0,0 +1,245 @@
+import numpy as np
+
+from ..model import sequence
+
+# Reduction of sampled transform animation to sparse Quill key frames.
+#
+# The exporter samples the transforms on every frame. Instead of creating one key frame per frame,
+# we find the longest runs of samples that can be reproduced by a single Quill interpolation
+# between two key frames, within an error tolerance on the position, rotation and scale.
+#
+# Quill interpolation is defined on the outgoing key frame and applies until the next key frame.
+# - None: hold the value of the key frame until the next one.
+# - Linear, EaseIn, EaseOut, Smoothstep: easing function applied to the normalized time.
+# Rotations are interpolated spherically.
+
+# Interpolated runs must turn less than 180°, with a margin as a half turn could go either way.
+# Compared to the dot product of the quaternions at both ends, cos(angle / 2).
+HALF_TURN_EPSILON = 1e-3
+
+# Minimum number of samples after a run where rest points are considered as run ends.
+REST_POINT_MIN_WINDOW = 8
+
+EASINGS = {
+    "Linear": lambda u: u,
+    "EaseIn": lambda u: u * u,
+    "EaseOut": lambda u: 1 - (1 - u) * (1 - u),
+    "Smoothstep": lambda u: u * u * (3 - 2 * u),
+}
+
+
+def get_arrays(transforms):
+    """
+    Gather a list of Quill transforms into arrays.
+
+    Returns translations (n, 3), rotations (n, 4) as XYZW quaternions and scales (n,).
+    Quaternions are flipped as needed so consecutive rotations are in the same hemisphere.
+    """
+
+    translations = np.array([t.translation for t in transforms], dtype=np.float64).reshape(-1, 3)
+    rotations = np.array([t.rotation for t in transforms], dtype=np.float64).reshape(-1, 4)
+    scales = np.array([t.scale for t in transforms], dtype=np.float64)
+
+    # q and -q are the same rotation, make the sequence continuous.
+    for i in range(1, len(rotations)):
+        if np.dot(rotations[i - 1], rotations[i]) < 0:
+            rotations[i] = -rotations[i]
+
+    return translations, rotations, scales
+
+
+def slerp(q0, q1, u):
+    """Spherical interpolation between two quaternions for an array of parameters."""
+
+    dot = float(np.clip(np.dot(q0, q1), -1.0, 1.0))
+    u = u[:, None]
+    if dot > 0.9995:
+        # Nearly identical, fall back to normalized lerp.
+        q = q0 + (q1 - q0) * u
+        return q / np.linalg.norm(q, axis=1)[:, None]
+
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    return (np.sin((1 - u) * theta) * q0 + np.sin(u * theta) * q1) / sin_theta
+
+
+def rotation_errors(q, r):
+    """Angle in radians between two arrays of unit quaternions."""
+    dot = np.abs(np.sum(q * r, axis=1))
+    return 2 * np.arccos(np.clip(dot, 0.0, 1.0))
+
+
+def fits(interpolation, i, j, translations, rotations, scales, tolerances):
+    """
+    Whether the samples in [i, j] are reproduced by a key frame at i with the given interpolation and one at j.
+    """
+
+    position_tolerance, rotation_tolerance, scale_tolerance = tolerances
+
+    if interpolation == "None":
+        # Samples before the next key frame hold the value of the first one.
+        t = translations[i:j] - translations[i]
+        r = rotation_errors(rotations[i:j], np.broadcast_to(rotations[i], (j - i, 4)))
+        s = scales[i:j] - scales[i]
+    else:
+        # The stored key frames don't keep the sign used to make the quaternions continuous,
+        # so the rotation is interpolated along the shortest path between them.
+        # Runs turning 180° or more can't be represented, they would go the other way or not turn at all.
+        if np.dot(rotations[i], rotations[j]) <= HALF_TURN_EPSILON:
+            return False
+
+        # Samples in between are interpolated.
+        u = EASINGS[interpolation](np.arange(0, j - i + 1) / (j - i))
+        t = translations[i:j + 1] - (translations[i] + (translations[j] - translations[i]) * u[:, None])
+        r = rotation_errors(rotations[i:j + 1], slerp(rotations[i], rotations[j], u))
+        s = scales[i:j + 1] - (scales[i] + (scales[j] - scales[i]) * u)
+
+    return (np.all(np.linalg.norm(t, axis=1) <= position_tolerance) and
+            np.all(r <= rotation_tolerance) and
+            np.all(np.abs(s) <= scale_tolerance))
+
+
+def get_rest_points(translations, rotations, scales, tolerances):
+    """
+    Sample indices where the motion comes to a rest or slows down to a local minimum of speed.
+
+    Eased interpolations start or end with a null velocity, these are the natural candidates
+    for key frames that a greedy extension of the runs would not find.
+    """
+
+    position_tolerance, rotation_tolerance, scale_tolerance = tolerances
+    count = len(translations)
+    if count < 3:
+        return list(range(count))
+
+    # Speed between consecutive samples, normalized by the tolerances so the channels are comparable.
+    speed = np.linalg.norm(translations[1:] - translations[:-1], axis=1) / max(position_tolerance, 1e-9)
+    speed += rotation_errors(rotations[1:], rotations[:-1]) / max(rotation_tolerance, 1e-9)
+    speed += np.abs(scales[1:] - scales[:-1]) / max(scale_tolerance, 1e-9)
+
+    # Sample k is a rest point if the speed just before it is a local minimum or below 1.
+    before = speed[:-1]
+    after = speed[1:]
+    previous = np.concatenate(([np.inf], speed[:-2]))
+    rest = (before <= 1) | ((before <= previous) & (before <= after))
+    points = list(np.nonzero(rest)[0] + 1)
+    points.append(count - 1)
+
+    return points
+
+
+def find_interpolation(i, j, translations, rotations, scales, tolerances, interpolations):
+    """First interpolation fitting the samples in [i, j], or None."""
+
+    for interpolation in interpolations:
+        if fits(interpolation, i, j, translations, rotations, scales, tolerances):
+            return interpolation
+
+    return None
+
+
+def reduce(translations, rotations, scales, tolerances, interpolations=("None", "Linear", "EaseIn", "EaseOut", "Smoothstep")):
+    """
+    Find a sparse set of key frames reproducing the samples within tolerance.
+
+    Greedy: from each key frame, find how far the run of samples can go while one of the interpolations fits.
+    The end of the run is found by doubling its length then by binary search, so each key costs
+    a logarithmic number of fits. Then try to reach further to the rest points of the motion
+    just after the run, where eased interpolations end.
+
+    :param translations: (n, 3) array of translations.
+    :param rotations: (n, 4) array of continuous unit quaternions.
+    :param scales: (n,) array of scales.
+    :param tolerances: (position, rotation in radians, scale) maximum errors.
+    :param interpolations: Quill interpolations to try, in order of preference.
+    :return: list of (sample index, interpolation) for the key frames.
+    """
+
+    count = len(translations)
+    if count == 0:
+        return []
+
+    rest_points = np.array(get_rest_points(translations, rotations, scales, tolerances))
+
+    def find(i, j):
+        return find_interpolation(i, j, translations, rotations, scales, tolerances, interpolations)
+
+    keys = []
+    i = 0
+    while i < count - 1:
+
+        # Two consecutive samples always fit.
+        best = (i + 1, find(i, i + 1) or "None")
+
+        # Double the length of the run until no interpolation fits anymore.
+        failed = count
+        length = 2
+        while i + length < count:
+            interpolation = find(i, i + length)
+            if interpolation is None:
+                failed = i + length
+                break
+
+            best = (i + length, interpolation)
+            length *= 2
+
+        # Binary search between the last run that fits and the first one that doesn't.
+        low, high = best[0], failed
+        while high - low > 1:
+            middle = (low + high) // 2
+            interpolation = find(i, middle)
+            if interpolation is None:
+                high = middle
+            else:
+                low = middle
+                best = (middle, interpolation)
+
+        # Eased runs don't fit until their end is reached, try the rest points just after the run.
+        # The window is bounded by the length of the run found so far.
+        window_end = best[0] + max(best[0] - i, REST_POINT_MIN_WINDOW)
+        first = np.searchsorted(rest_points, best[0], side="right")
+        last = np.searchsorted(rest_points, window_end, side="right")
+        for j in rest_points[first:last]:
+            interpolation = find(i, int(j))
+            if interpolation is None:
+                break
+
+            best = (int(j), interpolation)
+
+        keys.append((i, best[1]))
+        i = best[0]
+
+    # Last key frame, holds the final value.
+    # Not needed if the previous key frame already holds it.
+    if len(keys) > 0 and keys[-1][1] == "None" and fits("None", keys[-1][0], count, translations, rotations, scales, tolerances):
+        return keys
+
+    keys.append((count - 1, "None"))
+
+    return keys
+
+
+def get_tolerances(config):
+    """Error tolerances from the export options, rotation converted to radians."""
+    return (
+        config["animation_tolerance_position"],
+        np.radians(config["animation_tolerance_rotation"]),
+        config["animation_tolerance_scale"],
+    )
+
+
+def make_keyframes(times, transforms, config):
+    """
+    Create the reduced list of transform key frames for a sampled animation.
+
+    :param times: time of each sample, in ticks.
+    :param transforms: Quill transform of each sample.
+    :param config: export options.
+    :return: list of sequence.Keyframe.
+    """
+
+    translations, rotations, scales = get_arrays(transforms)
+    tolerances = get_tolerances(config)
+    keys = reduce(translations, rotations, scales, tolerances)
+
+    return [sequence.Keyframe(interpolation, times[i], transforms[i]) for i, interpolation in keys]
@@ -1,14 +1,18 @@
 
 import bpy
 import mathutils
+import numpy as np
 import random
 
 from ..model import paint, quill_utils, sequence
-from . import utils
+from . import animation, sampler as frame_sampler, utils
 
-def convert(obj, config):
+def convert(obj, config, sampler=None):
     """Converts a Blender armature object to a hierarchy of groups and layers.
-    Create a sub-group for each bone, and add a paint layer with a stroke representing the bone."""
+    Create a sub-group for each bone, and add a paint layer with a stroke representing the bone.
+    The pose animation is read from the sampler, which must have recorded the armature.
+    Returns the armature group layer and the map from bone name to bone group layer,
+    so objects parented to bones can be added to the hierarchy."""
 
     armature_group_layer = quill_utils.create_group_layer(obj.name)
     
@@ -19,12 +23,11 @@ def convert(obj, config):
     for pose_bone in obj.pose.bones:
         make_bone_layer(pose_bone, armature_group_layer, bone_group_layers, config)
     
-    pose_armature(obj, bone_group_layers, config)
+    # Rest poses don't change during the export, compute them once for all the frames.
+    rest_poses = get_rest_poses_in_parent(obj)
+    pose_armature(obj, bone_group_layers, rest_poses, config, sampler)
 
-    # TODO: go through the armature children, find objects that are parented to bones,
-    # convert them and put them in the correct group.
-
-    return armature_group_layer
+    return armature_group_layer, bone_group_layers
 
 
 def make_bone_layer(pose_bone, armature_group_layer, bone_group_layers, config):
@@ -74,90 +77,110 @@ def make_bone_layer(pose_bone, armature_group_layer, bone_group_layers, config):
     drawing.bounding_box = quill_utils.bbox_add(drawing.bounding_box, stroke.bounding_box)
 
 
-def pose_armature(obj, bone_group_layers, config):
-    
-    if not config["armature_animation"]:
+def get_rest_poses_in_parent(obj):
+    """
+    Rest pose of each bone in the space of the rest pose of its parent.
+
+    :return: array (bones, 4, 4) in the order of obj.pose.bones.
+    """
+
+    pose_bones = obj.pose.bones
+    bone_indices = {pose_bone.name: i for i, pose_bone in enumerate(pose_bones)}
+    parents = np.array([bone_indices[pose_bone.parent.name] if pose_bone.parent is not None else -1 for pose_bone in pose_bones], dtype=np.int64)
+
+    # matrix_local is the rest pose in armature space.
+    rest_poses_in_armature = np.array([np.array(pose_bone.bone.matrix_local) for pose_bone in pose_bones], dtype=np.float64).reshape(-1, 4, 4)
+
+    rest_poses_in_parent = rest_poses_in_armature.copy()
+    has_parent = parents >= 0
+    parent_rest_poses = rest_poses_in_armature[parents[has_parent]]
+    rest_poses_in_parent[has_parent] = np.linalg.inv(parent_rest_poses) @ rest_poses_in_armature[has_parent]
+
+    return rest_poses_in_parent
+
+
+def pose_armature(obj, bone_group_layers, rest_poses, config, sampler=None):
+    """
+    Set the pose of the bone groups, or their animation.
+
+    :param rest_poses: rest poses of the bones in the space of their parent, see get_rest_poses_in_parent.
+    """
+
+    pose_bones = obj.pose.bones
+    pose_bases = sampler.get_pose_bases(obj) if sampler is not None else None
+    if not config["armature_animation"] or pose_bases is None:
         # Just set the pose at the current frame, no keyframes.
-        for pose_bone in obj.pose.bones:
-            set_pose(pose_bone, bone_group_layers, {}, 0, config)
+        # Apply the current pose to the rest pose to get the final pose.
+        poses = rest_poses @ frame_sampler.get_pose_bases(obj)
+        transforms = get_pose_transforms(poses)
+        for pose_bone, transform in zip(pose_bones, transforms):
+            if pose_bone.name not in bone_group_layers:
+                print(f"Error: bone {pose_bone.name} not found in bone groups.")
+                continue
+            bone_group_layers[pose_bone.name].transform = transform
         return
     
     # Animation.
-    # Go through the Blender timeline and apply the pose to each bone group.
+    # Go through the recorded poses and apply them to each bone group.
     
     scn = bpy.context.scene
     frame_start = max(scn.frame_start, 0)
     frame_end = max(scn.frame_end, 0)
     ticks_per_second = 12600
     ticks_per_frame = int(ticks_per_second / scn.render.fps)
-    memo_current_frame = scn.frame_current
-    
-    # Map from bone name to the previous transform, to detect if we actually need a keyframe.
-    previous_poses = {}
+
+    # Poses of all the bones on all the frames, as an array (frames, bones, 4, 4).
+    frames = range(frame_start, frame_end + 1)
+    bases = pose_bases[sampler.get_index(frame_start):sampler.get_index(frame_end) + 1]
+    poses = rest_poses[np.newaxis] @ bases
     
     # Note: the time is calculated based on Blender fps, and may not match the Quill scene fps.
     # Quill is happy to create the keyframes at the right time even if they don't align with frames.
-    for frame in range(frame_start, frame_end + 1):
-        scn.frame_set(frame)
-        time = frame * ticks_per_frame
-        
-        # Go through the armature and set the transform of each bone group.
-        for pose_bone in obj.pose.bones:
-            set_pose(pose_bone, bone_group_layers, previous_poses, time, config)
-            
+    times = [frame * ticks_per_frame for frame in frames]
+    interpolation = "None" if config["armature_interpolation"] == "STEPPED" else "Linear"
+    for i, pose_bone in enumerate(pose_bones):
+        if pose_bone.name not in bone_group_layers:
+            print(f"Error: bone {pose_bone.name} not found in bone groups.")
+            continue
+
+        kktt = bone_group_layers[pose_bone.name].animation.keys.transform
+        bone_poses = poses[:, i]
+
+        if config["animation_simplify"]:
+            # Fit the sampled poses with Quill interpolations and only keep the key frames needed.
+            kktt.extend(animation.make_keyframes(times, get_pose_transforms(bone_poses), config))
+
+        else:
+            # Only add a keyframe if the pose has changed since the last one.
+            epsilon = 1e-5
+            indices = utils.transform_change_indices(bone_poses, epsilon)
+            transforms = get_pose_transforms(bone_poses[indices])
+            for index, transform in zip(indices, transforms):
+                kktt.append(sequence.Keyframe(interpolation, times[index], transform))
+
+    # The pivot should be at the bone head which is the origin so we don't need to set it explicitly.
+    # TODO: still true for disconnected nodes?
+    # TODO: should it be set from the rest pose?
+    #bone_group_layer.implementation.pivot = head
+
     # Go through the rig and clean up single keyframes.
     for bone_group_layer in bone_group_layers.values():
         if len(bone_group_layer.animation.keys.transform) == 1:
             bone_group_layer.transform = bone_group_layer.animation.keys.transform[0].value
             bone_group_layer.animation.keys.transform = []
-        
-    # Restore the active frame
-    scn.frame_set(memo_current_frame)
 
 
-def set_pose(pose_bone, bone_group_layers, previous_poses, time, config):
-    
-    if pose_bone.name not in bone_group_layers:
-        print(f"Error: bone {pose_bone.name} not found in bone groups.")
-        return
-    
-    bone_group_layer = bone_group_layers[pose_bone.name]
+def get_pose_transforms(poses):
+    """Quill transforms of bone groups for an array of poses in the space of the parent bone (n, 4, 4)."""
 
-    # Find the rest pose of the bone in the space of the rest pose of its parent.
-    if pose_bone.parent is not None:
-        rest_pose_in_armature = pose_bone.bone.matrix_local
-        parent_rest_pose_in_armature = pose_bone.parent.bone.matrix_local
-        rest_pose_in_parent = parent_rest_pose_in_armature.inverted() @ rest_pose_in_armature
-    else:
-        rest_pose_in_parent = pose_bone.bone.matrix_local
-        
-    # Apply the current pose to the rest pose to get the final pose.
-    pose_in_parent = rest_pose_in_parent @ pose_bone.matrix_basis
-
-    # Convert the transform.
-    translation, rotation, scale, flip = utils.convert_transform_raw(pose_in_parent)
-    transform = sequence.Transform(flip, list(rotation), scale[0], list(translation))
-    
-    if not config["armature_animation"]:
-        bone_group_layer.transform = transform
-        return
-    
-    # Only add a keyframe if the pose has changed since the last frame.
-    epsilon = 1e-5
-    if pose_bone.name in previous_poses and utils.transform_equals(previous_poses[pose_bone.name], pose_in_parent, epsilon):
-        return
+    translations, rotations, scales, flips = utils.convert_transforms_raw(poses)
 
-    previous_poses[pose_bone.name] = pose_in_parent
-    
-    interpolation = "None" if config["armature_interpolation"] == "STEPPED" else "Linear"
-    keyframe = sequence.Keyframe(interpolation, time, transform)
-    bone_group_layer.animation.keys.transform.append(keyframe)
+    transforms = []
+    for i in range(len(translations)):
+        transforms.append(sequence.Transform(flips[i], rotations[i].tolist(), float(scales[i, 0]), translations[i].tolist()))
+
+    return transforms
 
-    # The pivot should be at the bone head which is the origin so we don't need to set it explicitly.
-    # TODO: still true for disconnected nodes?
-    # TODO: should it be set from the rest pose?
-    #bone_group_layer.implementation.pivot = head
-            
 
 def make_bone_stroke(head, tail, color, config):
     """Make a stroke representing a bone, from head to tail.
@@ -1,7 +1,7 @@
 import bpy
 import logging
 import math
-import mathutils
+import numpy as np
 from ..model import paint, quill_utils, sequence
 from . import utils
 
@@ -108,56 +108,31 @@ def make_paint_layer(gpencil_layer, gpencil_materials, thickness_scale, config):
     # Blender timeline frames corresponds to Quill frames.
     ticks_per_second = 12600
 
+    # Statistics gathered over the drawings of the layer, for the export report.
+    stats = {
+        "fitted_strokes": 0,
+        "fallback_strokes": 0,
+        "non_planar_strokes": 0,
+        "max_planarity_residual": 0.0,
+        "points_before_reduction": 0,
+        "points_after_reduction": 0,
+    }
+
     # Drawing list
     for gp_frame in gpencil_layer.frames:
         drawing = sequence.Drawing.from_default()
-        drawing.data = paint.DrawingData()
         paint_layer.implementation.drawings.append(drawing)
 
-        gp_strokes = gp_frame.drawing.strokes if gpv3 else gp_frame.strokes
-
-        # Convert all Grease Pencil strokes to Quill ones.
-        for gp_stroke in gp_strokes:
-
-            # Ignore single-point GPencil strokes using flat cap as they can't really be represented in Quill.
-            # For round cap we will generate a perfect sphere.
-            flat_cap = (gp_stroke.start_cap == 1) if gpv3 else (gp_stroke.start_cap_mode == 'FLAT')
-            if len(gp_stroke.points) < 2 and flat_cap:
-                continue
-            
-            material = gpencil_materials[gp_stroke.material_index].grease_pencil
-            
-            # Stroke, Fill or both.
-            # Prior to Blender 5.10 this was an attribute of the material.
-            # After 5.10 it's an attribute of the stroke.
-            show_stroke = False
-            show_fill = False
-            if bpy.app.version >= (5, 1, 0):
-                show_stroke = not gp_stroke.hide_stroke
-                show_fill = gp_stroke.fill_id is not None and gp_stroke.fill_id != 0
-            else:
-                show_stroke = material.show_stroke 
-                show_fill = material.show_fill
-
-            # Bypass if neither are enabled.
-            if not show_stroke and not show_fill:
-                continue
-
-            if show_stroke:
-                # This can be represented by a normal Quill stroke.
-                stroke = make_normal_stroke(gp_stroke, material, thickness_scale, thickness_offset, config)
-                if stroke is None:
-                    continue
-                drawing.data.strokes.append(stroke)
-                drawing.bounding_box = quill_utils.bbox_add(drawing.bounding_box, stroke.bounding_box)
-
-            if show_fill:
-                # This requires special handling.
-                stroke = make_fill_stroke(gp_stroke, material)
-                if stroke is None:
-                    continue
-                drawing.data.strokes.append(stroke)
-                drawing.bounding_box = quill_utils.bbox_add(drawing.bounding_box, stroke.bounding_box)
+        # Convert all Grease Pencil strokes of the frame to Quill ones at once.
+        drawing.data = make_drawing_arrays(gp_frame, gpencil_materials, thickness_scale, thickness_offset, config, stats)
+        if drawing.data.stroke_count > 0:
+            drawing.bounding_box = quill_utils.bbox_add(drawing.bounding_box, drawing.data.get_bounding_box())
+
+    if config["greasepencil_guess_drawing_plane"]:
+        report_planarity(paint_layer.name, stats)
+
+    if config["greasepencil_point_reduction"] != "NONE":
+        report_point_reduction(paint_layer.name, stats)
 
     # Animation frame list.
     if len(gpencil_layer.frames) == 1:
@@ -198,281 +173,598 @@ def make_paint_layer(gpencil_layer, gpencil_materials, thickness_scale, config):
     return paint_layer
 
 
-def make_normal_stroke(gp_stroke, material, thickness_scale, thickness_offset, config):
+def make_drawing_arrays(gp_frame, gpencil_materials, thickness_scale, thickness_offset, config, stats=None):
+    """
+    Convert the strokes of a Grease pencil frame to Quill strokes, as a DrawingArrays.
+
+    The point data is read in bulk and all the per-point computations (coordinate system,
+    color mixing, widths, normals, tangents, caps) are done on arrays for the whole drawing.
+    If `stats` is provided it accumulates the statistics of the drawing for the export report.
+    """
 
     gpv3 = bpy.app.version >= (4, 3, 0)
+    gp_strokes = gp_frame.drawing.strokes if gpv3 else gp_frame.strokes
 
-    # Convert a Grease pencil stroke to a Quill stroke.
-    thickness_factor = 1
-    if not gpv3:
-        stroke_thickness = max(gp_stroke.line_width + thickness_offset, 1)
-        thickness_factor = (stroke_thickness * thickness_scale) / 1000
+    # Per-stroke settings.
+    # Point counts of all the strokes, to locate the points of the strokes we keep in the drawing.
+    all_sizes = []
+    kept = []
+    base_colors = []
+    thickness_factors = []
+    cyclic = []
+    round_caps = []
 
-    disable_rotational_opacity = True
+    # Strokes made by make_fill_stroke, added after the normal strokes.
+    fill_strokes = []
 
-    # Default to Cylinder brush.
-    brush_type = paint.BrushType.CYLINDER
-    if config["greasepencil_brush_type"] == "ELLIPSE":
-        brush_type = paint.BrushType.ELLIPSE
-    elif config["greasepencil_brush_type"] == "CUBE":
-        brush_type = paint.BrushType.CUBE
-    elif config["greasepencil_brush_type"] == "RIBBON":
-        brush_type = paint.BrushType.RIBBON
+    for index, gp_stroke in enumerate(gp_strokes):
+
+        size = len(gp_stroke.points)
+        all_sizes.append(size)
+        if size == 0:
+            continue
+
+        # Ignore single-point GPencil strokes using flat cap as they can't really be represented in Quill.
+        # For round cap we will generate a perfect sphere.
+        flat_cap = (gp_stroke.start_cap == 1) if gpv3 else (gp_stroke.start_cap_mode == 'FLAT')
+        if size < 2 and flat_cap:
+            continue
+
+        material = gpencil_materials[gp_stroke.material_index].grease_pencil
+
+        # Stroke, Fill or both.
+        # Prior to Blender 5.10 this was an attribute of the material.
+        # After 5.10 it's an attribute of the stroke.
+        show_stroke = False
+        show_fill = False
+        if bpy.app.version >= (5, 1, 0):
+            show_stroke = not gp_stroke.hide_stroke
+            show_fill = gp_stroke.fill_id is not None and gp_stroke.fill_id != 0
+        else:
+            show_stroke = material.show_stroke
+            show_fill = material.show_fill
+
+        if show_fill:
+            # This requires special handling.
+            stroke = make_fill_stroke(gp_stroke, material)
+            if stroke is not None:
+                fill_strokes.append(stroke)
+
+        if not show_stroke:
+            continue
 
-    # Ignore cap modes (ROUND, FLAT).
-    # gpencil_stroke.start_cap_mode, gpencil_stroke.end_cap_mode.
+        kept.append(index)
 
-    # Line type (material.mode): we only support "Line", not "Dots" or "Square"
-    # Line style (material.stroke_style): we only support "Solid", not "Texture".
+        # Line type (material.mode): we only support "Line", not "Dots" or "Square"
+        # Line style (material.stroke_style): we only support "Solid", not "Texture".
+        # Line color (material.color).
+        base_colors.append(material.color[:3])
+
+        thickness_factor = 1
+        if not gpv3:
+            stroke_thickness = max(gp_stroke.line_width + thickness_offset, 1)
+            thickness_factor = (stroke_thickness * thickness_scale) / 1000
+        thickness_factors.append(thickness_factor)
+
+        cyclic.append(gp_stroke.cyclic if gpv3 else gp_stroke.use_cyclic)
+        round_caps.append((gp_stroke.start_cap == 0) if gpv3 else (gp_stroke.start_cap_mode == 'ROUND'))
+
+    if len(kept) == 0:
+        return add_fill_strokes(paint.DrawingArrays(), fill_strokes)
+
+    kept = np.array(kept)
+    all_sizes = np.array(all_sizes, dtype=np.int64)
+    sizes = all_sizes[kept]
+
+    # Read the point data.
+    if gpv3:
+        locations, radii, opacities, vertex_colors = read_points_v3(gp_frame.drawing, all_sizes, kept)
+    else:
+        locations, radii, opacities, vertex_colors = read_points_v2(gp_strokes, sizes, kept)
+
+    stroke_of_point = np.repeat(np.arange(len(kept)), sizes)
+    offsets = np.zeros(len(kept), dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes)[:-1]
+
+    # Blender to Quill coordinate system.
+    positions = utils.swizzle_yup_locations(locations)
 
-    # Line color (material.color).
     # Color model: in Grease pencil the final color of the point is a mix between
     # the vertex color and the material color, in Quill there is only one color.
     # We compute the rendered color and bake it in the Quill stroke point.
     # TODO: the color of all strokes on a layer can also be tinted via
     # GPencil > Layers > Adjustments > Tint Color + Factor.
-    base_color = material.color
-
-    # Option to guess the drawing plane by looking at the points.
-    # If false we fall back to the camera position to compute a normal at each point.
-    # If there is no camera we fallback to the origin.
-    guess_drawing_plane = config["greasepencil_guess_drawing_plane"]
-    guessed_normal = mathutils.Vector((0, 1, 0))
-    camera_position = mathutils.Vector((0, 0, 0))
-
-    if guess_drawing_plane:
-        # Guess the drawing plane by looking at 3 points from the stroke.
-        # This assumes all the points are on the same plane (we don't fit a plane).
-        # If the user has drawn a stroke in 3D space, or imported from Quill, they should not 
-        # check that export option.
-        # FIXME: this also assumes the points are not colinear, this could fail for the line tool.
-        if len(gp_stroke.points) > 2:
-            start = gp_stroke.points[0].position if gpv3 else gp_stroke.points[0].co
-            mid_idx = len(gp_stroke.points) // 2
-            mid = gp_stroke.points[mid_idx].position if gpv3 else gp_stroke.points[mid_idx].co
-            end = gp_stroke.points[-1].position if gpv3 else gp_stroke.points[-1].co
-            p = utils.swizzle_yup_location(start)
-            p2 = utils.swizzle_yup_location(mid)
-            p3 = utils.swizzle_yup_location(end)
-            guessed_normal = (p2 - p).cross(p3 - p)
-            if guessed_normal.length > 0.000001:
-                guessed_normal.normalize()
-            else:
-                # If the points are colinear assume up axis.
-                guessed_normal = mathutils.Vector((0, 1, 0))
-        else:
-            # If we don't have enough points fallback to the up axis.
-            guessed_normal = mathutils.Vector((0, 1, 0))
+    alpha = vertex_colors[:, 3:4]
+    colors = vertex_colors[:, :3] * alpha + np.array(base_colors)[stroke_of_point] * (1.0 - alpha)
+
+    # Thickness
+    if gpv3:
+        # Failure case:
+        # Creating a file in Blender 4.2 and setting thickness scale at the layer level
+        # (Grease pencil > Data > Strokes > Thickness scale, and data: "pixel_factor").
+        # When opening the file in Blender 4.3, this info is somehow retained and causes strokes
+        # to be thicker or thinner than expected even with regards to the UI (brush circle is wrong).
+        # When exporting we would need to apply that thickness scale as well but it's nowhere to be found.
+        # Consequence: files created in 4.2 and imported in 4.3 and then exported to Quill will have a
+        # wrong thickness if the original file used thickness scale.
+        widths = radii + thickness_offset
     else:
-        camera = bpy.context.scene.camera
-        if camera is not None:
-            camera_position = bpy.context.scene.camera.matrix_world.to_translation()
-            camera_position = utils.swizzle_yup_location(camera_position)
-
-    bbox = quill_utils.bbox_empty()
-    vertices = []
-    
-    
-    for i in range(len(gp_stroke.points)):
-
-        gp_point = gp_stroke.points[i]
-        location = gp_point.position if gpv3 else gp_point.co
-        p = utils.swizzle_yup_location(location)
-
-        if guess_drawing_plane:
-            normal = guessed_normal
-        else:
-            normal = (camera_position - p).normalized()
-        
-        tangent = compute_tangent(gp_stroke, i, p)
-
-        # Mix between the vertex color and the base color.
-        alpha = gp_point.vertex_color[3]
-        beta = 1.0 - alpha
-        color = (
-            gp_point.vertex_color[0] * alpha + base_color[0] * beta,
-            gp_point.vertex_color[1] * alpha + base_color[1] * beta,
-            gp_point.vertex_color[2] * alpha + base_color[2] * beta)
-        opacity = gp_point.opacity if gpv3 else gp_point.strength
-
-        # Thickness
-        if gpv3:
-            # Failure case:
-            # Creating a file in Blender 4.2 and setting thickness scale at the layer level
-            # (Grease pencil > Data > Strokes > Thickness scale, and data: "pixel_factor").
-            # When opening the file in Blender 4.3, this info is somehow retained and causes strokes
-            # to be thicker or thinner than expected even with regards to the UI (brush circle is wrong).
-            # When exporting we would need to apply that thickness scale as well but it's nowhere to be found.
-            # Consequence: files created in 4.2 and imported in 4.3 and then exported to Quill will have a
-            # wrong thickness if the original file used thickness scale.
-            width = gp_point.radius + thickness_offset
+        widths = (radii / 2.0) * np.array(thickness_factors)[stroke_of_point]
+
+    widths = np.maximum(widths, 0.00001)
+
+    # Optionally reduce the number of points before computing the normals and tangents.
+    if config["greasepencil_point_reduction"] != "NONE":
+        values = np.concatenate((positions, colors, opacities[:, None], widths[:, None]), axis=1)
+        point_count = len(values)
+        if config["greasepencil_point_reduction"] == "RESAMPLE":
+            values, sizes = resample_strokes(values, offsets, sizes, config["greasepencil_point_spacing"])
         else:
-            width = (gp_point.pressure / 2.0) * thickness_factor
+            values, sizes = simplify_strokes(values, offsets, sizes, config["greasepencil_simplify_tolerance"])
 
-        width = max(width, 0.00001)
+        positions, colors, opacities, widths = values[:, 0:3], values[:, 3:6], values[:, 6], values[:, 7]
+        stroke_of_point = np.repeat(np.arange(len(sizes)), sizes)
+        offsets = np.zeros(len(sizes), dtype=np.int64)
+        offsets[1:] = np.cumsum(sizes)[:-1]
 
-        vertex = paint.Vertex(p, normal, tangent, color, opacity, width)
-        vertices.append(vertex)
-        bbox = quill_utils.bbox_add_point(bbox, p)
+        if stats is not None:
+            stats["points_before_reduction"] += point_count
+            stats["points_after_reduction"] += len(values)
 
-    # Add an extra vertex at the start if the stroke is marked "cyclic" (rectangle and circle tools)
-    if (gpv3 and gp_stroke.cyclic) or (not gpv3 and gp_stroke.use_cyclic):
-        vertex = paint.Vertex(vertices[0].position, vertices[0].normal, vertices[0].tangent, vertices[0].color, vertices[0].opacity, vertices[0].width)
-        vertices.append(vertex)
+    # Normals pointing towards the camera position.
+    # If there is no camera we fallback to the origin.
+    camera_position = np.zeros(3)
+    camera = bpy.context.scene.camera
+    if camera is not None:
+        camera_position = np.array(utils.swizzle_yup_location(camera.matrix_world.to_translation()))
+    normals = utils.normalize(camera_position - positions)
 
-    # Add extra vertices for caps if needed.
-    # Heuristic:
-    # - if the stroke already has a zero width extremities we don't do anything (assume it was imported from Quill).
-    # - if the stroke was created with FLAT caps in Blender, we add end vertices with zero width.
-    # - if the user disabled round caps in export settings, we also just add zero width extremities.
-    # - otherwise it's round caps and we add a bunch of vertices to rebuild them.
-    # This is independent of the export brush type.
-    if vertices[0].width > 0:
-        caps_type = "FLAT"
-        has_round_caps = (gpv3 and gp_stroke.start_cap == 0) or (not gpv3 and gp_stroke.start_cap_mode == 'ROUND')
-        if has_round_caps and config["greasepencil_match_round_caps"]:
-            caps_type = "ROUND"
-        add_caps(vertices, caps_type, bbox)
+    # Option to guess the drawing plane by looking at the points.
+    # Strokes for which no plane can be found keep the camera facing normals.
+    if config["greasepencil_guess_drawing_plane"]:
+        plane_normals, residuals, valid = fit_stroke_planes(positions, offsets, sizes, camera_position)
+        fitted = valid[stroke_of_point]
+        normals[fitted] = plane_normals[stroke_of_point[fitted]]
 
-    id = 0
-    return paint.Stroke(id, bbox, brush_type, disable_rotational_opacity, vertices)
+        if stats is not None:
+            stats["fitted_strokes"] += int(np.count_nonzero(valid))
+            stats["fallback_strokes"] += int(np.count_nonzero(~valid))
+            stats["non_planar_strokes"] += int(np.count_nonzero(residuals[valid] > NON_PLANAR_THRESHOLD))
+            if np.any(valid):
+                stats["max_planarity_residual"] = max(stats["max_planarity_residual"], float(residuals[valid].max()))
 
+    tangents = compute_tangents(positions, stroke_of_point, offsets, sizes)
 
-def compute_tangent(gp_stroke, i, p):
+    # Vertex records: position, normal, tangent, color, opacity, width.
+    records = np.concatenate((positions, normals, tangents, colors, opacities[:, None], widths[:, None]), axis=1)
 
-    gpv3 = bpy.app.version >= (4, 3, 0)
+    caps_types = np.where(np.array(round_caps) & config["greasepencil_match_round_caps"], "ROUND", "FLAT")
+    records, sizes = add_cyclic_and_caps(records, offsets, sizes, np.array(cyclic, dtype=bool), caps_types)
 
-    # Compute the direction of the stroke at point i.
-    epsilon = 0.0000001
+    return add_fill_strokes(make_arrays(records, sizes, config), fill_strokes)
+
+
+def make_fill_stroke(gp_stroke, material):
+    return None
 
-    # First valid forward difference.
-    forward = mathutils.Vector((0, 0, 0))
-    for j in range(i + 1, len(gp_stroke.points)):
-        location = gp_stroke.points[j].position if gpv3 else gp_stroke.points[j].co
-        p2 = utils.swizzle_yup_location(location)
-        delta = p2 - p
-        if delta.length >= epsilon:
-            forward = delta.normalized()
-            break
 
-    # First valid backward difference.
-    backward = mathutils.Vector((0, 0, 0))
-    for j in range(i - 1, -1, -1):
-        location = gp_stroke.points[j].position if gpv3 else gp_stroke.points[j].co
-        p2 = utils.swizzle_yup_location(location)
-        delta = p - p2
-        if delta.length >= epsilon:
-            backward = delta.normalized()
+def add_fill_strokes(arrays, fill_strokes):
+    """Add the strokes made for the fills to the drawing arrays."""
+
+    if len(fill_strokes) == 0:
+        return arrays
+
+    return paint.concatenate_drawing_arrays([arrays, paint.get_drawing_arrays(fill_strokes)])
+
+
+def read_points_v3(gp_drawing, all_sizes, kept):
+    """Read the point attributes of the kept strokes of a GPv3 drawing."""
+
+    point_count = int(all_sizes.sum())
+
+    def read(name, key, width, default):
+        values = np.full(point_count * width, default, dtype=np.float32)
+        attribute = gp_drawing.attributes.get(name)
+        if attribute is not None:
+            attribute.data.foreach_get(key, values)
+        return values.reshape(point_count, width) if width > 1 else values
+
+    # Missing attributes take the Blender default values.
+    locations = read("position", "vector", 3, 0.0)
+    radii = read("radius", "value", 1, 0.01)
+    opacities = read("opacity", "value", 1, 1.0)
+    vertex_colors = read("vertex_color", "color", 4, 0.0)
+
+    # Indices of the points of the kept strokes.
+    all_offsets = np.zeros(len(all_sizes), dtype=np.int64)
+    all_offsets[1:] = np.cumsum(all_sizes)[:-1]
+    sizes = all_sizes[kept]
+    starts = np.zeros(len(kept), dtype=np.int64)
+    starts[1:] = np.cumsum(sizes)[:-1]
+    indices = np.repeat(all_offsets[kept] - starts, sizes) + np.arange(int(sizes.sum()))
+
+    return (locations[indices].astype(np.float64), radii[indices].astype(np.float64),
+            opacities[indices].astype(np.float64), vertex_colors[indices].astype(np.float64))
+
+
+def read_points_v2(gp_strokes, sizes, kept):
+    """Read the point attributes of the kept strokes of a GPv2 frame."""
+
+    point_count = int(sizes.sum())
+    locations = np.empty((point_count, 3), dtype=np.float32)
+    pressures = np.empty(point_count, dtype=np.float32)
+    strengths = np.empty(point_count, dtype=np.float32)
+    vertex_colors = np.empty((point_count, 4), dtype=np.float32)
+
+    start = 0
+    for index, size in zip(kept, sizes):
+        points = gp_strokes[int(index)].points
+        end = start + int(size)
+        points.foreach_get("co", locations[start:end].ravel())
+        points.foreach_get("pressure", pressures[start:end])
+        points.foreach_get("strength", strengths[start:end])
+        points.foreach_get("vertex_color", vertex_colors[start:end].ravel())
+        start = end
+
+    return (locations.astype(np.float64), pressures.astype(np.float64),
+            strengths.astype(np.float64), vertex_colors.astype(np.float64))
+
+
+def resample_strokes(values, offsets, sizes, spacing):
+    """
+    Resample strokes at regular intervals along their length.
+
+    Strokes are only resampled if this reduces their number of points,
+    the first and last points are kept in place.
+
+    :param values: (n, k) array of point values, starting with the position.
+        All the values are linearly interpolated.
+    :param offsets: index of the first point of each stroke.
+    :param sizes: number of points of each stroke.
+    :param spacing: target distance between points.
+    :return: the new values and stroke sizes.
+    """
+
+    count = len(values)
+    stroke_of_point = np.repeat(np.arange(len(sizes)), sizes)
+
+    # Cumulative length along the strokes. Each stroke starts where the previous one ended.
+    segment_lengths = np.linalg.norm(values[1:, 0:3] - values[:-1, 0:3], axis=1)
+    segment_lengths[stroke_of_point[1:] != stroke_of_point[:-1]] = 0
+    cumulative = np.concatenate(([0.0], np.cumsum(segment_lengths)))
+    starts = cumulative[offsets]
+    lengths = cumulative[offsets + sizes - 1] - starts
+
+    new_sizes = np.maximum(np.ceil(lengths / spacing).astype(np.int64) + 1, 2)
+    new_sizes = np.where(new_sizes < sizes, new_sizes, sizes)
+    resampled = new_sizes < sizes
+
+    # Parameter of each new point along its stroke.
+    new_stroke_of_point = np.repeat(np.arange(len(sizes)), new_sizes)
+    new_offsets = np.zeros(len(sizes), dtype=np.int64)
+    new_offsets[1:] = np.cumsum(new_sizes)[:-1]
+    local = np.arange(int(new_sizes.sum())) - new_offsets[new_stroke_of_point]
+    u = local / np.maximum(new_sizes - 1, 1)[new_stroke_of_point]
+    targets = starts[new_stroke_of_point] + u * lengths[new_stroke_of_point]
+
+    # Segment containing each target, restricted to the stroke.
+    first = offsets[new_stroke_of_point]
+    last = (offsets + sizes - 1)[new_stroke_of_point]
+    upper = np.clip(np.searchsorted(cumulative, targets, side='right'), np.minimum(first + 1, last), last)
+    lower = np.maximum(upper - 1, first)
+    span = cumulative[upper] - cumulative[lower]
+    t = np.clip((targets - cumulative[lower]) / np.where(span > 0, span, 1), 0, 1)
+
+    new_values = values[lower] + (values[upper] - values[lower]) * t[:, None]
+
+    # Strokes that are not resampled keep their original points.
+    unchanged = ~resampled[new_stroke_of_point]
+    new_values[unchanged] = values[first[unchanged] + local[unchanged]]
+
+    return new_values, new_sizes
+
+
+def simplify_strokes(values, offsets, sizes, tolerance):
+    """
+    Remove the points that can be linearly interpolated from the remaining ones within a tolerance.
+
+    This is the Ramer-Douglas-Peucker algorithm run on all the strokes at once, the error of a point
+    is the largest of its distance to the simplified segment and its width difference.
+
+    :param values: (n, k) array of point values, starting with the position and ending with the width.
+    :param offsets: index of the first point of each stroke.
+    :param sizes: number of points of each stroke.
+    :param tolerance: maximum position and width error.
+    :return: the new values and stroke sizes.
+    """
+
+    keep = np.zeros(len(values), dtype=bool)
+    keep[offsets] = True
+    keep[offsets + sizes - 1] = True
+
+    positions = values[:, 0:3]
+    widths = values[:, -1]
+
+    # Segments of the simplified strokes that still have points in between.
+    starts = offsets
+    ends = offsets + sizes - 1
+    while True:
+        interior = ends - starts - 1
+        starts = starts[interior > 0]
+        ends = ends[interior > 0]
+        interior = interior[interior > 0]
+        if len(starts) == 0:
             break
 
-    # Average
-    yaxis = forward + backward
-    if yaxis.length >= epsilon:
-        return yaxis.normalized()
+        segment = np.repeat(np.arange(len(starts)), interior)
+        segment_offsets = np.zeros(len(starts), dtype=np.int64)
+        segment_offsets[1:] = np.cumsum(interior)[:-1]
+        indices = np.arange(len(segment)) - segment_offsets[segment] + starts[segment] + 1
+
+        # Distance to the segment and width error.
+        a = positions[starts[segment]]
+        ab = positions[ends[segment]] - a
+        ap = positions[indices] - a
+        length2 = np.sum(ab * ab, axis=1)
+        u = np.clip(np.sum(ap * ab, axis=1) / np.where(length2 > 0, length2, 1), 0, 1)
+        distances = np.linalg.norm(ap - ab * u[:, None], axis=1)
+        interpolated_widths = widths[starts[segment]] + (widths[ends[segment]] - widths[starts[segment]]) * u
+        errors = np.maximum(distances, np.abs(widths[indices] - interpolated_widths))
+
+        # Point with the largest error of each segment.
+        max_errors = np.maximum.reduceat(errors, segment_offsets)
+        is_max = errors == max_errors[segment]
+        split = np.minimum.reduceat(np.where(is_max, indices, len(values)), segment_offsets)
+
+        # Keep that point and split the segment if the error is too large.
+        refine = max_errors > tolerance
+        keep[split[refine]] = True
+        starts, ends = np.concatenate((starts[refine], split[refine])), np.concatenate((split[refine], ends[refine]))
+
+    stroke_of_point = np.repeat(np.arange(len(sizes)), sizes)
+    new_sizes = np.bincount(stroke_of_point[keep], minlength=len(sizes))
+    return values[keep], new_sizes
+
+
+# Relative planarity residual above which a stroke is reported as not drawn on a plane.
+NON_PLANAR_THRESHOLD = 0.05
+
+
+def fit_stroke_planes(positions, offsets, sizes, camera_position):
+    """
+    Fit a least-squares plane to the points of each stroke.
+
+    The covariance matrices of all the strokes are computed at once and the plane normal is the
+    eigenvector with the smallest eigenvalue. The normal is oriented with the winding of the stroke,
+    or towards the camera if the winding is not defined.
+
+    :param positions: (n, 3) array of point positions.
+    :param offsets: index of the first point of each stroke.
+    :param sizes: number of points of each stroke.
+    :param camera_position: position used to orient the normals of strokes without winding.
+    :return: normals (strokes, 3), relative residuals (strokes,) and validity mask (strokes,).
+        The residual is the RMS distance of the points to the plane divided by the RMS spread of the
+        points along the main axis of the stroke. Strokes with less than 3 points or with colinear
+        points have no plane and are marked invalid.
+    """
+
+    stroke_count = len(sizes)
+    counts = sizes[:, None].astype(np.float64)
+
+    # Centroids and covariance matrices.
+    centroids = np.add.reduceat(positions, offsets, axis=0) / counts
+    centered = positions - np.repeat(centroids, sizes, axis=0)
+    outer = centered[:, :, None] * centered[:, None, :]
+    covariances = np.add.reduceat(outer, offsets, axis=0) / counts[:, :, None]
+
+    # Eigenvalues in ascending order.
+    eigenvalues, eigenvectors = np.linalg.eigh(covariances)
+    eigenvalues = np.maximum(eigenvalues, 0.0)
+    normals = eigenvectors[:, :, 0]
+
+    # A plane is defined if the points spread in two directions.
+    epsilon = 1e-12
+    valid = (sizes > 2) & (eigenvalues[:, 1] > eigenvalues[:, 2] * 1e-6) & (eigenvalues[:, 2] > epsilon)
+    residuals = np.zeros(stroke_count)
+    residuals[valid] = np.sqrt(eigenvalues[valid, 0] / eigenvalues[valid, 2])
+
+    # Orientation: the sum of the cross products of consecutive points (Newell's method)
+    # gives the winding of the stroke around its centroid.
+    same_stroke = np.repeat(np.arange(stroke_count), sizes)
+    cross = np.cross(centered[:-1], centered[1:])
+    cross[same_stroke[:-1] != same_stroke[1:]] = 0
+    winding = np.zeros((stroke_count, 3))
+    np.add.at(winding, same_stroke[:-1], cross)
+
+    orientation = np.sum(normals * winding, axis=1)
+    towards_camera = np.sum(normals * (camera_position - centroids), axis=1)
+    undefined = np.abs(orientation) <= epsilon
+    orientation[undefined] = towards_camera[undefined]
+    normals[orientation < 0] *= -1
+
+    return normals, residuals, valid
+
+
+def report_planarity(layer_name, stats):
+    """Log how well the strokes of a layer fit their drawing planes."""
+
+    logging.info("Grease Pencil layer %s: fitted drawing planes for %d strokes, %d strokes facing the camera, max planarity residual %.4f.",
+        layer_name, stats["fitted_strokes"], stats["fallback_strokes"], stats["max_planarity_residual"])
+
+    if stats["non_planar_strokes"] > 0:
+        logging.warning("Grease Pencil layer %s: %d strokes are not drawn on a plane, their guessed normals may be wrong. Consider disabling \"Guess planes\".",
+            layer_name, stats["non_planar_strokes"])
+
+
+def report_point_reduction(layer_name, stats):
+    """Log the number of points removed from the strokes of a layer."""
+
+    before = stats["points_before_reduction"]
+    after = stats["points_after_reduction"]
+    if before == 0:
+        return
+
+    logging.info("Grease Pencil layer %s: reduced strokes from %d to %d points (%.1f%% fewer).",
+        layer_name, before, after, 100.0 * (before - after) / before)
 
-    # If that's still zero, go for a desperate solution - overal stroke direction + noise.
-    last_location = gp_stroke.points[-1].position if gpv3 else gp_stroke.points[-1].co
-    first_location = gp_stroke.points[0].position if gpv3 else gp_stroke.points[0].co
-    last = utils.swizzle_yup_location(last_location)
-    first = utils.swizzle_yup_location(first_location)
-    yaxis = (last - first + mathutils.Vector((0.000001, 0.000002, 0.000003))).normalized()
-    return yaxis
 
+def compute_tangents(positions, stroke_of_point, offsets, sizes):
+    """
+    Compute the direction of the strokes at each point.
 
-def add_caps(vertices, caps_type, bbox):
+    Average of the first valid forward and backward differences within the stroke.
+    If that's still zero, go for a desperate solution - overal stroke direction + noise.
+    """
+
+    epsilon = 0.0000001
+    count = len(positions)
+    zero = np.zeros((count, 3))
+
+    # Segments between consecutive points of the same stroke, and whether they are long enough.
+    segments = positions[1:] - positions[:-1]
+    lengths = np.linalg.norm(segments, axis=1)
+    valid = (lengths >= epsilon) & (stroke_of_point[1:] == stroke_of_point[:-1])
+    directions = np.zeros_like(segments)
+    directions[valid] = segments[valid] / lengths[valid, None]
+
+    # Forward: first valid segment starting at or after the point.
+    indices = np.where(valid, np.arange(count - 1), count)
+    next_valid = np.minimum.accumulate(indices[::-1])[::-1] if count > 1 else indices
+    next_valid = np.append(next_valid, count)
+    has_forward = next_valid < count - 1
+    has_forward[has_forward] &= stroke_of_point[next_valid[has_forward]] == stroke_of_point[has_forward]
+    forward = zero.copy()
+    forward[has_forward] = directions[next_valid[has_forward]]
+
+    # Backward: last valid segment ending at or before the point.
+    indices = np.where(valid, np.arange(count - 1), -1)
+    previous_valid = np.maximum.accumulate(indices) if count > 1 else indices
+    previous_valid = np.insert(previous_valid, 0, -1)
+    has_backward = previous_valid >= 0
+    has_backward[has_backward] &= stroke_of_point[previous_valid[has_backward]] == stroke_of_point[has_backward]
+    backward = zero.copy()
+    backward[has_backward] = directions[previous_valid[has_backward]]
+
+    tangents = forward + backward
+    lengths = np.linalg.norm(tangents, axis=1)
+    valid = lengths >= epsilon
+    tangents[valid] /= lengths[valid, None]
+
+    # Fallback for the points where the average is still zero.
+    if not np.all(valid):
+        first = positions[offsets]
+        last = positions[offsets + sizes - 1]
+        fallback = utils.normalize(last - first + np.array([0.000001, 0.000002, 0.000003]))
+        tangents[~valid] = fallback[stroke_of_point[~valid]]
+
+    return tangents
+
+
+def add_cyclic_and_caps(records, offsets, sizes, cyclic, caps_types):
+    """
+    Add the extra vertices closing cyclic strokes and making the caps.
+
+    :param records: (n, 14) array of vertex records: position, normal, tangent, color, opacity, width.
+    :param offsets: index of the first vertex of each stroke.
+    :param sizes: number of vertices of each stroke.
+    :param cyclic: whether each stroke is cyclic.
+    :param caps_types: "FLAT" or "ROUND" for each stroke.
+    :return: the new records and stroke sizes.
+    """
+
+    stroke_count = len(sizes)
+    strokes = np.arange(stroke_count)
+
+    # Rows are sorted by stroke then by order within the stroke.
+    all_rows = [records]
+    all_strokes = [np.repeat(strokes, sizes)]
+    all_orders = [np.arange(len(records)) - np.repeat(offsets, sizes)]
+
+    # Add an extra vertex at the end if the stroke is marked "cyclic" (rectangle and circle tools)
+    first = records[offsets]
+    last = records[offsets + sizes - 1].copy()
+    last[cyclic] = first[cyclic]
+    all_rows.append(first[cyclic])
+    all_strokes.append(strokes[cyclic])
+    all_orders.append(sizes[cyclic])
+    body_sizes = sizes + cyclic
 
-    # Create the caps if needed.
+    # Add extra vertices for caps if needed.
+    # Heuristic:
+    # - if the stroke already has a zero width extremities we don't do anything (assume it was imported from Quill).
+    # - if the stroke was created with FLAT caps in Blender, we add end vertices with zero width.
+    # - if the user disabled round caps in export settings, we also just add zero width extremities.
+    # - otherwise it's round caps and we add a bunch of vertices to rebuild them.
+    # This is independent of the export brush type.
     # We assume both start and end caps are the same, it's seemingly impossible to
     # set different start and end cap types from Blender UI.
+    has_caps = first[:, 13] > 0
+    flat = has_caps & (caps_types == "FLAT")
+    round = has_caps & (caps_types == "ROUND")
+
+    def cap_vertices(base, mask, distance, width, order):
+        # Vertices along the tangent at a distance from the base vertex, copying the other attributes.
+        rows = base[mask].copy()
+        rows[:, 0:3] += rows[:, 6:9] * distance[mask, None]
+        rows[:, 13] = width[mask]
+        all_rows.append(rows)
+        all_strokes.append(strokes[mask])
+        all_orders.append(order[mask])
+
+    zero = np.zeros(stroke_count)
+
+    # Flat cap: add a single vertex at the start and end with zero width.
+    # Note: we extend the stroke by a small length on each side.
+    # If we set the extra points exactly at the same location as the current end points
+    # it behaves badly when imported back.
+    cap_vertices(first, flat, -first[:, 13] / 10, zero, np.full(stroke_count, -1))
+    cap_vertices(last, flat, last[:, 13] / 10, zero, body_sizes)
+
+    # Round cap: a vertex with zero width at a distance of the width, and intermediate
+    # vertices making a hemisphere.
+    round_cap_segments = 5
+    cap_vertices(first, round, -first[:, 13], zero, np.full(stroke_count, -(round_cap_segments + 1)))
+    cap_vertices(last, round, last[:, 13], zero, body_sizes + round_cap_segments)
+    for i in range(round_cap_segments):
+        k = (i + 1) / (round_cap_segments + 1)
+        cap_vertices(first, round, -first[:, 13] * k, first[:, 13] * math.sqrt(1 - k * k), np.full(stroke_count, -(i + 1)))
+        cap_vertices(last, round, last[:, 13] * k, last[:, 13] * math.sqrt(1 - k * k), body_sizes + i)
 
-    # If the first point already has zero width we assume this is already
-    # imported from Quill and we don't need to add caps.
-    if vertices[0].width == 0:
-        return
+    rows = np.concatenate(all_rows)
+    order = np.lexsort((np.concatenate(all_orders), np.concatenate(all_strokes)))
 
-    round_cap_segments = 5
+    new_sizes = body_sizes + np.where(flat, 2, 0) + np.where(round, 2 * (round_cap_segments + 1), 0)
+    return rows[order], new_sizes
 
-    if caps_type == 'FLAT':
-
-        # Flat cap: add a single vertex at the start and end with zero width.
-        # Note: we extend the stroke by a small length on each side.
-        # If we set the extra points exactly at the same location as the current end points
-        # it behaves badly when imported back.
-
-        # Start cap
-        p = vertices[0].position - (vertices[0].tangent * vertices[0].width / 10)
-        normal = vertices[0].normal
-        tangent = vertices[0].tangent
-        color = vertices[0].color
-        opacity = vertices[0].opacity
-        width = 0
-        vertex = paint.Vertex(p, normal, tangent, color, opacity, width)
-        vertices.insert(0, vertex)
-
-        # End cap
-        p = vertices[-1].position + (vertices[-1].tangent * vertices[-1].width / 10)
-        normal = vertices[-1].normal
-        tangent = vertices[-1].tangent
-        color = vertices[-1].color
-        opacity = vertices[-1].opacity
-        width = 0
-        vertex = paint.Vertex(p, normal, tangent, color, opacity, width)
-        vertices.append(vertex)
-
-    elif caps_type == 'ROUND':
-
-        def make_hemisphere(vertices, start_index, end_index, radius, count):
-            # Create intermediate points to make a hemisphere.
-            # start_index is at the base of the hemisphere.
-            extra_vertices = []
-            for i in range(count):
-                k = (i+1)/(count+1)
-                dir = (vertices[end_index].position - vertices[start_index].position).normalized()
-                p = vertices[start_index].position + dir * (k * radius)
-                dist = (p - vertices[start_index].position).length
-                angle = math.acos(dist / radius)
-                width = math.sin(angle) * radius
-
-                normal = vertices[start_index].normal
-                tangent = vertices[start_index].tangent
-                color = vertices[start_index].color
-                opacity = vertices[start_index].opacity
-
-                vertex = paint.Vertex(p, normal, tangent, color, opacity, width)
-                extra_vertices.append(vertex)
-
-            return extra_vertices
-
-        # Start cap
-        p = vertices[0].position - (vertices[0].tangent * vertices[0].width)
-        normal = vertices[0].normal
-        tangent = vertices[0].tangent
-        color = vertices[0].color
-        opacity = vertices[0].opacity
-        width = 0
-        vertex = paint.Vertex(p, normal, tangent, color, opacity, width)
-        vertices.insert(0, vertex)
-        bbox = quill_utils.bbox_add_point(bbox, p)
-        extra_vertices = make_hemisphere(vertices, 1, 0, vertices[1].width, round_cap_segments)
-        for i in range(len(extra_vertices)):
-            bbox = quill_utils.bbox_add_point(bbox, extra_vertices[i].position)
-            vertices.insert(1, extra_vertices[i])
-
-        # End cap
-        p = vertices[-1].position + (vertices[-1].tangent * vertices[-1].width)
-        normal = vertices[-1].normal
-        tangent = vertices[-1].tangent
-        color = vertices[-1].color
-        opacity = vertices[-1].opacity
-        width = 0
-        vertex = paint.Vertex(p, normal, tangent, color, opacity, width)
-        vertices.append(vertex)
-        bbox = quill_utils.bbox_add_point(bbox, p)
-        extra_vertices = make_hemisphere(vertices, len(vertices) - 2, len(vertices) - 1, vertices[-2].width, round_cap_segments)
-        for i in range(len(extra_vertices)):
-            bbox = quill_utils.bbox_add_point(bbox, extra_vertices[i].position)
-            vertices.insert(len(vertices) - 1, extra_vertices[i])
 
+def make_arrays(records, sizes, config):
+    """Pack the vertex records into a DrawingArrays with per-stroke settings and bounding boxes."""
 
-def make_fill_stroke(gp_stroke, material):
-    return None
+    # Default to Cylinder brush.
+    brush_type = paint.BrushType.CYLINDER
+    if config["greasepencil_brush_type"] == "ELLIPSE":
+        brush_type = paint.BrushType.ELLIPSE
+    elif config["greasepencil_brush_type"] == "CUBE":
+        brush_type = paint.BrushType.CUBE
+    elif config["greasepencil_brush_type"] == "RIBBON":
+        brush_type = paint.BrushType.RIBBON
+
+    arrays = paint.DrawingArrays(len(sizes), len(records))
+    arrays.sizes[:] = sizes
+    arrays.offsets[1:] = np.cumsum(sizes)[:-1]
+    arrays.ids[:] = 0
+    arrays.brush_types[:] = brush_type.value
+    arrays.disable_rotational_opacity[:] = True
+
+    arrays.positions[:] = records[:, 0:3]
+    arrays.normals[:] = records[:, 3:6]
+    arrays.tangents[:] = records[:, 6:9]
+    arrays.colors[:] = records[:, 9:12]
+    arrays.opacities[:] = records[:, 12]
+    arrays.widths[:] = records[:, 13]
+
+    offsets = arrays.offsets
+    arrays.bounding_boxes[:, :3] = np.minimum.reduceat(records[:, 0:3], offsets, axis=0)
+    arrays.bounding_boxes[:, 3:] = np.maximum.reduceat(records[:, 0:3], offsets, axis=0)
+
+    return arrays
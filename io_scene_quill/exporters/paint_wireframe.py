@@ -1,85 +1,394 @@
 
 import bpy
-import math
-import mathutils
+import hashlib
+import logging
+import numpy as np
 from ..model import paint, quill_utils, sequence
+from ..utils import timeline
 from . import utils
 
 
-def convert(obj, config):
-    """Convert a mesh object into a paint layer with its wireframe"""
+def convert(obj, config, sampler=None):
+    """
+    Convert a mesh object into a paint layer with its wireframe.
+
+    If the sampler recorded the evaluated mesh of the object and it changes over time,
+    the wireframe is exported frame by frame, with one drawing per distinct mesh.
+    """
+
+    mesh_keys = sampler.get_mesh_keys(obj) if sampler is not None else None
+    if mesh_keys is not None and len(set(mesh_keys)) > 1:
+        return convert_animated(obj, config, sampler)
 
     # Create a default paint layer and drawing.
     paint_layer = quill_utils.create_paint_layer(obj.name)
     drawing = sequence.Drawing.from_default()
-    drawing.data = paint.DrawingData()
     paint_layer.implementation.drawings.append(drawing)
 
-    # Produce a paint stroke for each edge.
     # https://docs.blender.org/api/current/bpy.types.Mesh.html
-    mesh = obj.data
-    stroke_id = 0
-    for (v1, v2) in mesh.edge_keys:
-        p1 = utils.swizzle_yup_location(mesh.vertices[v1].co)
-        p2 = utils.swizzle_yup_location(mesh.vertices[v2].co)
-        stroke = make_edge_stroke(p1, p2, stroke_id, config)
-        if stroke is None:
-            continue
-        drawing.data.strokes.append(stroke)
-        drawing.bounding_box = quill_utils.bbox_add(drawing.bounding_box, stroke.bounding_box)
-        stroke_id += 1
+    set_drawing_data(drawing, MeshArrays(obj.data), config)
 
     return paint_layer
 
 
-def make_edge_stroke(start, end, id, config):
-    # Expects start and end to be in Quill's coordinate system (Y up, Z forward)."""
-    brush_type = paint.BrushType.CYLINDER
-    disable_rotational_opacity = True
+def convert_animated(obj, config, sampler):
+    """Convert the evaluated mesh recorded at each frame into a frame by frame paint layer."""
 
-    dist = (end - start).length
-    min_size = 0.001
-    max_size = dist / 4
-    if dist < 0.004:
-        return None
+    paint_layer = quill_utils.create_paint_layer(obj.name)
+
+    # Set the layer to the Blender frame rate, like Grease Pencil frame by frame animation.
+    paint_layer.implementation.framerate = bpy.context.scene.render.fps
+    paint_layer.implementation.max_repeat_count = 1
+
+    # One drawing per distinct mesh, frames showing the same mesh reuse its drawing.
+    # Quill stores a fully expanded frame list.
+    mesh_keys = sampler.get_mesh_keys(obj)
+    meshes = sampler.get_meshes(obj)
+    key_to_drawing = {}
+    paint_layer.implementation.frames = []
+    for key in mesh_keys:
+        if key not in key_to_drawing:
+            drawing = sequence.Drawing.from_default()
+            set_drawing_data(drawing, meshes[key], config)
+            paint_layer.implementation.drawings.append(drawing)
+            key_to_drawing[key] = len(paint_layer.implementation.drawings) - 1
+
+        paint_layer.implementation.frames.append(key_to_drawing[key])
+
+    logging.info("Exported animated wireframe of %s: %d drawings over %d frames.", obj.name, len(key_to_drawing), len(mesh_keys))
+
+    return paint_layer
+
+
+# Modifiers whose result only depends on the mesh and their own settings.
+# Other modifiers may depend on time, simulations or other objects.
+STATIC_MODIFIERS = {
+    'BEVEL', 'DECIMATE', 'EDGE_SPLIT', 'MIRROR', 'REMESH', 'SCREW', 'SKIN', 'SOLIDIFY',
+    'SUBSURF', 'TRIANGULATE', 'WELD', 'WIREFRAME', 'ARRAY', 'MULTIRES', 'SMOOTH', 'LAPLACIANSMOOTH',
+}
+
+
+def is_deforming(obj):
+    """
+    Whether the evaluated mesh of the object may change over time.
+
+    Every frame of these meshes is evaluated and read during sampling, which is costly,
+    so static modifiers (e.g. a Subdivision Surface alone) and shape keys without animation
+    don't count.
+    """
+
+    if hasattr(obj, "keymesh") and obj.keymesh.active:
+        return True
+
+    mesh = obj.data
+    if mesh.animation_data is not None:
+        return True
+
+    if mesh.shape_keys is not None and mesh.shape_keys.animation_data is not None:
+        return True
+
+    return any(is_modifier_animated(obj, modifier) for modifier in obj.modifiers)
+
+
+def is_modifier_animated(obj, modifier):
+    """Whether the result of a modifier may change over time."""
+
+    if modifier.type not in STATIC_MODIFIERS:
+        return True
+
+    # Animated or driven settings.
+    if obj.animation_data is not None:
+        prefix = 'modifiers["%s"]' % modifier.name
+        fcurves = list(obj.animation_data.drivers) + timeline.get_fcurves(obj)
+        if any(fcurve.data_path.startswith(prefix) for fcurve in fcurves):
+            return True
+
+    # Settings referencing other objects, e.g. a mirror object or an array offset object.
+    for prop in modifier.bl_rna.properties:
+        if prop.type == 'POINTER' and getattr(prop.fixed_type, "identifier", None) == "Object":
+            if getattr(modifier, prop.identifier) is not None:
+                return True
+
+    return False
+
+
+def set_drawing_data(drawing, mesh_arrays, config):
+    drawing.data = make_drawing_arrays(mesh_arrays, config)
+    if drawing.data.stroke_count > 0:
+        drawing.bounding_box = quill_utils.bbox_add(drawing.bounding_box, drawing.data.get_bounding_box())
+
+
+class MeshArrays:
+    """
+    Vertices, edges and face corners of a mesh, read in bulk.
+
+    Positions are in Quill's coordinate system and edges are sorted vertex pairs, like `mesh.edge_keys`.
+    A face corner is a loop vertex with the edges of the loop and of the previous loop of the polygon.
+    """
+
+    def __init__(self, mesh):
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", co)
+        self.positions = utils.swizzle_yup_locations(co.reshape(-1, 3).astype(np.float64))
+
+        edges = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+        mesh.edges.foreach_get("vertices", edges)
+        self.edges = np.sort(edges.reshape(-1, 2), axis=1)
+
+        loop_count = len(mesh.loops)
+        self.loop_vertices = np.empty(loop_count, dtype=np.int32)
+        self.loop_edges = np.empty(loop_count, dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", self.loop_vertices)
+        mesh.loops.foreach_get("edge_index", self.loop_edges)
 
-    brush_size = max(min(config["wireframe_stroke_width"], max_size), min_size)
-    segments = math.ceil(dist * config["wireframe_segments_per_unit"])
-    segments = max(segments, 3)
+        loop_starts = np.empty(len(mesh.polygons), dtype=np.int32)
+        loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("loop_start", loop_starts)
+        mesh.polygons.foreach_get("loop_total", loop_totals)
 
-    points = []
-    for i in range(segments):
-        points.append(start.lerp(end, i / segments))
-    points.append(end)
+        # The edge of a loop goes from the loop vertex to the next one, so at the loop vertex
+        # it meets the edge of the previous loop of the polygon.
+        polygon_of_loop = np.repeat(np.arange(len(loop_starts)), loop_totals)
+        previous_loops = np.arange(loop_count) - 1
+        first_loops = previous_loops < loop_starts[polygon_of_loop]
+        previous_loops[first_loops] += loop_totals[polygon_of_loop[first_loops]]
+        self.previous_loop_edges = self.loop_edges[previous_loops]
+
+    def get_hash(self):
+        """Digest of the geometry and topology, to detect identical meshes."""
+        digest = hashlib.blake2b(digest_size=16)
+        for array in (self.positions, self.edges, self.loop_vertices, self.loop_edges):
+            digest.update(np.ascontiguousarray(array).tobytes())
+            digest.update(b"|")
+        return digest.hexdigest()
+
+    def get_face_corners(self):
+        """
+        Pairs of edges meeting at a face corner.
+
+        :return: a set of (vertex, edge, edge) for each corner, in both edge orders.
+        """
+
+        vertices = self.loop_vertices.tolist()
+        edges = self.loop_edges.tolist()
+        previous_edges = self.previous_loop_edges.tolist()
+        corners = set(zip(vertices, edges, previous_edges))
+        corners.update(zip(vertices, previous_edges, edges))
+        return corners
+
+    def get_edge_face_counts(self):
+        """Number of faces using each edge, boundary edges have a single face."""
+        return np.bincount(self.loop_edges, minlength=len(self.edges))
+
+
+def make_drawing_arrays(mesh_arrays, config):
+    """Produce the paint strokes for the edges of the mesh, as a DrawingArrays."""
+
+    positions = mesh_arrays.positions
+    edges = mesh_arrays.edges
+
+    if config["wireframe_mode"] == "POLYLINES":
+        # Produce a paint stroke for each chain of connected edges.
+        chain_vertices, chain_sizes = chain_edges(edges, len(positions), mesh_arrays.get_face_corners(), mesh_arrays.get_edge_face_counts())
+    else:
+        # Produce a paint stroke for each edge.
+        chain_vertices = edges.ravel()
+        chain_sizes = np.full(len(edges), 2, dtype=np.int64)
 
     # Location of the blender camera, used to get a normal.
-    camera_position = mathutils.Vector((0, 0, 0))
+    camera_position = np.zeros(3)
     camera = bpy.context.scene.camera
     if camera is not None:
-        camera_position = bpy.context.scene.camera.matrix_world.to_translation()
-        camera_position = utils.swizzle_yup_location(camera_position)
+        camera_position = np.array(utils.swizzle_yup_location(camera.matrix_world.to_translation()))
+
+    return make_strokes(positions, chain_vertices, chain_sizes, camera_position, config)
+
+
+def chain_edges(edges, vertex_count, corners, edge_face_counts):
+    """
+    Chain connected edges into polylines.
+
+    A polyline goes through vertices connected to exactly two edges, follows the edge loops
+    through vertices connected to four edges, and follows open borders through boundary vertices
+    connected to three edges, like Blender edge loop selection.
+    It stops at the other vertices (ends of wires, poles, interior edges reaching a boundary).
+
+    :param edges: (m, 2) vertex pairs.
+    :param vertex_count: number of vertices of the mesh.
+    :param corners: face corners, see MeshArrays.get_face_corners.
+    :param edge_face_counts: number of faces using each edge, see MeshArrays.get_edge_face_counts.
+    :return: the vertex indices of all the polylines one after the other, and the number of vertices of each polyline.
+        Closed loops end with their first vertex.
+    """
+
+    edge_count = len(edges)
+    if edge_count == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Edges connected to each vertex.
+    vertex_edges = [[] for i in range(vertex_count)]
+    for e, (v1, v2) in enumerate(edges.tolist()):
+        vertex_edges[v1].append(e)
+        vertex_edges[v2].append(e)
+
+    edge_list = edges.tolist()
+    used = np.zeros(edge_count, dtype=bool)
+
+    def next_edge(v, e):
+        # Edge continuing the polyline arriving at vertex v through edge e.
+        connected = vertex_edges[v]
+        if len(connected) == 2:
+            candidates = [c for c in connected if c != e]
+        elif len(connected) == 4:
+            # Follow the edge loop: the continuation does not share a face with the incoming edge.
+            candidates = [c for c in connected if c != e and (v, e, c) not in corners]
+        elif len(connected) == 3 and edge_face_counts[e] == 1:
+            # Boundary vertex: follow the border along the other boundary edge, not the interior one.
+            candidates = [c for c in connected if c != e and edge_face_counts[c] == 1]
+        else:
+            return None
+
+        if len(candidates) != 1 or used[candidates[0]]:
+            return None
+
+        return candidates[0]
+
+    def walk(v, e):
+        # Vertices visited going through v from edge e, until the polyline stops.
+        vertices = []
+        while True:
+            e = next_edge(v, e)
+            if e is None:
+                return vertices
+            used[e] = True
+            v1, v2 = edge_list[e]
+            v = v2 if v == v1 else v1
+            vertices.append(v)
+
+    chain_vertices = []
+    chain_sizes = []
+    for e in range(edge_count):
+        if used[e]:
+            continue
+
+        used[e] = True
+        v1, v2 = edge_list[e]
+        forward = walk(v2, e)
+        backward = walk(v1, e)
+        chain = backward[::-1] + [v1, v2] + forward
+        chain_vertices.extend(chain)
+        chain_sizes.append(len(chain))
+
+    return np.array(chain_vertices, dtype=np.int64), np.array(chain_sizes, dtype=np.int64)
+
+
+def make_strokes(positions, chain_vertices, chain_sizes, camera_position, config):
+    """
+    Generate the paint strokes for polylines of mesh vertices.
+
+    Each segment of a polyline is subdivided according to the resolution option.
+    The stroke width is tapered to a minimum at both ends.
+
+    :param positions: (n, 3) vertex positions, in Quill's coordinate system (Y up, Z forward).
+    :param chain_vertices: vertex indices of the polylines, one after the other.
+    :param chain_sizes: number of vertices of each polyline.
+    :param camera_position: position used to orient the normals.
+    """
+
+    min_size = 0.001
+    min_length = 0.004
+    epsilon = 0.0000001
+
+    # Segments of the polylines, ignoring those of zero length.
+    chain_count = len(chain_sizes)
+    chain_of_vertex = np.repeat(np.arange(chain_count), chain_sizes)
+    is_segment = chain_of_vertex[1:] == chain_of_vertex[:-1]
+    starts = positions[chain_vertices[:-1][is_segment]]
+    ends = positions[chain_vertices[1:][is_segment]]
+    segment_chains = chain_of_vertex[:-1][is_segment]
+    lengths = np.linalg.norm(ends - starts, axis=1)
+
+    valid = lengths >= epsilon
+    starts, ends, segment_chains, lengths = starts[valid], ends[valid], segment_chains[valid], lengths[valid]
+
+    # Ignore the polylines that are too short.
+    chain_lengths = np.bincount(segment_chains, weights=lengths, minlength=chain_count)
+    kept_chains = chain_lengths >= min_length
+    valid = kept_chains[segment_chains]
+    starts, ends, segment_chains, lengths = starts[valid], ends[valid], segment_chains[valid], lengths[valid]
+    if len(lengths) == 0:
+        return paint.DrawingArrays()
+
+    # Renumber the strokes.
+    stroke_ids = np.cumsum(kept_chains) - 1
+    segment_strokes = stroke_ids[segment_chains]
+    stroke_lengths = chain_lengths[kept_chains]
+    stroke_count = len(stroke_lengths)
+    segment_counts = np.bincount(segment_strokes, minlength=stroke_count)
+
+    # Number of subdivisions of each segment. Strokes have at least 3 subdivisions overall.
+    min_pieces = np.ceil(3 / segment_counts).astype(np.int64)[segment_strokes]
+    pieces = np.maximum(np.ceil(lengths * config["wireframe_segments_per_unit"]).astype(np.int64), min_pieces)
 
-    # The stroke is straight so all points have the same tangent.
-    tangent = (end - start).normalized()
+    # Layout of the points: the subdivisions of each segment, then the end of the stroke.
+    stroke_sizes = np.bincount(segment_strokes, weights=pieces, minlength=stroke_count).astype(np.int64) + 1
+    stroke_offsets = np.zeros(stroke_count, dtype=np.int64)
+    stroke_offsets[1:] = np.cumsum(stroke_sizes)[:-1]
+    segment_offsets = np.zeros(len(pieces), dtype=np.int64)
+    segment_offsets[1:] = np.cumsum(pieces)[:-1]
+    first_segments = np.searchsorted(segment_strokes, np.arange(stroke_count))
+    segment_starts = stroke_offsets[segment_strokes] + segment_offsets - segment_offsets[first_segments][segment_strokes]
+    last_points = stroke_offsets + stroke_sizes - 1
+    last_segments = np.append(first_segments[1:], len(pieces)) - 1
 
-    vertices = []
-    for i in range(len(points)):
+    vertex_count = int(stroke_sizes.sum())
+    point_positions = np.empty((vertex_count, 3))
+    tangents = np.empty((vertex_count, 3))
 
-        p = points[i]
+    # Subdivisions.
+    directions = (ends - starts) / lengths[:, None]
+    point_segments = np.repeat(np.arange(len(pieces)), pieces)
+    j = np.arange(len(point_segments)) - segment_offsets[point_segments]
+    indices = segment_starts[point_segments] + j
+    k = (j / pieces[point_segments])[:, None]
+    point_positions[indices] = starts[point_segments] + (ends - starts)[point_segments] * k
+    tangents[indices] = directions[point_segments]
 
-        # Set the normal to be in the direction of the camera.
-        normal = (camera_position - p).normalized()
-        color = (0, 0, 0)
-        opacity = 1.0
-        width = min_size if (i == 0 or i == segments) else brush_size
-        vertex = paint.Vertex(p, normal, tangent, color, opacity, width)
-        vertices.append(vertex)
+    # At joints the tangent is the average of the directions of both segments.
+    joints = np.ones(len(pieces), dtype=bool)
+    joints[first_segments] = False
+    joint_tangents = directions[np.nonzero(joints)[0] - 1] + directions[joints]
+    fallback = directions[joints]
+    joint_tangents = np.where(np.linalg.norm(joint_tangents, axis=1)[:, None] >= epsilon, joint_tangents, fallback)
+    tangents[segment_starts[joints]] = utils.normalize(joint_tangents)
 
-    bounding_box = quill_utils.bbox_from_points(start, end)
+    # End of the strokes.
+    point_positions[last_points] = ends[last_segments]
+    tangents[last_points] = directions[last_segments]
 
-    stroke = paint.Stroke(id, bounding_box, brush_type, disable_rotational_opacity, vertices)
-    return stroke
+    # Widths: minimum at the ends of the strokes.
+    max_size = stroke_lengths / 4
+    brush_sizes = np.maximum(np.minimum(config["wireframe_stroke_width"], max_size), min_size)
+    widths = np.repeat(brush_sizes, stroke_sizes)
+    widths[stroke_offsets] = min_size
+    widths[last_points] = min_size
 
+    arrays = paint.DrawingArrays(stroke_count, vertex_count)
+    arrays.sizes[:] = stroke_sizes
+    arrays.offsets[:] = stroke_offsets
+    arrays.ids[:] = np.arange(stroke_count)
+    arrays.brush_types[:] = paint.BrushType.CYLINDER.value
+    arrays.disable_rotational_opacity[:] = True
 
+    arrays.positions[:] = point_positions
+    # Set the normal to be in the direction of the camera.
+    arrays.normals[:] = utils.normalize(camera_position - point_positions)
+    arrays.tangents[:] = tangents
+    arrays.colors[:] = 0
+    arrays.opacities[:] = 1.0
+    arrays.widths[:] = widths
 
+    arrays.bounding_boxes[:, :3] = np.minimum.reduceat(point_positions, stroke_offsets, axis=0)
+    arrays.bounding_boxes[:, 3:] = np.maximum.reduceat(point_positions, stroke_offsets, axis=0)
 
+    return arrays
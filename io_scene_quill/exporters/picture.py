@@ -1,4 +1,6 @@
 import bpy
+import logging
+import numpy as np
 from ..model import picture, quill_utils
 
 def convert(obj, config):
@@ -35,9 +37,43 @@ def convert(obj, config):
     picture_data.hasAlpha = True
     picture_data.width = obj.data.size[0]
     picture_data.height = obj.data.size[1]
+    picture_data.pixels = get_pixels(obj.data)
 
-    # Blender stores the data as [0..1] floats, RGB(A).
-    # We convert to [0..255] bytes in the write function.
-    picture_data.pixels = obj.data.pixels
+    # Compress the image in the qbin if requested.
+    # Quill only reads raw pixels, files with compressed pictures can only be opened by this add-on.
+    if config["picture_compression"] == "PNG":
+        logging.warning("Picture %s is stored as PNG, the exported file can't be opened in Quill.", obj.name)
+        picture_data.encoding = picture.AssetFormat.PNG
 
     return picture_layer
+
+
+def get_pixels(image):
+    """
+    Read the pixels of a Blender image as RGBA bytes.
+
+    Blender stores the data as [0..1] floats, with rows from bottom to top.
+    We keep the row order, which is the one of the qbin picture data.
+    """
+
+    width, height = image.size
+    channels = image.channels
+
+    # Fetch the whole buffer at once and convert to [0..255] bytes.
+    buffer = np.empty(width * height * channels, dtype=np.float32)
+    image.pixels.foreach_get(buffer)
+    pixels = picture.quantize(buffer).reshape(height, width, channels)
+
+    # Expand grey and RGB images to RGBA.
+    if channels == 4:
+        return pixels
+
+    rgba = np.full((height, width, 4), 255, dtype=np.uint8)
+    if channels < 3:
+        rgba[:, :, :3] = pixels[:, :, :1]
+    else:
+        rgba[:, :, :3] = pixels[:, :, :3]
+    if channels == 2:
+        rgba[:, :, 3] = pixels[:, :, 1]
+
+    return rgba
@@ -0,0 +1,369 @@
+import bpy
+import numpy as np
+
+from ..utils import timeline
+from .paint_wireframe import MeshArrays
+
+
+class FrameSampler:
+    """
+    Records the animated state of the exported objects over the scene frame range.
+
+    Evaluating a frame is costly as it re-evaluates the whole depsgraph,
+    so instead of stepping the timeline for each layer, we step it once and record
+    everything the layers will need: local matrices, visibility, pose-bone bases
+    and evaluated meshes.
+    Key frames are then built from the recorded samples.
+
+    In fast mode, objects whose local transform only depends on their own action
+    are evaluated directly from their F-curves, and the timeline is only stepped
+    for the remaining objects, if any.
+    """
+
+    def __init__(self, frame_start, frame_end, fast=False):
+        self.frame_start = frame_start
+        self.frame_end = max(frame_end, frame_start)
+        self.fast = fast
+
+        # Objects to sample and what to record for them.
+        # Objects in `direct_objects` are evaluated from their F-curves.
+        self.objects = []
+        self.direct_objects = []
+        self.armatures = []
+        self.meshes = []
+
+        # Recorded samples, indexed by object name.
+        # matrices: (frames, 4, 4) local matrices.
+        # visibility: (frames,) result of visible_get().
+        # pose_bases: (frames, bones, 4, 4) matrix_basis of the pose bones, in pose.bones order.
+        self.matrices = {}
+        self.visibility = {}
+        self.pose_bases = {}
+
+        # Evaluated meshes, indexed by object name.
+        # mesh_keys: list of the hash of the evaluated mesh on each frame.
+        # mesh_arrays: map from hash to the MeshArrays of the distinct meshes.
+        self.mesh_keys = {}
+        self.mesh_arrays = {}
+
+    @property
+    def frame_count(self):
+        return self.frame_end - self.frame_start + 1
+
+    def add_object(self, obj):
+        if obj.name in self.matrices:
+            return
+
+        self.matrices[obj.name] = np.zeros((self.frame_count, 4, 4))
+        self.visibility[obj.name] = np.zeros(self.frame_count, dtype=bool)
+
+        if self.fast and can_evaluate_directly(obj):
+            self.direct_objects.append(obj)
+        else:
+            self.objects.append(obj)
+
+    def add_armature(self, obj):
+        if obj.name not in self.pose_bases:
+            self.armatures.append(obj)
+            self.pose_bases[obj.name] = np.zeros((self.frame_count, len(obj.pose.bones), 4, 4))
+
+    def add_mesh(self, obj):
+        if obj.name not in self.mesh_keys:
+            self.meshes.append(obj)
+            self.mesh_keys[obj.name] = []
+            self.mesh_arrays[obj.name] = {}
+
+    def sample(self):
+        """Record all the samples, stepping the timeline once if needed."""
+
+        frames = np.arange(self.frame_start, self.frame_end + 1)
+        for obj in self.direct_objects:
+            self.matrices[obj.name][:] = evaluate_matrices(obj, frames)
+            self.visibility[obj.name][:] = evaluate_visibility(obj, frames)
+
+        if len(self.objects) == 0 and len(self.armatures) == 0 and len(self.meshes) == 0:
+            return
+
+        scn = bpy.context.scene
+        memo_current_frame = scn.frame_current
+
+        for i, frame in enumerate(range(self.frame_start, self.frame_end + 1)):
+            scn.frame_set(frame)
+
+            for obj in self.objects:
+                self.matrices[obj.name][i] = obj.matrix_local
+                self.visibility[obj.name][i] = obj.visible_get()
+
+            for obj in self.armatures:
+                self.pose_bases[obj.name][i] = get_pose_bases(obj)
+
+            if len(self.meshes) > 0:
+                depsgraph = bpy.context.evaluated_depsgraph_get()
+                for obj in self.meshes:
+                    self.record_mesh(obj, depsgraph)
+
+        # Restore the active frame
+        scn.frame_set(memo_current_frame)
+
+    def record_mesh(self, obj, depsgraph):
+        """Record the evaluated mesh of the object at the current frame, storing each distinct mesh once."""
+
+        obj_eval = obj.evaluated_get(depsgraph)
+        mesh = obj_eval.to_mesh()
+        mesh_arrays = MeshArrays(mesh)
+        obj_eval.to_mesh_clear()
+
+        key = mesh_arrays.get_hash()
+        self.mesh_keys[obj.name].append(key)
+        self.mesh_arrays[obj.name].setdefault(key, mesh_arrays)
+
+    def get_index(self, frame):
+        """Index of the sample for `frame`."""
+        return frame - self.frame_start
+
+    def get_matrices(self, obj):
+        return self.matrices.get(obj.name)
+
+    def get_visibility(self, obj):
+        return self.visibility.get(obj.name)
+
+    def get_pose_bases(self, obj):
+        return self.pose_bases.get(obj.name)
+
+    def get_mesh_keys(self, obj):
+        return self.mesh_keys.get(obj.name)
+
+    def get_meshes(self, obj):
+        return self.mesh_arrays.get(obj.name)
+
+
+def get_pose_bases(obj):
+    """matrix_basis of all the pose bones of an armature at the current frame, as an array (bones, 4, 4)."""
+
+    pose_bones = obj.pose.bones
+    bases = np.empty(len(pose_bones) * 16, dtype=np.float32)
+    pose_bones.foreach_get("matrix_basis", bases)
+
+    # Matrices are flattened column by column.
+    return bases.reshape(-1, 4, 4).transpose(0, 2, 1)
+
+
+# Transform channels that can be evaluated directly, and their length.
+TRANSFORM_CHANNELS = {
+    "location": 3,
+    "rotation_euler": 3,
+    "rotation_quaternion": 4,
+    "rotation_axis_angle": 4,
+    "scale": 3,
+    "delta_location": 3,
+    "delta_rotation_euler": 3,
+    "delta_rotation_quaternion": 4,
+    "delta_scale": 3,
+}
+
+
+def can_evaluate_directly(obj):
+    """
+    Whether the local matrix and visibility of the object only depend on its own action.
+
+    This excludes objects with constraints, drivers, NLA or a blended action (influence or blend mode),
+    objects parented to a bone or vertices,
+    objects moved by a simulation, and objects that may be hidden by something else
+    than their own hide_viewport property.
+    """
+
+    if len(obj.constraints) > 0:
+        return False
+
+    # Rigid bodies are moved by the simulation, not by their F-curves.
+    if obj.rigid_body is not None:
+        return False
+
+    if obj.parent is not None and obj.parent_type != 'OBJECT':
+        return False
+
+    anim_data = obj.animation_data
+    if anim_data is not None:
+        if len(anim_data.drivers) > 0:
+            return False
+        if len(anim_data.nla_tracks) > 0 or anim_data.use_tweak_mode:
+            return False
+
+        # The action must fully replace the values, blending depends on the current state.
+        if anim_data.action_influence != 1.0 or anim_data.action_blend_type != 'REPLACE':
+            return False
+
+    # Visibility must only be controlled by the object itself.
+    view_layer = bpy.context.view_layer
+    if obj.name not in view_layer.objects or obj.hide_get():
+        return False
+    if not are_collections_visible(obj, view_layer):
+        return False
+
+    for fcurve in timeline.get_fcurves(obj):
+        if fcurve.data_path == "rotation_mode":
+            return False
+
+    return True
+
+
+def are_collections_visible(obj, view_layer):
+    """
+    Whether all the collections of the object are visible in the view layer, including their parent collections.
+    Any of these can hide the object with their own (possibly animated) visibility properties.
+    """
+
+    collections = set(obj.users_collection)
+    found = set()
+
+    def visit(layer_collection, visible):
+        visible = visible and not layer_collection.exclude and not layer_collection.hide_viewport
+        visible = visible and not layer_collection.collection.hide_viewport
+        if layer_collection.collection in collections:
+            found.add(layer_collection.collection)
+            if not visible:
+                return False
+
+        for child in layer_collection.children:
+            if not visit(child, visible):
+                return False
+
+        return True
+
+    if not visit(view_layer.layer_collection, True):
+        return False
+
+    # The scene collection itself is the root of the view layer.
+    return found == collections
+
+
+def evaluate_channels(obj, frames):
+    """
+    Evaluate the transform channels of the object on each frame.
+
+    Returns a dictionary mapping the channel name to an array of shape (frames, length).
+    Channels that are not animated, or whose F-curve is muted, hold their current value.
+    """
+
+    channels = {}
+    for name, length in TRANSFORM_CHANNELS.items():
+        value = np.array(getattr(obj, name), dtype=np.float64)
+        channels[name] = np.tile(value, (len(frames), 1))
+
+    for fcurve in timeline.get_fcurves(obj):
+        # Muted channels keep their current value.
+        if fcurve.mute:
+            continue
+
+        if fcurve.data_path not in channels or fcurve.array_index >= TRANSFORM_CHANNELS[fcurve.data_path]:
+            continue
+
+        values = channels[fcurve.data_path]
+        for i, frame in enumerate(frames):
+            values[i, fcurve.array_index] = fcurve.evaluate(frame)
+
+    return channels
+
+
+def evaluate_matrices(obj, frames):
+    """Local matrices of the object on each frame, computed from its F-curves."""
+
+    channels = evaluate_channels(obj, frames)
+    mode = obj.rotation_mode
+
+    if mode == 'QUATERNION':
+        rotation = quaternion_to_matrix(channels["rotation_quaternion"])
+        delta_rotation = quaternion_to_matrix(channels["delta_rotation_quaternion"])
+    elif mode == 'AXIS_ANGLE':
+        rotation = axis_angle_to_matrix(channels["rotation_axis_angle"])
+        delta_rotation = np.broadcast_to(np.identity(3), rotation.shape)
+    else:
+        rotation = euler_to_matrix(channels["rotation_euler"], mode)
+        delta_rotation = euler_to_matrix(channels["delta_rotation_euler"], mode)
+
+    location = channels["location"] + channels["delta_location"]
+    scale = channels["scale"] * channels["delta_scale"]
+
+    # matrix_basis = T @ R @ S, the delta rotation is applied after the rotation.
+    basis = np.zeros((len(frames), 4, 4))
+    basis[:, :3, :3] = (delta_rotation @ rotation) * scale[:, None, :]
+    basis[:, :3, 3] = location
+    basis[:, 3, 3] = 1
+
+    if obj.parent is None:
+        return basis
+
+    # matrix_local = matrix_parent_inverse @ matrix_basis.
+    parent_inverse = np.array(obj.matrix_parent_inverse, dtype=np.float64)
+    return parent_inverse @ basis
+
+
+def evaluate_visibility(obj, frames):
+    """Visibility of the object on each frame, from its hide_viewport property."""
+
+    fcurve = timeline.get_fcurve(obj, "hide_viewport")
+    if fcurve is None or fcurve.mute:
+        return np.full(len(frames), not obj.hide_viewport)
+
+    return np.array([fcurve.evaluate(frame) < 0.5 for frame in frames])
+
+
+def euler_to_matrix(euler, order='XYZ'):
+    """Rotation matrices of shape (n, 3, 3) from Euler angles of shape (n, 3) in the given order."""
+
+    count = len(euler)
+    matrices = {}
+    for axis, index in (('X', 0), ('Y', 1), ('Z', 2)):
+        c = np.cos(euler[:, index])
+        s = np.sin(euler[:, index])
+        m = np.zeros((count, 3, 3))
+        a, b = [k for k in range(3) if k != index]
+        m[:, index, index] = 1
+        m[:, a, a] = c
+        m[:, b, b] = c
+        if axis == 'Y':
+            m[:, a, b] = s
+            m[:, b, a] = -s
+        else:
+            m[:, a, b] = -s
+            m[:, b, a] = s
+        matrices[axis] = m
+
+    # The first axis of the order is applied first.
+    return matrices[order[2]] @ matrices[order[1]] @ matrices[order[0]]
+
+
+def quaternion_to_matrix(quaternions):
+    """Rotation matrices of shape (n, 3, 3) from WXYZ quaternions of shape (n, 4)."""
+
+    norm = np.linalg.norm(quaternions, axis=1)
+    norm[norm == 0] = 1
+    w, x, y, z = (quaternions / norm[:, None]).T
+
+    m = np.empty((len(quaternions), 3, 3))
+    m[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    m[:, 0, 1] = 2 * (x * y - w * z)
+    m[:, 0, 2] = 2 * (x * z + w * y)
+    m[:, 1, 0] = 2 * (x * y + w * z)
+    m[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    m[:, 1, 2] = 2 * (y * z - w * x)
+    m[:, 2, 0] = 2 * (x * z - w * y)
+    m[:, 2, 1] = 2 * (y * z + w * x)
+    m[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return m
+
+
+def axis_angle_to_matrix(axis_angles):
+    """Rotation matrices of shape (n, 3, 3) from (angle, x, y, z) of shape (n, 4)."""
+
+    angle = axis_angles[:, 0]
+    axis = axis_angles[:, 1:]
+    norm = np.linalg.norm(axis, axis=1)
+    valid = norm > 0
+    axis = np.where(valid[:, None], axis / np.where(valid, norm, 1)[:, None], 0)
+    angle = np.where(valid, angle, 0)
+
+    # Rodrigues formula through the equivalent quaternion.
+    half = angle / 2
+    quaternions = np.concatenate((np.cos(half)[:, None], axis * np.sin(half)[:, None]), axis=1)
+    return quaternion_to_matrix(quaternions)
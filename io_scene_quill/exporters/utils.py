@@ -1,4 +1,5 @@
 import bpy
+import numpy as np
 from mathutils import Matrix, Vector, Quaternion, Euler
 
 # Functions to convert from Blender coordinate system to Quill’s.
@@ -55,3 +56,164 @@ def transform_equals(m1: Matrix, m2: Matrix, epsilon=1e-6):
                 return False
 
     return True
+
+
+# Batched versions of the above, working on arrays of points of shape (n, 3)
+# or arrays of matrices of shape (n, 4, 4).
+
+def swizzle_yup_locations(locations):
+    """Array version of swizzle_yup_location."""
+    return np.stack((locations[:, 0], locations[:, 2], -locations[:, 1]), axis=1)
+
+
+def normalize(vectors, epsilon=0.0):
+    """Normalize an array of vectors, vectors shorter than epsilon are set to zero."""
+    lengths = np.linalg.norm(vectors, axis=1)
+    valid = lengths > epsilon
+    result = np.zeros_like(vectors)
+    result[valid] = vectors[valid] / lengths[valid, None]
+    return result
+
+
+def matrices_to_quaternions(m):
+    """Convert an array of pure rotation matrices (n, 3, 3) to WXYZ quaternions (n, 4), with w >= 0."""
+
+    count = len(m)
+    q = np.empty((count, 4))
+    trace = m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2]
+
+    # Pick the most stable formula for each matrix based on the largest diagonal term.
+    case_w = trace > 0
+    case_x = ~case_w & (m[:, 0, 0] >= m[:, 1, 1]) & (m[:, 0, 0] >= m[:, 2, 2])
+    case_y = ~case_w & ~case_x & (m[:, 1, 1] >= m[:, 2, 2])
+    case_z = ~case_w & ~case_x & ~case_y
+
+    i = case_w
+    s = np.sqrt(1.0 + trace[i]) * 2
+    q[i, 0] = 0.25 * s
+    q[i, 1] = (m[i, 2, 1] - m[i, 1, 2]) / s
+    q[i, 2] = (m[i, 0, 2] - m[i, 2, 0]) / s
+    q[i, 3] = (m[i, 1, 0] - m[i, 0, 1]) / s
+
+    i = case_x
+    s = np.sqrt(np.maximum(1.0 + m[i, 0, 0] - m[i, 1, 1] - m[i, 2, 2], 1e-12)) * 2
+    q[i, 0] = (m[i, 2, 1] - m[i, 1, 2]) / s
+    q[i, 1] = 0.25 * s
+    q[i, 2] = (m[i, 0, 1] + m[i, 1, 0]) / s
+    q[i, 3] = (m[i, 0, 2] + m[i, 2, 0]) / s
+
+    i = case_y
+    s = np.sqrt(np.maximum(1.0 + m[i, 1, 1] - m[i, 0, 0] - m[i, 2, 2], 1e-12)) * 2
+    q[i, 0] = (m[i, 0, 2] - m[i, 2, 0]) / s
+    q[i, 1] = (m[i, 0, 1] + m[i, 1, 0]) / s
+    q[i, 2] = 0.25 * s
+    q[i, 3] = (m[i, 1, 2] + m[i, 2, 1]) / s
+
+    i = case_z
+    s = np.sqrt(np.maximum(1.0 + m[i, 2, 2] - m[i, 0, 0] - m[i, 1, 1], 1e-12)) * 2
+    q[i, 0] = (m[i, 1, 0] - m[i, 0, 1]) / s
+    q[i, 1] = (m[i, 0, 2] + m[i, 2, 0]) / s
+    q[i, 2] = (m[i, 1, 2] + m[i, 2, 1]) / s
+    q[i, 3] = 0.25 * s
+
+    q /= np.linalg.norm(q, axis=1)[:, None]
+    q[q[:, 0] < 0] *= -1
+    return q
+
+
+def decompose_matrices(matrices):
+    """
+    Decompose an array of matrices (n, 4, 4) into translations (n, 3), WXYZ quaternions (n, 4) and scales (n, 3).
+    Same convention as Matrix.decompose(): a negative determinant is carried by the scale.
+    """
+
+    matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+    translations = matrices[:, :3, 3].copy()
+    basis = matrices[:, :3, :3]
+
+    scales = np.linalg.norm(basis, axis=1)
+    negative = np.linalg.det(basis) < 0
+    scales[negative] *= -1
+
+    safe_scales = np.where(scales == 0, 1, scales)
+    rotations = matrices_to_quaternions(basis / safe_scales[:, None, :])
+
+    return translations, rotations, scales
+
+
+def convert_transforms(matrices):
+    """Convert an array of Blender matrices (n, 4, 4) to Quill transforms, as arrays."""
+    translations, rotations, scales = decompose_matrices(matrices)
+
+    # swizzle_yup_location, swizzle_yup_rotation + swizzle_quaternion, swizzle_yup_scale.
+    translations = np.stack((translations[:, 0], translations[:, 2], -translations[:, 1]), axis=1)
+    rotations = np.stack((rotations[:, 1], rotations[:, 3], -rotations[:, 2], rotations[:, 0]), axis=1)
+    scales = np.stack((scales[:, 0], scales[:, 2], scales[:, 1]), axis=1)
+    flips = ["N"] * len(matrices)
+
+    return translations, rotations, scales, flips
+
+
+def convert_transforms_raw(matrices):
+    """Convert an array of Blender matrices (n, 4, 4) to Quill transforms, as arrays, without swizzling axes."""
+    translations, rotations, scales = decompose_matrices(matrices)
+
+    # Don't change the axes but do change the quat format.
+    rotations = np.stack((rotations[:, 1], rotations[:, 2], rotations[:, 3], rotations[:, 0]), axis=1)
+    flips = ["N"] * len(matrices)
+
+    return translations, rotations, scales, flips
+
+
+def transform_change_mask(matrices, epsilon=1e-6):
+    """
+    Mask of the matrices (n, 4, 4) that differ from the previous one in the array, with a tolerance.
+    The first matrix is always marked as changed.
+    """
+
+    matrices = np.asarray(matrices).reshape(-1, 16)
+    mask = np.ones(len(matrices), dtype=bool)
+    mask[1:] = np.any(np.abs(matrices[1:] - matrices[:-1]) > epsilon, axis=1)
+    return mask
+
+
+# Number of matrices compared at once when looking for the next change.
+CHANGE_SCAN_CHUNK = 64
+
+
+def transform_change_indices(matrices, epsilon=1e-6):
+    """
+    Indices of the matrices (n, 4, 4) that differ from the last retained one, with a tolerance.
+
+    This is the batched equivalent of comparing each matrix to the matrix of the last key frame
+    with `transform_equals`. The first matrix is always retained.
+    """
+
+    matrices = np.asarray(matrices).reshape(-1, 16)
+    count = len(matrices)
+    if count == 0:
+        return []
+
+    # Common case: the matrix changes on every sample, they are all retained.
+    changes = transform_change_mask(matrices, epsilon)
+    if np.all(changes):
+        return list(range(count))
+
+    indices = [0]
+    last = 0
+    start = 1
+    while start < count:
+        # Look for the next matrix that differs from the last retained one,
+        # scanning forward in chunks so we don't compare the whole tail each time.
+        end = min(start + CHANGE_SCAN_CHUNK, count)
+        differs = np.any(np.abs(matrices[start:end] - matrices[last]) > epsilon, axis=1)
+        found = np.nonzero(differs)[0]
+        if len(found) == 0:
+            start = end
+            continue
+
+        last = start + int(found[0])
+        indices.append(last)
+        start = last + 1
+
+    return indices
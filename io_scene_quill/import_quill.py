@@ -3,7 +3,7 @@ import bpy
 import logging
 import mathutils
 from math import floor, radians
-from .importers import curve_paint, gpencil_paint, mesh_material, mesh_paint, sound_sound
+from .importers import curve_paint, gpencil_paint, image_picture, mesh_material, mesh_paint, sound_sound
 from .model import quill_utils
 from .utils import timeline
 
@@ -16,6 +16,7 @@ class QuillImporter:
         self.material = None
         self.next_empty_channel = -1
         self.lipsync_data = None
+        self.frame_range = None
 
     def __enter__(self):
         return self
@@ -25,8 +26,16 @@ class QuillImporter:
 
     def import_scene(self):
 
+        # Optional frame range, only the drawings visible in that range are loaded and converted.
+        if self.config["use_frame_range"]:
+            frame_start = self.config["frame_range_start"]
+            frame_end = max(self.config["frame_range_end"], frame_start)
+            self.frame_range = (frame_start, frame_end)
+
         # Import the Quill scene to memory, including scene graph and drawing data.
-        quill_scene = quill_utils.import_scene(self.path, self.config["layer_types"], self.config["only_visible"], self.config["only_non_empty"])
+        # Use the same framerate fallback as below so we agree on which drawings are in the frame range.
+        default_framerate = bpy.context.scene.render.fps
+        quill_scene = quill_utils.import_scene(self.path, self.config["layer_types"], self.config["only_visible"], self.config["only_non_empty"], self.frame_range, default_framerate)
         
         if quill_scene.lipsync_data is not None and len(quill_scene.lipsync_data) > 0:
             logging.info("Found lipsync data for %d layers.", len(quill_scene.lipsync_data))
@@ -38,14 +47,20 @@ class QuillImporter:
 
         #bpy.context.scene.frame_set(1)
 
-        # Find the last visible frame to extend the Blender timeline.
-        # This is commented out for now since it may result in very long loading times.
-        # ticks_per_second = 12600
-        # ticks_per_frame = int(ticks_per_second / quill_scene.sequence.framerate)
-        # frame_end = quill_utils.find_last_visible_frame(quill_scene.sequence.root_layer, ticks_per_frame)
-        # if (frame_end > 0 and frame_end > bpy.context.scene.frame_end):
-        #     logging.info("Extending Blender timeline to frame %d.", frame_end)
-        #     bpy.context.scene.frame_end = frame_end
+        if self.frame_range is not None:
+            # Match the Blender timeline to the imported range.
+            bpy.context.scene.frame_start = self.frame_range[0]
+            bpy.context.scene.frame_end = self.frame_range[1]
+        else:
+            # Find the last visible frame to extend the Blender timeline.
+            # This works on the visibility schedule of the layers so it doesn't depend on the number of frames.
+            framerate = quill_scene.sequence.framerate or bpy.context.scene.render.fps
+            ticks_per_second = 12600
+            ticks_per_frame = int(ticks_per_second / framerate)
+            frame_end = quill_utils.find_last_visible_frame(quill_scene.sequence.root_layer, ticks_per_frame)
+            if (frame_end > 0 and frame_end > bpy.context.scene.frame_end):
+                logging.info("Extending Blender timeline to frame %d.", frame_end)
+                bpy.context.scene.frame_end = frame_end
 
         # Create the shared material.
         self.material = None
@@ -122,7 +137,7 @@ class QuillImporter:
                 self.setup_animation(obj, layer, offset)
 
                 # Import the drawings and animate them.
-                mesh_paint.convert(self.config, obj, layer, self.material, use_keymesh, self.lipsync_data)
+                mesh_paint.convert(self.config, obj, layer, self.material, use_keymesh, self.lipsync_data, self.frame_range)
 
             elif self.config["convert_paint"] == "GPENCIL" or self.config["convert_paint"] == "GREASEPENCIL":
 
@@ -138,16 +153,16 @@ class QuillImporter:
                 self.setup_obj(obj, layer, parent_obj, layer_path)
                 self.setup_animation(obj, layer, offset)
 
-                gpencil_paint.convert(obj, layer)
+                gpencil_paint.convert(obj, layer, self.frame_range)
 
             elif self.config["convert_paint"] == "CURVE":
 
-                data = bpy.data.curves.new(layer.name, type='CURVE')
-                obj = bpy.data.objects.new(layer.name, data)
+                # Create an Empty that will become the parent of the individual drawings.
+                obj = bpy.data.objects.new(layer.name, None)
                 self.setup_obj(obj, layer, parent_obj, layer_path)
                 self.setup_animation(obj, layer, offset)
 
-                curve_paint.convert(obj, layer)
+                curve_paint.convert(obj, layer, self.frame_range)
 
         elif layer.type == "Viewpoint":
 
@@ -263,15 +278,19 @@ class QuillImporter:
 
             # Load the image data.
             # Quill stores both the data in Qbin and the file path in JSON.
-            # We just support the path for now, so the file has to be on disk.
+            # Use the file if it's on disk, otherwise create the image from the Qbin data.
             # Note: some characters in the file path may be unsupported like em dash.
             file_path = layer.implementation.import_file_path
-            if not os.path.exists(file_path):
+            if os.path.exists(file_path):
+                image_data = bpy.data.images.load(file_path, check_existing=False)
+            else:
+                image_data = image_picture.convert(layer)
+
+            if image_data is None:
                 logging.warning("Image file not found: %s", file_path)
                 obj.show_name = True
                 return
 
-            image_data = bpy.data.images.load(file_path, check_existing=False)
             obj.data = image_data
 
             # To get the correct size we need to do some shenanigans.
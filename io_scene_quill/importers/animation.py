@@ -1,8 +1,9 @@
 import bpy
+from ..model import schedule
 from ..utils.keymesh import keymesh_keyframe, keymesh_get_blank
 
 
-def animate(drawing_to_obj, layer, use_keymesh, parent_obj):
+def animate(drawing_to_obj, layer, use_keymesh, parent_obj, frame_range=None):
     """
     Animates the paint layer by keyframing the visibility of the drawings.
 
@@ -10,6 +11,7 @@ def animate(drawing_to_obj, layer, use_keymesh, parent_obj):
     :param layer: the Quill paint layer.
     :param use_keymesh: whether we are using Keymesh for this paint layer.
     :param parent_obj: the Blender object representing the paint layer.
+    :param frame_range: (start, end) frames to import, if None it is derived from the Blender frame range.
     """
 
     #--------------------------------------------------------------
@@ -33,10 +35,13 @@ def animate(drawing_to_obj, layer, use_keymesh, parent_obj):
     # We do this to cope with Blender scenes set up between say 1000 and 1249, which is done to create a buffer for simulations.
     # Instead of importing from 0 to 1249 we import from 0 to 249. We don't try to import from 1000 to 1249.
     # Bottom line: if a buffer is needed for simulation, start the frame range in the negative instead of 1000.
+    # If an explicit frame range is requested we leave the scene alone and only generate key frames inside it.
     #--------------------------------------------------------------
     scn = bpy.context.scene
     import_end = scn.frame_end
-    if scn.frame_start <= 0:
+    if frame_range is not None:
+        import_start, import_end = frame_range
+    elif scn.frame_start <= 0:
         import_start = 0
     elif scn.frame_start == 1:
         scn.frame_start = 0
@@ -58,7 +63,7 @@ def animate(drawing_to_obj, layer, use_keymesh, parent_obj):
     # in case of a single, always visible drawing.
     # For keymesh this is already the default state.
     if not use_keymesh:
-        for i in range(len(drawing_to_obj)):
+        for i in drawing_to_obj.keys():
             hide_drawing(i, min(scn.frame_start, import_start), drawing_to_obj)
 
     #--------------------------------------------------------------
@@ -134,45 +139,20 @@ def animate(drawing_to_obj, layer, use_keymesh, parent_obj):
     # For any target frame in the Blender timeline, we do:
     # blender frame -> global time -> local time -> quill frame -> quill drawing -> blender obj.
     # - local time is the time within the low level, base animation sequence, taking offset and looping into account.
-
-
-    # Create a stack of the lineage for this layer all the way up to the root.
-    # We will compute the local time by walking down the tree.
-    stack = [layer]
-    parent = layer.parent
-    while parent is not None:
-        stack.append(parent)
-        parent = parent.parent
-
-    # Loop through the Blender frames and show the corresponding drawing.
-    was_visible = True
+    #
+    # The mapping from global time to local time is compiled once for the whole lineage of the layer,
+    # into a schedule of visible segments (see model/schedule.py), so each frame is a direct lookup.
     ticks_per_second = 12600
     ticks_per_frame = int(ticks_per_second / scn.render.fps)
-    active_drawing_index = -1
-    last_frame = len(layer.implementation.frames) - 1
-    for frame_target in range(import_start, import_end + 1):
-
-        #print("----------------------------------------")
-        #print("Blender frame:", frame_target)
-
-        # Convert Blender frame to Quill ticks.
-        global_time = frame_target * ticks_per_frame
-        visible, local_time = get_local_time(stack, global_time, ticks_per_frame)
-
-        if visible:
-
-            # We are within an active iteration of the fundamental paint level animation.
-            # Convert the time to a frame index
-            frame_source = min(int(local_time / ticks_per_frame), last_frame)
-
-            # Get the actual drawing that should be visible.
-            drawing_index = int(layer.implementation.frames[frame_source])
+    horizon = (import_end + 1) * ticks_per_frame
+    segments = schedule.compile_layer(layer, ticks_per_frame, horizon)
+    changes = schedule.get_drawing_changes(layer, segments, import_start, import_end, ticks_per_frame)
 
-            # Bail out if we are still on the same drawing (frame hold).
-            # We have already set a key frame to show it during a previous iteration.
-            if drawing_index == active_drawing_index:
-                continue
+    # Go through the frames where the visible drawing changes.
+    active_drawing_index = -1
+    for frame_target, drawing_index in changes:
 
+        if drawing_index != -1:
             # Swap the active drawing.
             if use_keymesh:
                 keymesh_keyframe(parent_obj, frame_target, drawing_index)
@@ -180,14 +160,8 @@ def animate(drawing_to_obj, layer, use_keymesh, parent_obj):
                 hide_drawing(active_drawing_index, frame_target, drawing_to_obj)
                 show_drawing(drawing_index, frame_target, drawing_to_obj)
 
-            active_drawing_index = drawing_index
-            was_visible = True
-
         else:
             # We are between clips, all drawings must be hidden.
-            if not was_visible:
-                 continue
-
             if use_keymesh:
                 # For Keymesh we would need to hide all blocks which is not possible.
                 # Create a blank block if it doesn't exist and activate it.
@@ -196,15 +170,14 @@ def animate(drawing_to_obj, layer, use_keymesh, parent_obj):
             else:
                 hide_drawing(active_drawing_index, frame_target, drawing_to_obj)
 
-            active_drawing_index = -1
-            was_visible = False
+        active_drawing_index = drawing_index
 
     # Cleanup unecessary keyframes.
     # If it's a single, always visible drawing, we don't actually need the keyframe so
     # clear up the animation data. It's simpler to do it this way than to try to predict
     # if a keyframe is needed or not due to parent sequences or groups.
     if not use_keymesh and len(drawing_to_obj) == 1 and len(layer.animation.keys.visibility) == 1:
-        obj = drawing_to_obj[0]
+        obj = next(iter(drawing_to_obj.values()))
         if obj.animation_data.action.frame_start == 0 and obj.animation_data.action.frame_end == 0:
             obj.animation_data_clear()
 
@@ -212,88 +185,6 @@ def animate(drawing_to_obj, layer, use_keymesh, parent_obj):
     scn.frame_set(import_start)
 
 
-def get_local_time(stack, global_time, ticks_per_frame):
-
-    """
-    Compute the local time relatively to the fundamental base frame sequence,
-    taking into account clips, offsets, and looping at each level of the scene graph.
-
-    :param stack: the stack of layers from the paint layer up to the root.
-    :param global_time: the global time in ticks.
-    :param ticks_per_frame: number of ticks per frame.
-    :return (visible, local_time)
-    """
-
-    # The stack starts at the paint layer and goes up to the root.
-
-    local_time = int(global_time)
-
-    # Walk from the root down to the layer and update the local time at each level,
-    # based on clips, offsets, and looping of the fundamental animation.
-    # At each level we calculate the time within the fundamental animation sequence, not the clip.
-    # A clip may cover multiple iterations of the fundamental animation, and may start at an offset.
-    # A single layer can have multiple clips each with its own duration and offset.
-    # If we are invisible at a given level we bail out early since no drawing will be visible underneath.
-    for i in range(len(stack) - 1, -1, -1):
-
-        layer = stack[i]
-
-
-        # Find the key at or before the current time.
-        kkvv = layer.animation.keys.visibility
-        kkoo = layer.animation.keys.offset
-        last_key = None
-        for i in range(len(kkvv)):
-            if kkvv[i].time > local_time:
-                break
-
-            last_key = kkvv[i]
-
-        # Bail out if we are before the first key.
-        if last_key is None:
-            return False, local_time
-
-        if last_key.value:
-            # We are inside a clip or a visibility span.
-
-            # Check if there is an offset key matching the in-point.
-            start_offset = 0
-            for i in range(len(kkoo)):
-                if kkoo[i].time == int(last_key.time):
-                    start_offset = int(kkoo[i].value)
-                    break
-
-            # Sequences define clips while groups define visibility spans.
-            # Update the time to be relative to the start of the clip, taking offset into account.
-            if layer.type == "Paint" or layer.animation.timeline:
-                local_time = local_time - int(last_key.time) + start_offset
-
-            # Handle base animation looping.
-            # For sequence layers the base animation is defined by the loop point.
-            # For paint layers the base animation is the drawing sequence.
-            # TODO: handle max repeat count that's not 0 or 1, does Quill support this?
-            looping = False
-            duration = 0
-            if layer.type == "Paint":
-                looping = layer.implementation.max_repeat_count == 0
-                duration = len(layer.implementation.frames) * ticks_per_frame
-            else:
-                looping = layer.animation.max_repeat_count == 0
-                duration = int(layer.animation.duration)
-
-            if looping and duration > 0:
-                local_time = int(local_time % duration)
-
-            #print("layer:", layer.name, "local frame:", int(local_time / ticks_per_frame))
-
-        else:
-            # We are between clips or after the last.
-            #print("layer:", layer.name, "local frame: X")
-            return False, local_time
-
-    return True, local_time
-
-
 def show_drawing(drawing_index, frame, drawing_to_obj):
     keyframe_drawing_visibility(drawing_index, frame, drawing_to_obj, False)
 
@@ -305,7 +196,8 @@ def hide_drawing(drawing_index, frame, drawing_to_obj):
 def keyframe_drawing_visibility(drawing_index, frame, drawing_to_obj, hide=True):
     """Hide or show the drawing on `frame`."""
 
-    if drawing_index == -1:
+    # Drawings that were not imported (-1 or outside the imported frame range) are ignored.
+    if drawing_index not in drawing_to_obj:
         return
 
     obj = drawing_to_obj[drawing_index]
@@ -1,29 +1,78 @@
+import bpy
+import numpy as np
+from .animation import animate
+from ..model import paint
+
+
+def convert(parent_obj, layer, frame_range=None):
+    """
+    Convert a Quill paint layer to Blender curve objects with polyline splines and animate it.
+
+    Each drawing becomes a curve object parented to `parent_obj`,
+    the visibility of the drawings is animated the same way as for the mesh import.
+    Drawings without data (not visible in the imported frame range) are skipped.
+
+    :param parent_obj: Blender object representing the paint layer.
+    :param layer: Quill paint layer to convert.
+    :param frame_range: (start, end) frames to import, if None it is derived from the Blender frame range.
+    """
 
-def convert(obj, layer):
-    """Convert a Quill paint layer to a Blender curve object with polyline splines."""
-    
     drawings = layer.implementation.drawings
     if drawings is None or len(drawings) == 0:
         return
-    
-    curve_data = obj.data
-    curve_data.dimensions = '3D'
-    curve_data.resolution_u = 2
-    
-    # Only import the first drawing for now.
-    import_drawing(drawings[0], curve_data)
+
+    drawing_to_obj = {}
+    for index, drawing in enumerate(drawings):
+
+        if drawing.data is None:
+            continue
+
+        name = layer.name + f"_{index}"
+        curve_data = bpy.data.curves.new(name, type='CURVE')
+        curve_data.dimensions = '3D'
+        curve_data.resolution_u = 2
+
+        obj = bpy.data.objects.new(curve_data.name, curve_data)
+        drawing_to_obj[index] = obj
+
+        bpy.context.collection.objects.link(obj)
+        obj.parent = parent_obj
+
+        import_drawing(drawing, curve_data)
+
+    animate(drawing_to_obj, layer, False, parent_obj, frame_range)
 
 
 def import_drawing(drawing, curve_data):
-    
+    """
+    Convert a Quill drawing to polyline splines.
+
+    Legacy curves don't support generic attributes so the vertex colors are not imported,
+    see docs/import.md. Curves datablocks would support them but can't be used by Follow Path.
+
+    :param drawing: Quill drawing to convert.
+    :param curve_data: Blender curve data to populate.
+    """
+
     if drawing.data is None:
         return
-    
-    for stroke in drawing.data.strokes:
+
+    strokes = [stroke for stroke in drawing.data.strokes if len(stroke.vertices) > 0]
+    if len(strokes) == 0:
+        return
+
+    arrays = paint.get_drawing_arrays(strokes)
+
+    # Polyline points are (x, y, z, w).
+    coords = np.ones((arrays.vertex_count, 4), dtype=np.float32)
+    coords[:, :3] = arrays.positions
+
+    for i in range(arrays.stroke_count):
+        start = arrays.offsets[i]
+        end = start + arrays.sizes[i]
+
         polyline = curve_data.splines.new('POLY')
         # There is already one point by default so we only need to add count-1.
-        polyline.points.add(len(stroke.vertices) - 1)
-        for i in range(len(stroke.vertices)):
-            vertex = stroke.vertices[i]
-            polyline.points[i].co = (vertex.position[0], vertex.position[1], vertex.position[2], 1)
-            polyline.points[i].radius = vertex.width
+        polyline.points.add(int(arrays.sizes[i]) - 1)
+        polyline.points.foreach_set("co", coords[start:end].ravel())
+        polyline.points.foreach_set("radius", arrays.widths[start:end])
@@ -1,13 +1,17 @@
 import bpy
+import numpy as np
+from ..model import paint, schedule
 
-def convert(obj, layer):
+def convert(obj, layer, frame_range=None):
     """
     Converts a Quill paint layer to a Blender grease pencil object.
 
-    Imports the base frame-by-frame animation with optional looping. Not clips.
+    Imports the base frame-by-frame animation with looping, clips and offsets,
+    including the ones coming from parent groups and sequences.
 
     :param obj: Blender object to populate with grease pencil data.
     :param layer: Quill paint layer to convert.
+    :param frame_range: (start, end) frames to import, if None it is derived from the Blender frame range.
     """
 
     drawings = layer.implementation.drawings
@@ -33,10 +37,12 @@ def convert(obj, layer):
     gpencil_layer.opacity = layer.opacity
 
     # Blender frame range vs Quill animation range.
-    # We will loop through Blender frames and show the corresponding drawing.
+    # Same heuristic as for the mesh import, see importers/animation.py.
     scn = bpy.context.scene
     import_end = scn.frame_end
-    if scn.frame_start <= 0:
+    if frame_range is not None:
+        import_start, import_end = frame_range
+    elif scn.frame_start <= 0:
         import_start = 0
     elif scn.frame_start == 1:
         scn.frame_start = 0
@@ -52,37 +58,58 @@ def convert(obj, layer):
     if layer.implementation.framerate != scn.render.fps:
         scn.render.fps = int(layer.implementation.framerate)
 
-    # Loop through the Blender frames and show the corresponding drawing.
-    # We only support the base frame-by-frame animation + optional looping.
-    active_drawing_index = -1
-    for frame_target in range(import_start, import_end + 1):
-        #print("processing:", frame_target)
-
-        frame_source = frame_target
+    # Compile the visibility schedule of the layer, taking clips, offsets and looping
+    # of the layer and its parent groups and sequences into account.
+    # This gives the frames at which the visible drawing changes, -1 meaning hidden.
+    ticks_per_second = 12600
+    ticks_per_frame = int(ticks_per_second / scn.render.fps)
+    horizon = (import_end + 1) * ticks_per_frame
+    segments = schedule.compile_layer(layer, ticks_per_frame, horizon)
+    changes = schedule.get_drawing_changes(layer, segments, import_start, import_end, ticks_per_frame)
+
+    # Frame number of the first GP frame created for each drawing.
+    # Drawings reappear when the layer loops, when clips restart the animation, etc.
+    # Only the first occurrence is imported, the others reference it.
+    drawing_to_frame = {}
+
+    for frame_target, drawing_index in changes:
+
+        if drawing_index == -1 or drawings[drawing_index].data is None:
+            # Hidden: a GP frame without strokes ends the previous drawing.
+            # There is nothing to hide before the first drawing.
+            if len(gpencil_layer.frames) > 0:
+                gpencil_layer.frames.new(frame_target)
+            continue
 
-        # Take layer-level looping into account.
-        looping = layer.implementation.max_repeat_count == 0
-        if looping:
-            frame_source = frame_source % len(layer.implementation.frames)
-        else:
-            frame_source = min(frame_source, len(layer.implementation.frames) - 1)
+        if drawing_index in drawing_to_frame:
+            copy_frame(gpencil_layer, drawing_to_frame[drawing_index], frame_target)
+            continue
 
-        # Get the actual drawing that should be visible.
-        drawing_index = int(layer.implementation.frames[frame_source])
+        # Add a frame and import the drawing.
+        gp_frame = gpencil_layer.frames.new(frame_target)
+        import_drawing(drawings[drawing_index], gp_frame)
+        drawing_to_frame[drawing_index] = frame_target
 
-        # Bail out if we are still on the same drawing (frame hold).
-        if drawing_index == active_drawing_index:
-            continue
 
-        active_drawing_index = drawing_index
+def copy_frame(gpencil_layer, source_frame_number, frame_number):
+    """
+    Create a GP frame at `frame_number` showing the same drawing as the frame at `source_frame_number`.
 
-        # Add a frame and import the drawing.
-        gpencil_layer.frames.new(frame_target)
+    In GPv3 the new frame is an instance of the source drawing and doesn't duplicate the strokes.
+    GPv2 doesn't support instancing so the strokes are copied.
+    """
 
-        # Inside Quill UI it's not possible to duplicate a drawing past another one,
-        # the only duplication that can happen is frame-hold.
-        # We don't need to keep track of previously imported drawings.
-        import_drawing(drawings[drawing_index], gpencil_layer.frames[-1])
+    if bpy.app.version < (4, 3, 0):
+        source_frame = None
+        for gp_frame in gpencil_layer.frames:
+            if gp_frame.frame_number == source_frame_number:
+                source_frame = gp_frame
+                break
+
+        gp_frame = gpencil_layer.frames.copy(source_frame)
+        gp_frame.frame_number = frame_number
+    else:
+        gpencil_layer.frames.copy(source_frame_number, frame_number, instance_drawing=True)
 
 
 def import_drawing(drawing, gp_frame):
@@ -103,12 +130,24 @@ def import_drawing(drawing, gp_frame):
     if drawing.data is None:
         return
 
+    # Gather the stroke data into flat arrays for bulk transfers.
+    strokes = [stroke for stroke in drawing.data.strokes if len(stroke.vertices) > 0]
+    if len(strokes) == 0:
+        return
+
+    arrays = paint.get_drawing_arrays(strokes)
+    colors = np.ones((arrays.vertex_count, 4), dtype=np.float32)
+    colors[:, :3] = arrays.colors
+
     if bpy.app.version < (4, 3, 0):
 
         # Grease Pencil v2
         # Layer > Frame > Stroke > Point.
+        # Points are allocated in one go per stroke and filled from the columnar arrays.
+
+        pressures = arrays.widths * 2
 
-        for stroke in drawing.data.strokes:
+        for i in range(arrays.stroke_count):
 
             gp_stroke = gp_frame.strokes.new()
 
@@ -117,40 +156,70 @@ def import_drawing(drawing, gp_frame):
             gp_stroke.start_cap_mode = 'ROUND'
             gp_stroke.end_cap_mode = 'ROUND'
 
-            for vertex in stroke.vertices:
-                index = len(gp_stroke.points)
-                gp_stroke.points.add(1)
-                gp_point = gp_stroke.points[index]
-
-                gp_point.co = (vertex.position[0], vertex.position[1], vertex.position[2])
-                gp_point.pressure = vertex.width * 2
-                gp_point.strength = vertex.opacity
-                gp_point.vertex_color = (vertex.color[0], vertex.color[1], vertex.color[2], 1)
+            start = arrays.offsets[i]
+            end = start + arrays.sizes[i]
+            gp_stroke.points.add(int(arrays.sizes[i]))
+            gp_stroke.points.foreach_set("co", arrays.positions[start:end].ravel())
+            gp_stroke.points.foreach_set("pressure", pressures[start:end])
+            gp_stroke.points.foreach_set("strength", arrays.opacities[start:end])
+            gp_stroke.points.foreach_set("vertex_color", colors[start:end].ravel())
 
     else:
 
         # Grease Pencil v3
         # Layer > Frame > Drawing > Stroke > Point.
+        # The drawing is a curves geometry, we create all the strokes at once and
+        # fill the point and curve attributes directly from flat arrays.
 
         gp_drawing = gp_frame.drawing
+        point_start = len(gp_drawing.attributes["position"].data) if "position" in gp_drawing.attributes else 0
+        stroke_start = len(gp_drawing.strokes)
+        gp_drawing.add_strokes(arrays.sizes.tolist())
 
-        for stroke in drawing.data.strokes:
+        set_attribute(gp_drawing, "position", 'FLOAT_VECTOR', 'POINT', arrays.positions, point_start)
+        set_attribute(gp_drawing, "radius", 'FLOAT', 'POINT', arrays.widths, point_start)
+        set_attribute(gp_drawing, "opacity", 'FLOAT', 'POINT', arrays.opacities, point_start)
+        set_attribute(gp_drawing, "vertex_color", 'FLOAT_COLOR', 'POINT', colors, point_start)
 
-            gp_drawing.add_strokes([len(stroke.vertices)])
-            stroke_index = len(gp_drawing.strokes) - 1
+        # Caps: 0 = Round.
+        stroke_count = arrays.stroke_count
+        set_attribute(gp_drawing, "cyclic", 'BOOLEAN', 'CURVE', np.zeros(stroke_count, dtype=bool), stroke_start)
+        set_attribute(gp_drawing, "start_cap", 'INT8', 'CURVE', np.zeros(stroke_count, dtype=np.int32), stroke_start)
+        set_attribute(gp_drawing, "end_cap", 'INT8', 'CURVE', np.zeros(stroke_count, dtype=np.int32), stroke_start)
 
-            gp_stroke = gp_drawing.strokes[stroke_index]
-            gp_stroke.cyclic = False
-            gp_stroke.start_cap = 0 # Round
-            gp_stroke.end_cap = 0
 
-            vertex_index = 0
-            for vertex in stroke.vertices:
+def set_attribute(gp_drawing, name, type, domain, values, start=0):
+    """
+    Write values into a GPv3 drawing attribute, creating the attribute if needed.
+
+    :param gp_drawing: Blender GP drawing.
+    :param name: name of the attribute.
+    :param type: attribute data type, used if the attribute needs to be created.
+    :param domain: attribute domain ('POINT' or 'CURVE'), used if the attribute needs to be created.
+    :param values: array of values, one entry (or row) per element.
+    :param start: index of the first element to write, elements before are kept.
+    """
 
-                gp_point = gp_stroke.points[vertex_index]
-                gp_point.position = (vertex.position[0], vertex.position[1], vertex.position[2])
-                gp_point.radius = vertex.width
-                gp_point.opacity = vertex.opacity
-                gp_point.vertex_color = (vertex.color[0], vertex.color[1], vertex.color[2], 1)
+    attribute = gp_drawing.attributes.get(name)
+    if attribute is None:
+        attribute = gp_drawing.attributes.new(name, type, domain)
 
-                vertex_index += 1
+    # Name of the property holding the value, by data type.
+    if type == 'FLOAT_VECTOR':
+        key = "vector"
+    elif type == 'FLOAT_COLOR':
+        key = "color"
+    else:
+        key = "value"
+
+    values = np.ascontiguousarray(values)
+    if start > 0:
+        # Keep the values of the existing elements.
+        row_size = int(np.prod(values.shape[1:]))
+        existing = np.zeros(len(attribute.data) * row_size, dtype=values.dtype)
+        attribute.data.foreach_get(key, existing)
+        existing = existing.reshape((len(attribute.data),) + values.shape[1:])
+        existing[start:start + len(values)] = values
+        values = existing
+
+    attribute.data.foreach_set(key, values.ravel())
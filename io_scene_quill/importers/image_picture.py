@@ -0,0 +1,29 @@
+import bpy
+import logging
+from ..model import quill_utils
+
+def convert(layer):
+    """
+    Create a Blender image from the picture data embedded in a Quill picture layer.
+    The image is packed in the blend file since there is no file on disk.
+    """
+
+    # The picture data is decoded from the qbin at this point.
+    data = quill_utils.get_picture_data(layer)
+    if data is None or data.pixels is None:
+        return None
+
+    # Blender images are always stored as RGBA floats, rows from bottom to top like the qbin data.
+    pixels = data.get_float_pixels(4)
+
+    image = bpy.data.images.new(layer.name, width=data.width, height=data.height, alpha=data.hasAlpha)
+    image.pixels.foreach_set(pixels.ravel())
+    image.update()
+
+    # Pack the image so the blend file is self contained.
+    image.file_format = 'PNG'
+    image.pack()
+
+    logging.info("Created image %s (%dx%d) from embedded picture data.", image.name, data.width, data.height)
+
+    return image
@@ -7,8 +7,12 @@ from ..model.paint import BrushType
 from ..utils.keymesh import keymesh_init, keymesh_import
 
 
-def convert(config, parent_obj, layer, material, use_keymesh, lipsync_data):
-    """Converts a Quill paint layer to Blender mesh objects and animates it."""
+def convert(config, parent_obj, layer, material, use_keymesh, lipsync_data, frame_range=None):
+    """
+    Converts a Quill paint layer to Blender mesh objects and animates it.
+
+    Drawings without data (not visible in the imported frame range) are skipped.
+    """
 
     drawings = layer.implementation.drawings
     if drawings is None or len(drawings) == 0:
@@ -22,9 +26,11 @@ def convert(config, parent_obj, layer, material, use_keymesh, lipsync_data):
 
     # Load all drawings into mesh objects.
     # Note: empty frames still have a drawing pointer, just no strokes.
-    index = 0
     drawing_to_obj = {}
-    for drawing in drawings:
+    for index, drawing in enumerate(drawings):
+
+        if drawing.data is None:
+            continue
 
         # Create a new mesh object for this drawing.
         name = layer.name + f"_{index}"
@@ -78,14 +84,12 @@ def convert(config, parent_obj, layer, material, use_keymesh, lipsync_data):
             bpy.ops.uv.smart_project()
             bpy.ops.object.editmode_toggle()
 
-        index += 1
-
     if use_keymesh:
         keymesh_init(parent_obj)
-        keymesh_import(parent_obj, drawing_to_obj.values())
+        keymesh_import(parent_obj, drawing_to_obj)
         bpy.context.view_layer.objects.active = parent_obj
 
-    animate(drawing_to_obj, layer, use_keymesh, parent_obj)
+    animate(drawing_to_obj, layer, use_keymesh, parent_obj, frame_range)
     
     if use_keymesh and lipsync_data is not None:
         # Check if the lipsync data has this layer.
@@ -2,6 +2,7 @@
 # These do not depend on any Blender data types.
 
 import struct
+import numpy as np
 from enum import Enum
 
 
@@ -40,6 +41,93 @@ class Vertex:
         self.width = width
 
 
+class DrawingArrays:
+    """
+    Columnar view of a list of strokes, for bulk transfers to and from Blender.
+
+    Per-stroke arrays have one entry per stroke, per-vertex arrays have one entry (or row)
+    per vertex, with the vertices of all the strokes laid out one after the other.
+    The vertices of stroke i are in the range offsets[i]:offsets[i] + sizes[i].
+    """
+
+    def __init__(self, stroke_count=0, vertex_count=0):
+        # Per stroke.
+        self.sizes = np.zeros(stroke_count, dtype=np.int32)
+        self.offsets = np.zeros(stroke_count, dtype=np.int32)
+        self.ids = np.zeros(stroke_count, dtype=np.uint32)
+        self.bounding_boxes = np.zeros((stroke_count, 6), dtype=np.float32)
+        self.brush_types = np.zeros(stroke_count, dtype=np.int16)
+        self.disable_rotational_opacity = np.zeros(stroke_count, dtype=bool)
+
+        # Per vertex.
+        self.positions = np.zeros((vertex_count, 3), dtype=np.float32)
+        self.normals = np.zeros((vertex_count, 3), dtype=np.float32)
+        self.tangents = np.zeros((vertex_count, 3), dtype=np.float32)
+        self.colors = np.zeros((vertex_count, 3), dtype=np.float32)
+        self.opacities = np.zeros(vertex_count, dtype=np.float32)
+        self.widths = np.zeros(vertex_count, dtype=np.float32)
+
+    @property
+    def stroke_count(self):
+        return len(self.sizes)
+
+    @property
+    def vertex_count(self):
+        return len(self.positions)
+
+    def get_bounding_box(self):
+        """Bounding box of all the strokes, as a list [min x, min y, min z, max x, max y, max z]."""
+        if self.stroke_count == 0:
+            return [float('inf'), float('inf'), float('inf'), float('-inf'), float('-inf'), float('-inf')]
+
+        return self.bounding_boxes[:, :3].min(axis=0).tolist() + self.bounding_boxes[:, 3:].max(axis=0).tolist()
+
+
+def get_drawing_arrays(strokes):
+    """Gather the strokes into a DrawingArrays."""
+
+    stroke_count = len(strokes)
+    sizes = [len(stroke.vertices) for stroke in strokes]
+    arrays = DrawingArrays(stroke_count, sum(sizes))
+    if stroke_count == 0:
+        return arrays
+
+    arrays.sizes[:] = sizes
+    arrays.offsets[1:] = np.cumsum(arrays.sizes)[:-1]
+    arrays.ids[:] = [stroke.id for stroke in strokes]
+    arrays.bounding_boxes[:] = [stroke.bounding_box for stroke in strokes]
+    arrays.brush_types[:] = [stroke.brush_type.value for stroke in strokes]
+    arrays.disable_rotational_opacity[:] = [stroke.disable_rotational_opacity for stroke in strokes]
+
+    if arrays.vertex_count == 0:
+        return arrays
+
+    vertices = [vertex for stroke in strokes for vertex in stroke.vertices]
+    arrays.positions[:] = [vertex.position for vertex in vertices]
+    arrays.normals[:] = [vertex.normal for vertex in vertices]
+    arrays.tangents[:] = [vertex.tangent for vertex in vertices]
+    arrays.colors[:] = [vertex.color for vertex in vertices]
+    arrays.opacities[:] = [vertex.opacity for vertex in vertices]
+    arrays.widths[:] = [vertex.width for vertex in vertices]
+
+    return arrays
+
+
+def concatenate_drawing_arrays(arrays_list):
+    """Concatenate DrawingArrays into one, the strokes of each one after the other."""
+
+    result = DrawingArrays()
+    for name in ("sizes", "ids", "bounding_boxes", "brush_types", "disable_rotational_opacity",
+                 "positions", "normals", "tangents", "colors", "opacities", "widths"):
+        setattr(result, name, np.concatenate([getattr(arrays, name) for arrays in arrays_list]))
+
+    result.offsets = np.zeros(result.stroke_count, dtype=np.int32)
+    if result.stroke_count > 0:
+        result.offsets[1:] = np.cumsum(result.sizes)[:-1]
+
+    return result
+
+
 def read_drawing_data(qbin):
     data = DrawingData()
     stroke_count = struct.unpack("<I", qbin.read(4))[0]
@@ -76,6 +164,10 @@ def read_vertex(qbin):
 
 
 def write_drawing_data(data, qbin):
+    if isinstance(data, DrawingArrays):
+        write_drawing_arrays(data, qbin)
+        return
+
     qbin.write(struct.pack("<I", len(data.strokes)))
     for stroke in data.strokes:
         write_stroke(stroke, qbin)
@@ -107,4 +199,39 @@ def write_vertex(vertex, qbin):
     qbin.write(struct.pack("<f", vertex.width))
 
 
+# Stroke header: id, unknown, bounding box, brush type, disable rotational opacity, unknown, vertex count.
+STROKE_HEADER = struct.Struct("<II6fh?cI")
+
+# Vertex: position, normal, tangent, color, opacity, width.
+VERTEX_SIZE = 14
+
+
+def write_drawing_arrays(arrays, qbin):
+    """Bulk version of write_drawing_data for drawings stored as DrawingArrays."""
+
+    # Interleave the vertex attributes in the file layout and encode them all at once.
+    vertices = np.empty((arrays.vertex_count, VERTEX_SIZE), dtype="<f4")
+    vertices[:, 0:3] = arrays.positions
+    vertices[:, 3:6] = arrays.normals
+    vertices[:, 6:9] = arrays.tangents
+    vertices[:, 9:12] = arrays.colors
+    vertices[:, 12] = arrays.opacities
+    vertices[:, 13] = arrays.widths
+    buffer = vertices.tobytes()
+    vertex_bytes = VERTEX_SIZE * 4
+
+    # We don’t know what these two fields are but they are always 0 in files produced by Quill.
+    u2 = 0
+    u3 = b'\x00'
+
+    chunks = [struct.pack("<I", arrays.stroke_count)]
+    for i in range(arrays.stroke_count):
+        start = int(arrays.offsets[i])
+        size = int(arrays.sizes[i])
+        chunks.append(STROKE_HEADER.pack(
+            int(arrays.ids[i]), u2, *arrays.bounding_boxes[i].tolist(),
+            int(arrays.brush_types[i]), bool(arrays.disable_rotational_opacity[i]), u3, size))
+        chunks.append(buffer[start * vertex_bytes:(start + size) * vertex_bytes])
+
+    qbin.write(b"".join(chunks))
 
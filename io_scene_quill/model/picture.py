@@ -3,6 +3,7 @@
 
 from enum import Enum
 import struct
+import zlib
 import numpy as np
 
 class AssetFormat(Enum):
@@ -37,11 +38,70 @@ class ImageFormat(Enum):
 
 
 class PictureData:
+    """
+    Picture payload.
+
+    Pixels are RGB(A) values, rows from bottom to top like in Blender.
+    When read from a qbin they are a read-only uint8 array of shape (height, width, channels) in [0..255],
+    use get_float_pixels() to convert them to floats on demand.
+    On export they can be a uint8 array in [0..255] or floats in [0..1].
+
+    `encoding` is the format of the payload in the qbin: NONE for raw pixels, PNG or JPG for compressed images.
+    Compressed payloads that can't be decoded are kept as is in `encoded_data`, with no pixels.
+    """
+
     def __init__(self):
         self.hasAlpha = False
         self.width = 16
         self.height = 16
         self.pixels = None
+        self.encoding = AssetFormat.NONE
+        self.encoded_data = None
+
+    def get_float_pixels(self, channels=None):
+        """
+        Pixels as a float32 array of shape (height, width, channels) in [0..1].
+
+        :param channels: number of channels of the result, 4 to expand RGB to RGBA with opaque alpha.
+        """
+
+        if self.pixels is None:
+            return None
+
+        pixels = np.asarray(self.pixels)
+        if pixels.dtype == np.uint8:
+            pixels = pixels.astype(np.float32)
+            pixels /= 255.0
+        else:
+            pixels = pixels.astype(np.float32)
+
+        num_channels = 4 if self.hasAlpha else 3
+        pixels = pixels.reshape(self.height, self.width, num_channels)
+        if channels is None or channels == num_channels:
+            return pixels
+
+        result = np.ones((self.height, self.width, channels), dtype=np.float32)
+        count = min(channels, num_channels)
+        result[:, :, :count] = pixels[:, :, :count]
+        return result
+
+
+class PictureDataReference:
+    """
+    Location of a picture payload in a qbin file.
+
+    Pictures can be large and are not always needed (e.g. the image file is still on disk),
+    so the payload is only read and decoded when requested.
+    """
+
+    def __init__(self, path, offset):
+        self.path = path
+        self.offset = offset
+
+    def load(self):
+        with open(self.path, "rb") as qbin:
+            qbin.seek(self.offset)
+            return read_picture_data(qbin)
 
 
 def read_picture_data(qbin):
@@ -73,21 +133,36 @@ def read_picture_data(qbin):
     if image_format != ImageFormat.FORMAT_I_RGB and image_format != ImageFormat.FORMAT_I_RGBA:
         return None
     
-    _ = struct.unpack("<B", qbin.read(1))[0]
+    # Payload encoding, see write_picture_data.
+    data.encoding = AssetFormat(struct.unpack("<B", qbin.read(1))[0])
     _ = struct.unpack("<B", qbin.read(1))[0]
     
     data.width = struct.unpack("<I", qbin.read(4))[0]
     data.height = struct.unpack("<I", qbin.read(4))[0]
     _ = struct.unpack("<I", qbin.read(4))[0]
     
-    # The pixel data is expected to be an array of RGB(A) values in [0..255].
     num_channels = 4 if data.hasAlpha else 3
-    total_bytes = data.width * data.height * num_channels
-    pixel_data = qbin.read(total_bytes)
-    pixels = np.frombuffer(pixel_data, dtype=np.uint8)
-    pixels = pixels.astype(np.float32)
-    pixels = pixels / 255.0
-    data.pixels = pixels.reshape((data.height, data.width, num_channels)).tolist()
+    if data.encoding == AssetFormat.NONE:
+        # The pixel data is expected to be an array of RGB(A) values in [0..255].
+        total_bytes = data.width * data.height * num_channels
+        pixel_data = qbin.read(total_bytes)
+        pixels = np.frombuffer(pixel_data, dtype=np.uint8)
+
+    else:
+        # Compressed image file.
+        length = struct.unpack("<I", qbin.read(4))[0]
+        data.encoded_data = qbin.read(length)
+        if data.encoding != AssetFormat.PNG:
+            # JPG can't be decoded without an image library, keep the payload as is.
+            return data
+
+        try:
+            pixels = decode_png(data.encoded_data, num_channels)
+        except (ValueError, zlib.error):
+            return None
+
+    # Keep the bytes, conversion to floats is done on demand.
+    data.pixels = pixels.reshape((data.height, data.width, num_channels))
     
     return data
     
@@ -115,9 +190,12 @@ def write_picture_data(data:PictureData, qbin):
     else:
         qbin.write(struct.pack("<B", 0x06))
 
+    # Payload encoding: 00 for raw pixels, otherwise the AssetFormat of the compressed image file.
+    # This byte is always zero in files written by Quill, compressed payloads are specific to this add-on.
+    qbin.write(struct.pack("<B", data.encoding.value))
+
     # Unknown
     qbin.write(struct.pack("<B", 0x00))
-    qbin.write(struct.pack("<B", 0x00))
 
     # Image size.
     qbin.write(struct.pack("<I", data.width))
@@ -126,10 +204,240 @@ def write_picture_data(data:PictureData, qbin):
     # Unknown, likely the depth in pixels for dense 3D images.
     qbin.write(struct.pack("<I", 1))
 
-    # Input pixel data is expected to be an array of RGB(A) values in [0..1].
+    # Compressed payload: size followed by the image file.
+    if data.encoding != AssetFormat.NONE:
+        encoded_data = data.encoded_data
+        if encoded_data is None:
+            encoded_data = encode_png(get_pixel_array(data))
+
+        qbin.write(struct.pack("<I", len(encoded_data)))
+        qbin.write(encoded_data)
+        return
+
+    qbin.write(memoryview(get_pixel_array(data)).cast("B"))
+
+
+def get_pixel_array(data:PictureData):
+    """Pixels as a contiguous uint8 array of shape (height, width, channels)."""
+
+    # Input pixel data is expected to be an array of RGB(A) values, either bytes or floats in [0..1].
     # Convert to [0..255].
-    pixels = np.array(data.pixels)
-    pixels = pixels * 255
-    pixels = pixels.astype(np.int8)
+    pixels = data.pixels
+    if not isinstance(pixels, np.ndarray) or pixels.dtype != np.uint8:
+        pixels = quantize(np.array(pixels, dtype=np.float32))
+
+    num_channels = 4 if data.hasAlpha else 3
+    return np.ascontiguousarray(pixels).reshape(data.height, data.width, num_channels)
+
+
+def quantize(pixels):
+    """
+    Convert float pixel values in [0..1] to bytes in [0..255], with rounding.
+
+    The input array is used as scratch memory to avoid extra copies of large images.
+    """
+
+    np.multiply(pixels, 255, out=pixels)
+    np.rint(pixels, out=pixels)
+    np.clip(pixels, 0, 255, out=pixels)
+    return pixels.astype(np.uint8)
+
+
+# Minimal PNG support, only what is needed for picture payloads:
+# 8-bit grey, grey + alpha, RGB and RGBA images, without interlacing.
+# https://www.w3.org/TR/png/
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG color type for each number of channels, and the reverse.
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+PNG_CHANNELS = {0: 1, 4: 2, 2: 3, 6: 4}
+
+
+def png_chunk(chunk_type, chunk_data):
+    chunk = chunk_type + chunk_data
+    return struct.pack(">I", len(chunk_data)) + chunk + struct.pack(">I", zlib.crc32(chunk) & 0xFFFFFFFF)
+
+
+def encode_png(pixels, level=6):
+    """
+    Encode an image as a PNG file.
+
+    Each row uses the filter that gives the smallest sum of absolute differences,
+    all filters are computed on the whole image at once.
+
+    :param pixels: uint8 array of shape (height, width, channels), rows from bottom to top.
+    :param level: zlib compression level.
+    :return: the PNG file as bytes.
+    """
+
+    height, width, channels = pixels.shape
+
+    # PNG rows go from top to bottom.
+    rows = pixels[::-1].reshape(height, width * channels).astype(np.int16)
+
+    # Neighbors of each byte: same channel of the previous pixel, previous row.
+    left = np.zeros_like(rows)
+    left[:, channels:] = rows[:, :-channels]
+    up = np.zeros_like(rows)
+    up[1:] = rows[:-1]
+    up_left = np.zeros_like(rows)
+    up_left[1:, channels:] = rows[:-1, :-channels]
+
+    def paeth():
+        p = left + up - up_left
+        pa = np.abs(p - left)
+        pb = np.abs(p - up)
+        pc = np.abs(p - up_left)
+        return np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+
+    # None, Sub, Up, Average, Paeth.
+    predictors = (
+        lambda: 0,
+        lambda: left,
+        lambda: up,
+        lambda: (left + up) // 2,
+        paeth,
+    )
+
+    filtered = np.zeros((height, width * channels + 1), dtype=np.uint8)
+    best_costs = np.full(height, np.inf)
+    for filter_type, predictor in enumerate(predictors):
+        residuals = ((rows - predictor()) % 256).astype(np.uint8)
+
+        # Residuals are interpreted as signed bytes to estimate how well they compress.
+        costs = np.abs(residuals.view(np.int8).astype(np.int64)).sum(axis=1)
+        better = costs < best_costs
+        filtered[better, 0] = filter_type
+        filtered[better, 1:] = residuals[better]
+        best_costs[better] = costs[better]
+
+    header = struct.pack(">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[channels], 0, 0, 0)
+    return (PNG_SIGNATURE +
+        png_chunk(b"IHDR", header) +
+        png_chunk(b"IDAT", zlib.compress(filtered.tobytes(), level)) +
+        png_chunk(b"IEND", b""))
+
+
+def decode_png(png, channels=None):
+    """
+    Decode a PNG file.
+
+    :param png: the PNG file as bytes.
+    :param channels: number of channels of the result (3 or 4), or None to keep the channels of the image.
+    :return: uint8 array of shape (height, width, channels), rows from bottom to top.
+    """
+
+    if png[:8] != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file")
+
+    # Read the chunks.
+    header = None
+    idat = []
+    position = 8
+    while position + 8 <= len(png):
+        length, chunk_type = struct.unpack(">I4s", png[position:position + 8])
+        chunk_data = png[position + 8:position + 8 + length]
+        position += 12 + length
+        if chunk_type == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk_data)
+        elif chunk_type == b"IDAT":
+            idat.append(chunk_data)
+        elif chunk_type == b"IEND":
+            break
+
+    if header is None:
+        raise ValueError("Missing PNG header")
+
+    width, height, bit_depth, color_type, _, _, interlace = header
+    if bit_depth != 8 or color_type not in PNG_CHANNELS or interlace != 0:
+        raise ValueError("Unsupported PNG format")
+
+    image_channels = PNG_CHANNELS[color_type]
+    stride = width * image_channels
+    raw = np.frombuffer(zlib.decompress(b"".join(idat)), dtype=np.uint8)
+    raw = raw[:height * (stride + 1)].reshape(height, stride + 1)
+
+    filter_types = raw[:, 0]
+    if np.any(filter_types > 4):
+        raise ValueError("Invalid PNG filter")
+
+    if np.any(filter_types >= 3):
+        rows = unfilter_png_wavefront(raw[:, 1:], filter_types, width, image_channels)
+    else:
+        # Undo the filters, row by row.
+        rows = np.zeros((height, stride), dtype=np.uint8)
+        previous = np.zeros(stride, dtype=np.uint8)
+        for y in range(height):
+            filter_type = filter_types[y]
+            row = raw[y, 1:]
+            if filter_type == 0:
+                rows[y] = row
+            elif filter_type == 1:
+                rows[y] = np.cumsum(row.reshape(width, image_channels), axis=0, dtype=np.uint8).ravel()
+            else:
+                rows[y] = row + previous
+
+            previous = rows[y]
+
+    pixels = rows.reshape(height, width, image_channels)[::-1]
+
+    # Convert to the requested number of channels.
+    if channels is None or channels == image_channels:
+        return np.ascontiguousarray(pixels)
+
+    result = np.full((height, width, channels), 255, dtype=np.uint8)
+    if image_channels < 3:
+        result[:, :, :3] = pixels[:, :, :1]
+    else:
+        result[:, :, :3] = pixels[:, :, :3]
+    if channels == 4 and image_channels in (2, 4):
+        result[:, :, 3] = pixels[:, :, -1]
+
+    return result
+
+
+def unfilter_png_wavefront(residuals, filter_types, width, channels):
+    """
+    Undo PNG filters of any type.
+
+    Average and Paeth predict a pixel from its left, upper and upper-left neighbors, all already decoded.
+    Pixels on the same anti-diagonal (x + y constant) don't depend on each other,
+    so the image is decoded one anti-diagonal at a time, each one in a single batch.
+
+    :param residuals: uint8 array (height, width * channels) of filtered rows, top to bottom.
+    :param filter_types: filter type of each row.
+    :return: uint8 array (height, width * channels) of decoded rows.
+    """
+
+    height = len(residuals)
+    residuals = residuals.reshape(height, width, channels).astype(np.int16)
+    filter_types = filter_types.astype(np.int16)
+
+    # Decoded pixels, with a row and a column of zeros before the image for the missing neighbors.
+    decoded = np.zeros((height + 1, width + 1, channels), dtype=np.int16)
+
+    for diagonal in range(height + width - 1):
+        ys = np.arange(max(0, diagonal - width + 1), min(diagonal, height - 1) + 1)
+        xs = diagonal - ys
+
+        a = decoded[ys + 1, xs]
+        b = decoded[ys, xs + 1]
+        c = decoded[ys, xs]
+
+        p = a + b - c
+        pa = np.abs(p - a)
+        pb = np.abs(p - b)
+        pc = np.abs(p - c)
+        paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+
+        # None, Sub, Up, Average, Paeth.
+        filters = filter_types[ys][:, None]
+        predictor = np.select(
+            [filters == 1, filters == 2, filters == 3, filters == 4],
+            [a, b, (a + b) // 2, paeth],
+            0)
+
+        decoded[ys + 1, xs + 1] = (residuals[ys, xs] + predictor) % 256
 
-    pixels.tofile(qbin)
+    return decoded[1:, 1:].astype(np.uint8).reshape(height, width * channels)
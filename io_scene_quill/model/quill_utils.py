@@ -1,9 +1,10 @@
 import json
+import math
 import os
 import re
 import struct
 
-from . import paint, picture, sound, sequence, state, lipsync
+from . import paint, picture, schedule, sound, sequence, state, lipsync
 
 
 def create_scene():
@@ -109,7 +110,7 @@ def delete_hidden(layer):
 
         # In Quill hiding a sound layer just makes the speaker gizmo invisible but the audio still plays,
         # so we don't remove hidden sound layers here.
-        layer.implementation.children = [child for child in layer.implementation.children if child.visible or child.type == "Sound"]
+        remove_children(layer, lambda child: not child.visible and child.type != "Sound")
 
 
 def delete_type(layer, type):
@@ -119,7 +120,7 @@ def delete_type(layer, type):
             if child.type == "Group":
                 delete_type(child, type)
 
-        layer.implementation.children = [child for child in layer.implementation.children if child.type != type]
+        remove_children(layer, lambda child: child.type == type)
 
 
 def is_empty_group(layer):
@@ -138,7 +139,35 @@ def delete_empty_groups(layer):
         delete_empty_groups(child)
 
     # Remove empty groups from children.
-    layer.implementation.children = list(filter(lambda x: not is_empty_group(x), layer.implementation.children))
+    remove_children(layer, is_empty_group)
+
+
+def remove_children(layer, predicate):
+    """Remove the children of a group layer matching the predicate, keeping the path index up to date."""
+
+    removed = []
+    kept = []
+    for child in layer.implementation.children:
+        if predicate(child):
+            removed.append(child)
+        else:
+            kept.append(child)
+
+    layer.implementation.children = kept
+
+    root = layer.get_root()
+    path = layer.get_path()
+    if root.layer_index is None or root.layer_index.get(path) is not layer or len(removed) == 0:
+        return
+
+    for child in removed:
+        root.unindex_layer(child, path + (child.name,))
+
+    # Siblings with the same name as a removed layer may now be reachable.
+    removed_names = set(child.name for child in removed)
+    for child in kept:
+        if child.name in removed_names:
+            root.index_layer(child, path + (child.name,))
 
 
 def sanitize_name(name):
@@ -163,25 +192,34 @@ def get_unique_layer_name(name, parent_layer):
         i += 1
 
 
-def load_qbin_data(layer, qbin):
-    """Load qbin data for the layer and its children."""
+def load_qbin_data(layer, qbin, drawing_filter=None):
+    """
+    Load qbin data for the layer and its children.
+
+    If `drawing_filter` is set it maps paint layers to the set of drawing indices to load,
+    the other drawings of these layers are left without data.
+    """
 
     if layer.type == "Group":
         for child in layer.implementation.children:
-            load_qbin_data(child, qbin)
+            load_qbin_data(child, qbin, drawing_filter)
 
     elif layer.type == "Paint":
         drawings = layer.implementation.drawings
         if drawings is None or len(drawings) == 0:
             return
 
-        for drawing in layer.implementation.drawings:
+        for index, drawing in enumerate(layer.implementation.drawings):
+            if drawing_filter is not None and layer in drawing_filter and index not in drawing_filter[layer]:
+                continue
+
             qbin.seek(int(drawing.data_file_offset, 16))
             drawing.data = paint.read_drawing_data(qbin)
     
-    # elif layer.type == "Picture" and layer.implementation.data_file_offset != None:
-    #     qbin.seek(int(layer.implementation.data_file_offset, 16))
-    #     layer.implementation.data = picture.read_picture_data(qbin)
+    elif layer.type == "Picture" and layer.implementation.data_file_offset != None:
+        # Only record where the picture is, it's decoded on demand by get_picture_data.
+        offset = int(layer.implementation.data_file_offset, 16)
+        layer.implementation.data = picture.PictureDataReference(qbin.name, offset)
     
     elif layer.type == "Sound" and layer.implementation.data_file_offset != None:
         qbin.seek(int(layer.implementation.data_file_offset, 16))
@@ -193,6 +231,17 @@ def load_qbin_data(layer, qbin):
         layer.implementation.data = picture.read_picture_data(qbin)
 
 
+def get_picture_data(layer):
+    """Get the picture data of a Picture layer, reading it from the qbin on first access."""
+
+    data = layer.implementation.data
+    if isinstance(data, picture.PictureDataReference):
+        data = data.load()
+        layer.implementation.data = data
+
+    return data
+
+
 def export_sound_data(data, path):
     """Write sound data to an external file (.wav)."""
     return sound.export_sound_data(data, path)
@@ -212,9 +261,11 @@ def write_qbin_data(layer, qbin):
             paint.write_drawing_data(drawing.data, qbin)
 
     elif layer.type == "Picture" and layer.implementation.data != None:
-        offset = hex(qbin.tell())[2:].upper().zfill(8)
-        layer.implementation.data_file_offset = offset
-        picture.write_picture_data(layer.implementation.data, qbin)
+        data = get_picture_data(layer)
+        if data is not None:
+            offset = hex(qbin.tell())[2:].upper().zfill(8)
+            layer.implementation.data_file_offset = offset
+            picture.write_picture_data(data, qbin)
         
     elif layer.type == "Sound" and layer.implementation.data != None:
         offset = hex(qbin.tell())[2:].upper().zfill(8)
@@ -239,26 +290,18 @@ def write_json(json_obj, folder_path, file_name):
     file.close()
 
 
-def import_scene(path, layer_types, only_visible=False, only_non_empty=False):
-    """Load a Quill scene graph and its data."""
-
-    scene_path = os.path.join(path, "Quill.json")
-    qbin_path = os.path.join(path, "Quill.qbin")
+def import_scene(path, layer_types, only_visible=False, only_non_empty=False, frame_range=None, default_framerate=24):
+    """
+    Load a Quill scene graph and its data.
 
-    # Check if the expected files exist.
-    if not os.path.exists(scene_path) or not os.path.exists(qbin_path):
-        raise FileNotFoundError(f"File not found.")
+    If `frame_range` is set to a (start, end) tuple of frames, only the drawings
+    of paint layers that are visible in that range are loaded.
+    Frames are converted to time with the framerate of the scene, or `default_framerate`
+    if the scene doesn't have one.
+    """
 
-    scene = None
-    try:
-        with open(scene_path) as f:
-            d = json.load(f)
-            scene = sequence.QuillScene.from_dict(d)
-            connect_parents(scene.sequence.root_layer)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Failed to load JSON: {e}")
-    except:
-        raise ValueError(f"Failed to load Quill sequence: {scene_path}")
+    scene = read_scene_graph(path)
+    qbin_path = os.path.join(path, "Quill.qbin")
 
     # Filter out unwanted layers.
     if only_visible:
@@ -278,9 +321,16 @@ def import_scene(path, layer_types, only_visible=False, only_non_empty=False):
     if only_non_empty:
         delete_empty_groups(scene.sequence.root_layer)
 
+    # Find which drawings we actually need.
+    drawing_filter = None
+    if frame_range is not None:
+        ticks_per_second = 12600
+        ticks_per_frame = int(ticks_per_second / (scene.sequence.framerate or default_framerate))
+        drawing_filter = find_visible_drawings(scene.sequence.root_layer, ticks_per_frame, frame_range[0], frame_range[1])
+
     # Load the QBin data.
     qbin = open(qbin_path, "rb")
-    load_qbin_data(scene.sequence.root_layer, qbin)
+    load_qbin_data(scene.sequence.root_layer, qbin, drawing_filter)
     qbin.close()
     
     # Check for lipsync data.
@@ -291,12 +341,81 @@ def import_scene(path, layer_types, only_visible=False, only_non_empty=False):
     return scene
 
 
+def import_scene_partial(path, layer_drawings):
+    """
+    Load a Quill scene graph and only the data of some of its layers.
+
+    The whole graph is loaded but only the requested layers get their data from the qbin.
+    Group layers are ignored, their children must be requested explicitly.
+    This is used by the exporter to pick drawings from the original scenes without decoding everything.
+
+    :param path: Quill project folder.
+    :param layer_drawings: map from layer path to the set of drawing indices to load,
+        or None to load all the drawings of the layer.
+    """
+
+    scene = read_scene_graph(path)
+    qbin_path = os.path.join(path, "Quill.qbin")
+
+    # Resolve the requested layers.
+    layers = []
+    drawing_filter = {}
+    for layer_path, drawing_indices in layer_drawings.items():
+        layer = get_layer(scene, layer_path)
+        if layer is None or layer in layers:
+            continue
+
+        # Loading a group would load everything under it.
+        if layer.type == "Group":
+            continue
+
+        layers.append(layer)
+        if drawing_indices is not None:
+            drawing_filter[layer] = drawing_indices
+
+    # Load the QBin data of these layers only.
+    qbin = open(qbin_path, "rb")
+    for layer in layers:
+        load_qbin_data(layer, qbin, drawing_filter)
+    qbin.close()
+
+    return scene
+
+
+def read_scene_graph(path):
+    """Load the Quill scene graph from the Quill.json file of a project folder, without the qbin data."""
+
+    scene_path = os.path.join(path, "Quill.json")
+    qbin_path = os.path.join(path, "Quill.qbin")
+
+    # Check if the expected files exist.
+    if not os.path.exists(scene_path) or not os.path.exists(qbin_path):
+        raise FileNotFoundError(f"File not found.")
+
+    scene = None
+    try:
+        with open(scene_path) as f:
+            d = json.load(f)
+            scene = sequence.QuillScene.from_dict(d)
+            connect_parents(scene.sequence.root_layer)
+            scene.sequence.root_layer.build_layer_index()
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Failed to load JSON: {e}")
+    except:
+        raise ValueError(f"Failed to load Quill sequence: {scene_path}")
+
+    return scene
+
+
 def export_scene(folder_path, scene, state):
     """Write a Quill scene to a folder with a Quill.json, Quill.qbin, and State.json file."""
 
     # Write qbin file.
+    # Sounds and pictures may be copied from the qbin of the original scene,
+    # which can be the file we are replacing, so write to a temporary file first.
     qbin_path = os.path.join(folder_path, "Quill.qbin")
-    qbin = open(qbin_path, 'wb')
+    temp_path = qbin_path + ".tmp"
+    qbin = open(temp_path, 'wb')
 
     # Write the 8-byte header.
     qbin.write(struct.pack("<I", 0))
@@ -306,6 +425,7 @@ def export_scene(folder_path, scene, state):
     # This will also update the data_file_offset fields in the drawing data.
     write_qbin_data(scene.sequence.root_layer, qbin)
     qbin.close()
+    os.replace(temp_path, qbin_path)
 
     # Write the scene graph and application state files.
     write_json(scene.to_dict(), folder_path, "Quill.json")
@@ -320,7 +440,12 @@ def get_layer(scene, layer_path):
     # Remove empty and root parts.
     parts = parts[2:]
 
-    current_layer = scene.sequence.root_layer
+    # Loaded scenes have an index of the layers by path.
+    root_layer = scene.sequence.root_layer
+    if root_layer.layer_index is not None:
+        return root_layer.layer_index.get(tuple(parts))
+
+    current_layer = root_layer
     for part in parts:
         found = False
         if current_layer.type != "Group":
@@ -346,39 +471,46 @@ def connect_parents(layer_group):
 
 def find_last_visible_frame(layer, ticks_per_frame):
     """
-    Recursively find the last visible frame in the layer and its children.
+    Find the last frame showing new content in the layer and its children.
 
-    This is based on visibility keyframes (clips), not transform keyframes.
+    This is based on the visibility schedule of the layers (clips, offsets and looping),
+    not on transform keyframes. Layers that are never turned off contribute the end of
+    their base animation. Returns 0 if nothing is ever visible.
     """
 
-    # Find the last "visibility off" keyframe on this layer, if any.
-    kkvv = layer.animation.keys.visibility
-    last_kv_off = 0
-    if len(kkvv) > 0 and kkvv[-1].value == False:
-        last_kv_off = kkvv[-1].time
+    content_end = 0
+    schedules = schedule.compile_tree(layer, ticks_per_frame)
+    for child, segments in schedules.items():
+        if child.type == "Group":
+            continue
 
-    last_frame_layer = int(last_kv_off / ticks_per_frame)
+        content_end = max(content_end, schedule.get_content_end(child, segments, ticks_per_frame))
 
-    # If we are not a group we are done.
-    if layer.type != "Group":
-        return last_frame_layer
+    if content_end <= 0:
+        return 0
 
-    # If we are a group it's more subtle.
-    # None of the children are visible after the parent is hidden,
-    # but it's possible that all the children are hidden before the parent is hidden.
-    # In that case we need to find the last visible frame among the children.
-    last_frame_children = 0
-    for child in layer.implementation.children:
-        last_frame = find_last_visible_frame(child, ticks_per_frame)
-        if last_frame > last_frame_children:
-            last_frame_children = last_frame
-
-    if last_frame_layer == 0:
-        return last_frame_children
-    elif last_frame_children == 0:
-        return last_frame_layer
-    else:
-        return min(last_frame_layer, last_frame_children)
+    # The content end is exclusive, return the last frame starting before it.
+    return math.ceil(content_end / ticks_per_frame) - 1
+
+
+def find_visible_drawings(layer, ticks_per_frame, frame_start, frame_end):
+    """
+    Find the drawings of paint layers that are visible at some point between `frame_start` and `frame_end` (inclusive).
+
+    Returns a dictionary mapping paint layers to sets of drawing indices.
+    """
+
+    horizon = (frame_end + 1) * ticks_per_frame
+    schedules = schedule.compile_tree(layer, ticks_per_frame, horizon)
+
+    visible_drawings = {}
+    for child, segments in schedules.items():
+        if child.type != "Paint":
+            continue
+
+        visible_drawings[child] = schedule.get_visible_drawings(child, segments, frame_start, frame_end, ticks_per_frame)
+
+    return visible_drawings
 
 
 def bbox_empty():
@@ -0,0 +1,293 @@
+# Visibility schedule of layers over the Quill timeline.
+# These do not depend on any Blender data types.
+#
+# A schedule is the list of spans of global time during which a layer is visible,
+# together with the mapping from global time to the local time of the layer.
+# It is computed with interval arithmetic over the visibility keys (clips), offset keys
+# and loop durations of the layer and its whole lineage, without evaluating frames one by one.
+#
+# All times are expressed in ticks (12600 ticks per second).
+
+import math
+
+
+class Segment:
+    """
+    A span of global time [start, end) during which a layer is visible.
+
+    Within the span the local time of the layer advances with the global time,
+    starting at `local_start` and wrapping around `period` if the layer is looping.
+    `end` may be `math.inf` for layers that are never turned off.
+    `open` is set when the segment was cut short by the horizon or by the unrolling of
+    a looping parent, rather than by a visibility key: the layer doesn't turn off at `end`.
+    """
+
+    def __init__(self, start, end, local_start, period=0, open=False):
+        self.start = start
+        self.end = end
+        self.local_start = local_start
+        self.period = period
+        self.open = open
+
+    def __repr__(self):
+        return f"Segment({self.start}, {self.end}, {self.local_start}, {self.period}, {self.open})"
+
+    def local_time(self, global_time):
+        """Local time of the layer at `global_time`, which must be inside the segment."""
+        local_time = self.local_start + (global_time - self.start)
+        if self.period > 0:
+            local_time = local_time % self.period
+        return local_time
+
+
+def get_spans(layer):
+    """
+    Returns the visibility spans of the layer as a list of (start, end, offset) tuples.
+
+    Times are expressed in the local time of the parent layer.
+    Each span starts at a "visibility on" key and ends at the next visibility key.
+    The offset is the value of the offset key matching the in-point, if any (left-trim of clips).
+    """
+
+    kkvv = layer.animation.keys.visibility
+    kkoo = layer.animation.keys.offset
+
+    spans = []
+    for i in range(len(kkvv)):
+        if not kkvv[i].value:
+            continue
+
+        start = int(kkvv[i].time)
+        end = int(kkvv[i + 1].time) if i + 1 < len(kkvv) else math.inf
+        if end <= start:
+            continue
+
+        offset = 0
+        for key in kkoo:
+            if key.time == start:
+                offset = int(key.value)
+                break
+
+        spans.append((start, end, offset))
+
+    return spans
+
+
+def get_base_animation(layer, ticks_per_frame):
+    """
+    Returns (restart, period) for the base animation of the layer.
+
+    restart: whether clips restart the local time (paint layers and sequences),
+    as opposed to pure visibility spans (normal groups).
+    period: duration of the base animation if it is looping, 0 otherwise.
+    """
+
+    # Sequences define clips while groups define visibility spans.
+    restart = layer.type == "Paint" or layer.animation.timeline
+
+    # For sequence layers the base animation is defined by the loop point.
+    # For paint layers the base animation is the drawing sequence.
+    # TODO: handle max repeat count that's not 0 or 1, does Quill support this?
+    if layer.type == "Paint":
+        looping = layer.implementation.max_repeat_count == 0
+        duration = len(layer.implementation.frames) * ticks_per_frame
+    else:
+        looping = layer.animation.max_repeat_count == 0
+        duration = int(layer.animation.duration)
+
+    period = duration if looping and duration > 0 else 0
+    return restart, period
+
+
+def unwrap(segments, horizon=math.inf):
+    """
+    Split segments at the points where their local time wraps around.
+
+    Yields (start, end, local_start, open) tuples over which the local time is strictly increasing.
+    Segments are clipped to the horizon. Looping segments that are never turned off and
+    are not limited by a horizon are only unrolled until their content has played once in full,
+    the last piece is then marked open.
+    """
+
+    for segment in segments:
+        end = min(segment.end, horizon)
+        open = segment.open or end < segment.end
+        if segment.start >= end:
+            continue
+
+        if segment.period == 0:
+            yield segment.start, end, segment.local_start, open
+            continue
+
+        if end == math.inf:
+            end = segment.start + segment.period
+            open = True
+
+        start = segment.start
+        local_start = segment.local_start
+        while start < end:
+            wrap = start + (segment.period - local_start)
+            yield start, min(wrap, end), local_start, open and wrap >= end
+            start = wrap
+            local_start = 0
+
+
+def compile_segments(layer, parent_segments, ticks_per_frame, horizon=math.inf):
+    """
+    Compute the schedule of a layer from the schedule of its parent.
+
+    :param layer: the Quill layer.
+    :param parent_segments: schedule of the parent layer, the local time of the parent is the time of our keys.
+    :param ticks_per_frame: number of ticks per frame.
+    :param horizon: global time after which the schedule is not needed.
+    :return: list of segments sorted by start time.
+    """
+
+    spans = get_spans(layer)
+    restart, period = get_base_animation(layer, ticks_per_frame)
+
+    segments = []
+    for start, end, local_start, open in unwrap(parent_segments, horizon):
+        local_end = local_start + (end - start)
+        for span_start, span_end, offset in spans:
+
+            # Intersect the parent local time range with the span.
+            lo = max(span_start, local_start)
+            hi = min(span_end, local_end)
+            if lo >= hi:
+                continue
+
+            # Update the time to be relative to the start of the clip, taking offset into account.
+            local = lo - span_start + offset if restart else lo
+            if period > 0:
+                local = local % period
+
+            # The layer keeps being visible past the end of an open parent piece if the span does.
+            segment_open = open and hi == local_end and span_end > local_end
+            segments.append(Segment(start + (lo - local_start), start + (hi - local_start), local, period, segment_open))
+
+    return segments
+
+
+def root_segments():
+    """Schedule of the parent of the root layer: always visible, local time is global time."""
+    return [Segment(0, math.inf, 0)]
+
+
+def compile_layer(layer, ticks_per_frame, horizon=math.inf):
+    """Compute the schedule of a single layer, walking its lineage from the root down."""
+
+    stack = [layer]
+    parent = layer.parent
+    while parent is not None:
+        stack.append(parent)
+        parent = parent.parent
+
+    segments = root_segments()
+    for i in range(len(stack) - 1, -1, -1):
+        segments = compile_segments(stack[i], segments, ticks_per_frame, horizon)
+        if len(segments) == 0:
+            break
+
+    return segments
+
+
+def compile_tree(layer, ticks_per_frame, horizon=math.inf, parent_segments=None, schedules=None):
+    """
+    Compute the schedule of a layer and all its descendants in a single top-down pass.
+
+    Returns a dictionary mapping layers to their list of segments.
+    """
+
+    if schedules is None:
+        schedules = {}
+
+    if parent_segments is None:
+        parent_segments = root_segments()
+
+    segments = compile_segments(layer, parent_segments, ticks_per_frame, horizon)
+    schedules[layer] = segments
+
+    if layer.type == "Group":
+        for child in layer.implementation.children:
+            compile_tree(child, ticks_per_frame, horizon, segments, schedules)
+
+    return schedules
+
+
+def get_visible_range(segments):
+    """Returns the (start, end) global times of the visible range, or None if the layer is never visible."""
+    if len(segments) == 0:
+        return None
+
+    return min(s.start for s in segments), max(s.end for s in segments)
+
+
+def get_content_end(layer, segments, ticks_per_frame):
+    """
+    Returns the global time at which the layer stops showing new content, 0 if it's never visible.
+
+    For segments that are never turned off this is the time at which the base animation
+    has been played in full, after that it either loops or holds the last drawing.
+    """
+
+    content_end = 0
+    for segment in segments:
+        if segment.end != math.inf and not segment.open:
+            end = segment.end
+        else:
+            if segment.period > 0:
+                end = segment.start + segment.period
+            elif layer.type == "Paint":
+                duration = len(layer.implementation.frames) * ticks_per_frame
+                end = segment.start + max(ticks_per_frame, duration - segment.local_start)
+            else:
+                end = segment.start + ticks_per_frame
+
+            end = min(end, segment.end)
+
+        content_end = max(content_end, end)
+
+    return content_end
+
+
+def get_drawing_changes(layer, segments, frame_start, frame_end, ticks_per_frame):
+    """
+    Returns the list of (frame, drawing_index) at which the visible drawing of a paint layer changes.
+
+    The drawing index is -1 when the layer is hidden. The first frame of the range is always included.
+    Frames are evaluated directly from the segments without walking the lineage of the layer.
+    """
+
+    frames = layer.implementation.frames
+    if frames is None or len(frames) == 0:
+        return []
+
+    last_frame = len(frames) - 1
+    changes = []
+    active_drawing_index = None
+    i = 0
+    for frame in range(frame_start, frame_end + 1):
+        time = frame * ticks_per_frame
+
+        # Segments are sorted and don't overlap.
+        while i < len(segments) and segments[i].end <= time:
+            i += 1
+
+        drawing_index = -1
+        if i < len(segments) and segments[i].start <= time:
+            local_time = segments[i].local_time(time)
+            frame_source = min(int(local_time / ticks_per_frame), last_frame)
+            drawing_index = int(frames[frame_source])
+
+        if drawing_index != active_drawing_index:
+            changes.append((frame, drawing_index))
+            active_drawing_index = drawing_index
+
+    return changes
+
+
+def get_visible_drawings(layer, segments, frame_start, frame_end, ticks_per_frame):
+    """Returns the set of drawing indices of a paint layer that are visible at some point in the frame range."""
+    changes = get_drawing_changes(layer, segments, frame_start, frame_end, ticks_per_frame)
+    return set(drawing_index for _, drawing_index in changes if drawing_index != -1)
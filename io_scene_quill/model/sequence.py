@@ -532,6 +532,9 @@ class Layer:
         self.visible = visible
         self.parent = None
 
+        # On the root layer of a loaded scene: map from layer path to layer, see build_layer_index.
+        self.layer_index = None
+
     @staticmethod
     def from_dict(obj):
         assert isinstance(obj, dict)
@@ -634,6 +637,61 @@ class Layer:
         self.implementation.children.append(layer)
         layer.parent = self
 
+        # Keep the path index of the hierarchy up to date.
+        # Layers under a group shadowed by a sibling with the same name are not reachable.
+        root = self.get_root()
+        path = self.get_path()
+        if root.layer_index is not None and root.layer_index.get(path) is self:
+            root.index_layer(layer, path + (layer.name,))
+
+    def get_root(self):
+        layer = self
+        while layer.parent is not None:
+            layer = layer.parent
+        return layer
+
+    def get_path(self):
+        """Path of the layer as a tuple of layer names, starting below the root layer."""
+        names = []
+        layer = self
+        while layer.parent is not None:
+            names.append(layer.name)
+            layer = layer.parent
+        return tuple(reversed(names))
+
+    def build_layer_index(self):
+        """
+        Build the index of the layers of the hierarchy by path, on the root layer.
+        Paths are tuples of layer names, the root layer itself is at ().
+        """
+        self.layer_index = {(): self}
+        if self.type == "Group":
+            for child in self.implementation.children:
+                self.index_layer(child, (child.name,))
+
+    def index_layer(self, layer, path):
+        """Add a layer and its descendants to the index of this root layer."""
+
+        # Like a search by name, the first layer with a given path wins.
+        # The descendants of the other ones can't be reached.
+        if self.layer_index.setdefault(path, layer) is not layer:
+            return
+
+        if layer.type == "Group":
+            for child in layer.implementation.children:
+                self.index_layer(child, path + (child.name,))
+
+    def unindex_layer(self, layer, path):
+        """Remove a layer and its descendants from the index of this root layer."""
+
+        if self.layer_index.get(path) is not layer:
+            return
+
+        del self.layer_index[path]
+        if layer.type == "Group":
+            for child in layer.implementation.children:
+                self.unindex_layer(child, path + (child.name,))
+
 
 class Sequence:
     def __init__(self, background_color, camera_resolution, default_viewpoint, export_end, export_start, framerate, gallery, metadata, root_layer):
@@ -1,8 +1,11 @@
 # Qbin data used by sounds.
 # These do not depend on any Blender data types.
 
+import os
 import struct
-import wave
+
+# Size of the chunks when copying samples between files.
+CHUNK_SIZE = 1024 * 1024
 
 class SoundData:
     def __init__(self):
@@ -10,13 +13,36 @@ class SoundData:
         self.bits = 0
         self.rate = 0
         self.num_samples = 0
-        self.samples = []
+
+        # Samples can be held in memory, or left in the qbin file they were read from.
+        # In the later case `samples` is None and the samples are streamed from
+        # `path` at `samples_offset` when needed.
+        # `offset` is the start of the whole sound payload in that file, header included.
+        self.samples = None
+        self.path = None
+        self.offset = 0
+        self.samples_offset = 0
+
+    def get_samples_length(self):
+        """Size of the samples in bytes."""
+        return self.num_samples * int(self.num_channels * self.bits / 8)
+
+    def write_samples(self, file):
+        """Write the samples to the passed file object, streaming them from the qbin if needed."""
+
+        if self.samples is not None:
+            file.write(self.samples)
+            return
+
+        with open(self.path, "rb") as qbin:
+            copy_range(qbin, self.samples_offset, self.get_samples_length(), file)
 
 
 def read_sound_data(qbin):
     """Read sound data from the passed QBin file object."""
 
     data = SoundData()
+    offset = qbin.tell()
 
     # Based on piWave.cpp.
     # https://github.com/Immersive-Foundation/IMM/blob/main/code/libImmCore/src/libWave/piWave.cpp
@@ -31,10 +57,11 @@ def read_sound_data(qbin):
     data.rate = struct.unpack("<I", qbin.read(4))[0]
     data.num_samples = struct.unpack("<Q", qbin.read(8))[0]
 
-    # Read samples in a bytearray.
-    bytes_per_sample = int(data.num_channels * data.bits / 8)
-    total_bytes = data.num_samples * bytes_per_sample
-    data.samples = qbin.read(total_bytes)
+    # Don't read the samples, they can be large and are often not needed.
+    # Only record where they are in the file.
+    data.path = qbin.name
+    data.offset = offset
+    data.samples_offset = qbin.tell()
 
     return data
 
@@ -42,6 +69,14 @@ def read_sound_data(qbin):
 def write_sound_data(data:SoundData, qbin):
     """Write sound data to the passed QBin file object."""
 
+    if data.samples is None and data.path is not None:
+        # Passthrough: the sound comes unchanged from another qbin,
+        # copy the original payload as is, header included.
+        length = data.samples_offset - data.offset + data.get_samples_length()
+        with open(data.path, "rb") as src:
+            copy_range(src, data.offset, length, qbin)
+        return
+
     # version (4 bytes), unknown (2 bytes), num_channels (1 byte), bits (1 byte),
     # rate (4 bytes), num_samples (8 bytes), samples (num_samples * num_channels * bits/8 bytes).
     # version.
@@ -55,17 +90,70 @@ def write_sound_data(data:SoundData, qbin):
     qbin.write(struct.pack("<B", data.bits))
     qbin.write(struct.pack("<I", data.rate))
     qbin.write(struct.pack("<Q", data.num_samples))
-    qbin.write(data.samples)
+    data.write_samples(qbin)
 
 
 def export_sound_data(data:SoundData, path):
     """Write sound data to an external file (.wav)."""
-    # https://docs.python.org/3/library/wave.html
-    with wave.open(path, "wb") as wave_write:
-        wave_write.setnchannels(data.num_channels)
-        wave_write.setsampwidth(int(data.bits / 8))
-        wave_write.setframerate(data.rate)
-        wave_write.writeframes(data.samples)
+
+    # The samples are streamed from the qbin so we write the header ourselves
+    # instead of going through the wave module.
+    # http://soundfile.sapp.org/doc/WaveFormat/
+    length = data.get_samples_length()
+    block_align = int(data.num_channels * data.bits / 8)
+    byte_rate = data.rate * block_align
+    padding = length % 2
+
+    with open(path, "wb") as wav:
+        wav.write(b"RIFF")
+        wav.write(struct.pack("<I", 36 + length + padding))
+        wav.write(b"WAVE")
+
+        wav.write(b"fmt ")
+        wav.write(struct.pack("<IHHIIHH", 16, 1, data.num_channels, data.rate, byte_rate, block_align, data.bits))
+
+        wav.write(b"data")
+        wav.write(struct.pack("<I", length))
+        data.write_samples(wav)
+
+        # Chunks are word aligned.
+        if padding:
+            wav.write(b"\x00")
+
     return True
 
 
+def copy_range(src, offset, length, dst):
+    """
+    Copy `length` bytes at `offset` in the source file object to the current position of the destination file object.
+    Uses copy_file_range when available so the data doesn't go through Python, otherwise copies in chunks.
+    """
+
+    dst.flush()
+    dst_offset = dst.tell()
+    copied = 0
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < length:
+                count = os.copy_file_range(src.fileno(), dst.fileno(), length - copied, offset + copied, dst_offset + copied)
+                if count == 0:
+                    break
+                copied += count
+        except OSError:
+            # Not supported between these files (e.g. different file systems), finish with the fallback.
+            pass
+
+        dst.seek(dst_offset + copied)
+
+    src.seek(offset + copied)
+    while copied < length:
+        chunk = src.read(min(CHUNK_SIZE, length - copied))
+        if not chunk:
+            break
+        dst.write(chunk)
+        copied += len(chunk)
+
+    return copied
+
+
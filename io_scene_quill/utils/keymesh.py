@@ -33,12 +33,14 @@ def keymesh_init(obj):
     obj.keymesh.property_overridable_library_set('["Keymesh Data"]', True)
 
 
-def keymesh_import(parent_obj, drawing_objs):
+def keymesh_import(parent_obj, drawing_to_obj):
     """
-    Inserts Keymesh blocks for each object in `drawing_objs` and delete the original objects afterwards.
+    Inserts Keymesh blocks for each object in `drawing_to_obj` and delete the original objects afterwards.
+
+    The block "Data" value is the index of the drawing in Quill, so drawings that
+    were not imported leave a gap in the values.
     """
-    index = 0
-    for obj in drawing_objs:
+    for index, obj in drawing_to_obj.items():
         # Keymesh properties.
         block = obj.data
         block.keymesh["ID"] = parent_obj.keymesh["ID"]
@@ -50,16 +52,14 @@ def keymesh_import(parent_obj, drawing_objs):
         block_registry.block = block
         block_registry.name = obj.name
 
-        index += 1
-
     # Delete the individual drawing objects since their data is now in Keymesh blocks.
-    for obj in drawing_objs:
+    for obj in drawing_to_obj.values():
         bpy.data.objects.remove(obj)
 
 
 def keymesh_get_blank(parent_obj):
     """
-    Get the index of the blank block, create it if it doesn't exist.
+    Get the "Data" value of the blank block, create it if it doesn't exist.
     """
 
     # Check if the blank block has already been added.
@@ -68,9 +68,10 @@ def keymesh_get_blank(parent_obj):
         last_block_registry = parent_obj.keymesh.blocks[-1]
         last_block = last_block_registry.block
         if last_block.quill.drawing_index == -1:
-            return len(parent_obj.keymesh.blocks) - 1
+            return last_block.keymesh["Data"]
 
-    index = len(parent_obj.keymesh.blocks)
+    # Use a value past all the drawings, there may be gaps if not all drawings were imported.
+    index = 1 + max((block_registry.block.keymesh["Data"] for block_registry in parent_obj.keymesh.blocks), default=-1)
 
     # Create a new mesh object to hold the blank block.
     mesh = bpy.data.meshes.new(name=f"{parent_obj.name}_blank")
@@ -107,7 +108,7 @@ def keymesh_keyframe(parent_obj, frame, index):
     # of the Keymesh add-on.
 
     # Select the block corresponding to the drawing we want to show.
-    # Since we are still in the setup phase we know the block index matches the drawing index.
+    # Since we are still in the setup phase we know the block "Data" value matches the drawing index.
     # After that drawings can be rearranged in the frame picker.
     parent_obj.keymesh["Keymesh Data"] = int(index)
 
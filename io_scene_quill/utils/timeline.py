@@ -43,3 +43,18 @@ def get_fcurve(obj, path: str):
         for fcurve in obj.animation_data.action.fcurves:
             if fcurve.data_path == path:
                 return fcurve
+
+
+def get_fcurves(data_block):
+    """Returns the list of f-curves of the action of a given ID, empty if there is none."""
+
+    if not data_block.animation_data or not data_block.animation_data.action:
+        return []
+
+    if bpy.app.version >= (5, 0, 0):
+        channelbag = ensure_channelbag(data_block)
+        if channelbag is None:
+            return []
+        return list(channelbag.fcurves)
+    else:
+        return list(data_block.animation_data.action.fcurves)
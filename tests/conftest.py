@@ -0,0 +1,9 @@
+import os
+import sys
+import types
+
+# The add-on __init__ registers the Blender operators and needs bpy.
+# The modules tested here don't depend on Blender, so the package is loaded without running it.
+package = types.ModuleType("io_scene_quill")
+package.__path__ = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "io_scene_quill")]
+sys.modules.setdefault("io_scene_quill", package)
@@ -0,0 +1,47 @@
+import types
+
+import numpy as np
+
+from io_scene_quill.exporters import animation
+
+
+def make_transforms(angles):
+    """Transforms rotating around Y, stored with w >= 0 like Matrix.decompose."""
+    transforms = []
+    for angle in angles:
+        rotation = np.array([0.0, np.sin(angle / 2), 0.0, np.cos(angle / 2)])
+        if rotation[3] < 0:
+            rotation = -rotation
+        transforms.append(types.SimpleNamespace(translation=[0.0, 0.0, 0.0], rotation=rotation.tolist(), scale=1.0))
+    return transforms
+
+
+def test_spin_longer_than_half_turn():
+    # Linear turntable, a full turn over 100 frames.
+    angles = np.radians(np.arange(101) * 3.6)
+    transforms = make_transforms(angles)
+    tolerances = (0.001, np.radians(0.1), 0.001)
+
+    translations, rotations, scales = animation.get_arrays(transforms)
+    keys = animation.reduce(translations, rotations, scales, tolerances)
+
+    # Replay the key frames from the stored quaternions, along the shortest path like Quill.
+    for (i, interpolation), (j, _) in zip(keys, keys[1:]):
+        q0 = np.array(transforms[i].rotation)
+        q1 = np.array(transforms[j].rotation)
+        if np.dot(q0, q1) < 0:
+            q1 = -q1
+
+        if interpolation == "None":
+            replayed = np.broadcast_to(q0, (j - i, 4))
+            expected = np.array([t.rotation for t in transforms[i:j]])
+        else:
+            u = animation.EASINGS[interpolation](np.arange(0, j - i + 1) / (j - i))
+            replayed = animation.slerp(q0, q1, u)
+            expected = np.array([t.rotation for t in transforms[i:j + 1]])
+
+        assert np.all(animation.rotation_errors(replayed, expected) <= tolerances[1] + 1e-9)
+
+        # The key frames don't store the direction of the turn, runs must turn less than half a turn.
+        if interpolation != "None":
+            assert angles[j] - angles[i] < np.pi
@@ -0,0 +1,31 @@
+from io_scene_quill.model import quill_utils
+
+
+def make_scene(folder):
+    """Save a scene with a group holding two paint layers of three drawings each."""
+    scene = quill_utils.create_scene()
+    group = quill_utils.create_group_layer("Group")
+    scene.sequence.root_layer.add_child(group)
+    for name in ("A", "B"):
+        layer = quill_utils.create_paint_layer(name)
+        group.add_child(layer)
+        for i in range(3):
+            layer.implementation.drawings.append(quill_utils.create_drawing())
+
+    quill_utils.export_scene(str(folder), scene, quill_utils.create_state())
+
+
+def test_partial_load_only_requested_drawings(tmp_path):
+    make_scene(tmp_path)
+
+    # Groups are requested too, like the Empties of an imported scene.
+    scene = quill_utils.import_scene_partial(str(tmp_path), {
+        "/Root": set(),
+        "/Root/Group": set(),
+        "/Root/Group/A": {0, 2},
+    })
+
+    a = quill_utils.get_layer(scene, "/Root/Group/A")
+    b = quill_utils.get_layer(scene, "/Root/Group/B")
+    assert [drawing.data is not None for drawing in a.implementation.drawings] == [True, False, True]
+    assert all(drawing.data is None for drawing in b.implementation.drawings)